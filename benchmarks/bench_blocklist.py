@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for IP blocklist lookups.
+
+Builds blocklists of 10, 1k and 100k random IPv4 and IPv6 networks with
+realistic prefix lengths and times membership tests of random addresses
+with the original linear scan over the network list and with IPBlocklist.
+
+Run with: PYTHONPATH=. python benchmarks/bench_blocklist.py
+"""
+import ipaddress
+import random
+import time
+
+from plugins.title_plugin import IPBlocklist
+
+V4_LENGTHS = [8, 12, 16, 20, 22, 24, 24, 24, 28, 32]
+V6_LENGTHS = [10, 32, 44, 48, 48, 56, 64, 64, 128]
+
+
+def make_networks(count, rng):
+    networks = []
+    for i in range(count):
+        if i % 4 == 3:
+            networks.append(ipaddress.IPv6Network(
+                (rng.getrandbits(128), rng.choice(V6_LENGTHS)), strict=False))
+        else:
+            networks.append(ipaddress.IPv4Network(
+                (rng.getrandbits(32), rng.choice(V4_LENGTHS)), strict=False))
+    return networks
+
+
+def make_addresses(count, rng):
+    return [ipaddress.IPv4Address(rng.getrandbits(32)) if i % 4 != 3
+            else ipaddress.IPv6Address(rng.getrandbits(128))
+            for i in range(count)]
+
+
+def linear(networks, address):
+    """The check shipped before IPBlocklist."""
+    for network in networks:
+        if address in network:
+            return True
+    return False
+
+
+def timed(function, addresses):
+    started = time.perf_counter()
+    blocked = sum(1 for address in addresses if function(address))
+    elapsed = time.perf_counter() - started
+    return blocked / len(addresses), elapsed / len(addresses)
+
+
+def main(lookups=20000):
+    rng = random.Random(0)
+    addresses = make_addresses(lookups, rng)
+    print(f"{'networks':>9} {'method':>9} {'build ms':>9} {'blocked':>8} "
+          f"{'us/lookup':>10}")
+    for count in (10, 1000, 100000):
+        networks = make_networks(count, rng)
+        started = time.perf_counter()
+        blocklist = IPBlocklist(networks)
+        build = time.perf_counter() - started
+        # The linear scan is too slow to run every address at 100k
+        sample = addresses[:max(200, lookups * 10 // count)]
+        for name, function, checked, build_time in (
+                ("linear", lambda a: linear(networks, a), sample, 0.0),
+                ("indexed", blocklist.__contains__, addresses, build)):
+            blocked, seconds = timed(function, checked)
+            print(f"{count:>9} {name:>9} {build_time * 1000:>9.1f} "
+                  f"{blocked:>8.1%} {seconds * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
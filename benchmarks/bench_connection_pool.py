@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the title plugin's HTTP connection pool.
+
+Starts a local HTTPS server with a throwaway self-signed certificate and
+fetches a small page from it repeatedly, once with the plugin's
+persistent TitleConnectionPool and once with a non-persistent pool that
+opens a new TCP+TLS connection per request.
+
+Run with: PYTHONPATH=. python benchmarks/bench_connection_pool.py
+"""
+import datetime
+import time
+
+import treq
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from twisted.internet import defer, ssl, task
+from twisted.web import resource, server
+from twisted.web.client import Agent, HTTPConnectionPool
+from twisted.web.iweb import IPolicyForHTTPS
+from zope.interface import implementer
+
+from plugins.title_plugin import TitleConnectionPool
+
+PAGE = b"<html><head><title>Benchmark</title></head><body></body></html>"
+
+
+class Page(resource.Resource):
+    isLeaf = True
+
+    def render_GET(self, request):
+        request.setHeader(b"content-type", b"text/html")
+        return PAGE
+
+
+def self_signed():
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder()
+            .subject_name(name).issuer_name(name)
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(days=1))
+            .not_valid_after(now + datetime.timedelta(days=1))
+            .add_extension(x509.SubjectAlternativeName(
+                [x509.DNSName("localhost")]), critical=False)
+            .add_extension(x509.BasicConstraints(ca=True, path_length=None),
+                           critical=True)
+            .sign(key, hashes.SHA256()))
+    key_pem = key.private_bytes(serialization.Encoding.PEM,
+                                serialization.PrivateFormat.PKCS8,
+                                serialization.NoEncryption())
+    cert_pem = cert.public_bytes(serialization.Encoding.PEM)
+    return ssl.PrivateCertificate.loadPEM(key_pem + cert_pem)
+
+
+@implementer(IPolicyForHTTPS)
+class TrustCertificate(object):
+    def __init__(self, certificate):
+        self.certificate = certificate
+
+    def creatorForNetloc(self, hostname, port):
+        return ssl.optionsForClientTLS(hostname.decode("ascii"),
+                                       trustRoot=self.certificate)
+
+
+async def fetch_all(reactor, url, pool, policy, count):
+    client = treq.client.HTTPClient(Agent(reactor, contextFactory=policy,
+                                          pool=pool))
+    started = time.perf_counter()
+    for _ in range(count):
+        response = await client.get(url)
+        await response.content()
+    return time.perf_counter() - started
+
+
+async def run(reactor, count):
+    certificate = self_signed()
+    port = reactor.listenSSL(0, server.Site(Page()),
+                             certificate.options(), interface="127.0.0.1")
+    url = f"https://localhost:{port.getHost().port}/"
+    policy = TrustCertificate(certificate)
+    print(f"{count} sequential GETs of {url}")
+    print(f"{'pool':>12} {'total ms':>10} {'ms/request':>12}")
+    pools = [("per-request", HTTPConnectionPool(reactor, persistent=False)),
+             ("persistent", TitleConnectionPool(reactor))]
+    for name, pool in pools:
+        elapsed = await fetch_all(reactor, url, pool, policy, count)
+        print(f"{name:>12} {elapsed * 1000:>10.1f} "
+              f"{elapsed / count * 1000:>12.2f}")
+        await pool.closeCachedConnections()
+    print("persistent pool host stats:", pools[1][1].stats())
+    await port.stopListening()
+
+
+def main(reactor, count=200):
+    return defer.ensureDeferred(run(reactor, count))
+
+
+if __name__ == "__main__":
+    task.react(main)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for plugin event dispatch.
+
+Measures NanoBotProtocol._dispatch_event throughput with 1, 10 and 100
+registered privmsg handlers, both unfiltered (every handler is called)
+and with prefix filters that only one handler matches, with handler
+statistics disabled and enabled.
+
+Run with: PYTHONPATH=. python benchmarks/bench_dispatch.py
+"""
+import timeit
+
+from twisted.internet import task
+
+import nanobot
+from plugin import PluginRegistry
+
+
+class Bot:
+    nickname = "bench"
+    realname = "bench"
+
+
+class Server:
+    hostname = "irc.example.com"
+    channels = []
+    network_config = {}
+
+
+def make_protocol(count, filtered, stats):
+    clock = task.Clock()
+    bot = Bot()
+    bot.plugin_registry = PluginRegistry(clock, {})
+    if stats:
+        bot.plugin_registry.enable_stats()
+    for i in range(count):
+        # Distinct function objects, as registered by distinct plugins
+        def each(protocol, user, channel, message):
+            pass
+        if filtered:
+            bot.plugin_registry.register_handler('privmsg', each,
+                                                 prefix=f"!cmd{i} ")
+        else:
+            bot.plugin_registry.register_handler('privmsg', each)
+    protocol = nanobot.NanoBotProtocol(clock, Server(), bot)
+    protocol.nickname = "bench"
+    return protocol
+
+
+def main(number=20000):
+    print(f"{'handlers':>8} {'filters':>8} {'stats':>6} {'events/s':>12} "
+          f"{'us/event':>10}")
+    for count in (1, 10, 100):
+        for filtered in (False, True):
+            for stats in (False, True):
+                protocol = make_protocol(count, filtered, stats)
+                dispatch = protocol._dispatch_event
+                args = ("nick!user@host", "#chan", "!cmd0 some arguments")
+                seconds = min(timeit.repeat(
+                    lambda: dispatch('privmsg', *args), number=number,
+                    repeat=3))
+                print(f"{count:>8} {'prefix' if filtered else 'none':>8} "
+                      f"{'on' if stats else 'off':>6} "
+                      f"{number / seconds:>12.0f} "
+                      f"{seconds / number * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the title-vs-URL similarity check.
+
+Times dynsearch on URLs with many path segments, once with titles that
+resemble the end of the path and once with unrelated titles, comparing
+the original recursive implementation with the iterative one.
+
+Run with: PYTHONPATH=. python benchmarks/bench_dynsearch.py
+"""
+import random
+import time
+
+import Levenshtein
+
+from plugins.title_plugin import dynsearch, prepare_title, prepare_url
+
+
+def legacy_difference_check(a, s):
+    if len(a) < 14 or len(s) < 14:
+        if len(a) != len(s):
+            return True
+        else:
+            return a != s
+    else:
+        return Levenshtein.distance(a, s) >= 7
+
+
+def legacy_dynsearch(l, s):
+    """The implementation shipped before the iterative one."""
+    a, b = l[0], l[1:]
+    if not b:
+        return legacy_difference_check(a, s)
+    else:
+        if not legacy_dynsearch(b, s):
+            return False
+        else:
+            return legacy_difference_check("".join(b), s)
+
+
+def make_cases(segments, count, related, rng):
+    words = ["news", "article", "python", "twisted", "release", "notes",
+             "archive", "2024", "category", "tutorial", "deep", "dive"]
+    cases = []
+    for _ in range(count):
+        path = "/".join("-".join(rng.choice(words)
+                                 for _ in range(rng.randint(1, 4)))
+                        for _ in range(segments))
+        url = f"https://example.com/{path}"
+        if related:
+            title = path.rsplit("/", 1)[1].replace("-", " ").title()
+        else:
+            title = " ".join(rng.choice(words) for _ in range(6)).title()
+        cases.append((prepare_url(url), prepare_title(title)))
+    return cases
+
+
+def timed(function, cases, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        results = [function(l, s) for l, s in cases]
+        elapsed = (time.perf_counter() - started) / len(cases)
+        best = elapsed if best is None else min(best, elapsed)
+    return results, best
+
+
+def main(count=2000):
+    rng = random.Random(0)
+    print(f"{'segments':>9} {'titles':>10} {'recursive us':>13} "
+          f"{'iterative us':>13}")
+    for segments in (4, 16, 64, 256):
+        for related in (True, False):
+            cases = make_cases(segments, count, related, rng)
+            legacy, legacy_time = timed(legacy_dynsearch, cases)
+            current, current_time = timed(dynsearch, cases)
+            assert legacy == current
+            print(f"{segments:>9} {'related' if related else 'unrelated':>10} "
+                  f"{legacy_time * 1e6:>13.2f} {current_time * 1e6:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
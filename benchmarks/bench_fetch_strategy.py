@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the title plugin's fetch strategies.
+
+Serves a mix of large HTML pages and binary files from a local HTTP
+server that honours Range and HEAD, fetches every URL with each strategy
+and reports the bytes the server had to send alongside the handler's own
+per-strategy counters.
+
+Run with: PYTHONPATH=. python benchmarks/bench_fetch_strategy.py
+"""
+import os
+import tempfile
+import time
+
+import lxml.html
+from twisted.internet import defer, task
+from twisted.protocols import policies
+from twisted.web import server, static
+from twisted.web.client import HTTPConnectionPool
+
+from plugins.title_plugin import AppException, FetchStats, UrlHandler
+
+
+class CountingProtocol(policies.ProtocolWrapper):
+    def write(self, data):
+        self.factory.sent += len(data)
+        policies.ProtocolWrapper.write(self, data)
+
+    def writeSequence(self, data):
+        self.factory.sent += sum(len(chunk) for chunk in data)
+        policies.ProtocolWrapper.writeSequence(self, data)
+
+
+class CountingFactory(policies.WrappingFactory):
+    protocol = CountingProtocol
+
+    def __init__(self, wrappedFactory):
+        policies.WrappingFactory.__init__(self, wrappedFactory)
+        self.sent = 0
+
+
+def make_files(directory, pages, binaries):
+    row = b"<div class='row'><a href='/item'>item</a> <span>text</span></div>\n"
+    names = []
+    for i in range(pages):
+        name = f"page{i}.html"
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(b"<html><head><title>Page %d</title></head><body>" % i)
+            f.write(row * 4000)
+        names.append(name)
+    for i in range(binaries):
+        name = f"video{i}.mp4"
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(os.urandom(4 * 1024 ** 2))
+        names.append(name)
+    return names
+
+
+async def fetch_all(urls, strategy, pool, stats):
+    for url in urls:
+        handler = UrlHandler(max_body=2 * 1024 ** 2,
+                             parser_class=lxml.html.HTMLParser,
+                             pool=pool, strategy=strategy, fetch_stats=stats)
+        try:
+            await handler.get_title(url)
+        except AppException:
+            pass
+
+
+async def run(reactor, pages, binaries):
+    with tempfile.TemporaryDirectory() as directory:
+        names = make_files(directory, pages, binaries)
+        root = static.File(directory)
+        root.contentTypes[".mp4"] = "video/mp4"
+        factory = CountingFactory(server.Site(root))
+        port = reactor.listenTCP(0, factory, interface="127.0.0.1")
+        base = f"http://127.0.0.1:{port.getHost().port}/"
+        urls = [base + name for name in names]
+        print(f"{pages} HTML pages of ~260 KB, {binaries} binaries of 4 MB")
+        print(f"{'strategy':>8} {'server KB':>10} {'read KB':>10} "
+              f"{'requests':>9} {'rejected':>9} {'ms':>8}")
+        for strategy in UrlHandler.STRATEGIES:
+            pool = HTTPConnectionPool(reactor, persistent=False)
+            stats = FetchStats()
+            factory.sent = 0
+            started = time.perf_counter()
+            await fetch_all(urls, strategy, pool, stats)
+            elapsed = time.perf_counter() - started
+            # Let aborted transfers drain before reading the counter
+            await task.deferLater(reactor, 0.5, lambda: None)
+            counters = stats.stats()[strategy]
+            print(f"{strategy:>8} {factory.sent // 1024:>10} "
+                  f"{counters['bytes'] // 1024:>10} "
+                  f"{counters['requests']:>9} {counters['rejected']:>9} "
+                  f"{elapsed * 1000:>8.1f}")
+        await port.stopListening()
+
+
+def main(reactor, pages=20, binaries=5):
+    return defer.ensureDeferred(run(reactor, pages, binaries))
+
+
+if __name__ == "__main__":
+    task.react(main)
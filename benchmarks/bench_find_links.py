@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for URL extraction from channel messages.
+
+Every privmsg in every channel goes through the title plugin's URL
+extraction. This replays a channel log, synthetic by default with about
+one message in twenty carrying links, IRC formatting and punctuation,
+and compares the previous per-message re.finditer over an uncompiled
+pattern with extract_urls. Pass a plain-text log file to replay real
+traffic.
+
+Run with: PYTHONPATH=. python benchmarks/bench_find_links.py [LOG]
+"""
+import random
+import re
+import sys
+import time
+
+from plugins.title_plugin import extract_urls, trim_url
+
+WORDS = ["the", "build", "is", "green", "again", "anyone", "seen", "this",
+         "lol", "merge", "it", "tomorrow", "ok", "thanks", "review", "please"]
+
+
+def legacy_extract(message):
+    """The extraction find_links did before the precompiled extractor."""
+    return [trim_url(m.group(0))
+            for m in re.finditer("(https?://[^ ]+)", message)]
+
+
+def synthetic_log(lines, seed=0):
+    rng = random.Random(seed)
+    log = []
+    for _ in range(lines):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 25)))
+        if rng.random() < 0.05:
+            url = (f"https://example.com/{rng.choice(WORDS)}/"
+                   f"{rng.randint(1, 9999)}")
+            template = rng.choice(["{}", "<{}>", "({})", "{}.",
+                                   "\x02{}\x02"])
+            url = template.format(url)
+            text = f"{text} {url}"
+        log.append(text)
+    return log
+
+
+def timed(function, log, repeat=5):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        found = sum(len(function(message)) for message in log)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return found, best / len(log)
+
+
+def main(argv):
+    if len(argv) > 1:
+        with open(argv[1], encoding="utf-8", errors="replace") as f:
+            log = f.read().splitlines()
+        source = argv[1]
+    else:
+        log = synthetic_log(500000)
+        source = "synthetic log"
+    print(f"{len(log)} messages from {source}")
+    print(f"{'extractor':>10} {'urls':>7} {'ns/message':>11}")
+    for name, function in (("legacy", legacy_extract),
+                           ("compiled", extract_urls)):
+        found, seconds = timed(function, log)
+        print(f"{name:>10} {found:>7} {seconds * 1e9:>11.1f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark for simple_eval.
+
+Compares the original postfix interpreter (re-tokenizing on every call)
+with the cached compiled path on short and long expressions.
+
+Run with: PYTHONPATH=. python benchmarks/bench_simple_eval.py
+"""
+import itertools
+import timeit
+
+import simple_eval
+from simple_eval import (BOOL_SYNTAX, BOOL_NOT, BOOL_AND, BOOL_OR,
+                         WHITESPACE, EvalError, boolify, tokenize,
+                         infix_to_postfix)
+
+
+def legacy_eval_bool(input, truths):
+    """The interpreter eval_bool shipped before compilation was added."""
+    stack = []
+    tokens = tokenize(input, BOOL_SYNTAX, WHITESPACE)
+    tokens = infix_to_postfix(tokens, BOOL_SYNTAX)
+    for pos, token in tokens:
+        if token == BOOL_NOT:
+            try:
+                pos_sym, sym = stack.pop()
+            except IndexError:
+                raise EvalError(pos, token)
+            stack.append((pos_sym, not boolify(sym, truths)))
+        elif token in BOOL_SYNTAX:
+            try:
+                pos_a, a = stack.pop()
+                pos_b, b = stack.pop()
+            except IndexError:
+                raise EvalError(pos, token)
+            if a in BOOL_SYNTAX or b in BOOL_SYNTAX:
+                raise EvalError(pos, token)
+            a = boolify(a, truths)
+            b = boolify(b, truths)
+            if token == BOOL_AND:
+                stack.append((pos_a, a and b))
+            elif token == BOOL_OR:
+                stack.append((pos_a, a or b))
+            else:
+                raise EvalError(pos, token)
+        else:
+            stack.append((pos, token))
+    pos, token = stack.pop()
+    if stack:
+        raise EvalError(pos, token)
+    return boolify(token, truths)
+
+
+def long_expression(tokens):
+    """Build a left-nested expression of roughly the given token count."""
+    names = ("alpha", "beta", "gamma", "delta", "epsilon")
+    ops = itertools.cycle((BOOL_AND, BOOL_OR))
+    expr = names[0]
+    count = 1
+    for name in itertools.cycle(names[1:]):
+        if count >= tokens:
+            break
+        expr = f"({expr}{next(ops)}~{name})"
+        count += 6
+    return expr, count
+
+
+def bench(label, func, expr, truths, number):
+    seconds = min(timeit.repeat(lambda: func(expr, truths),
+                                number=number, repeat=3))
+    print(f"{label:<32} {seconds / number * 1e6:12.2f} us/call")
+    return seconds
+
+
+def main():
+    truths = ["alpha", "gamma", "foo"]
+    cases = [("short", "~(foo&bar)|(foo&~bar)", 20000)]
+    expr, count = long_expression(10000)
+    cases.append((f"long ({count} tokens)", expr, 20))
+    cases.append((f"decided left operand ({count + 2} tokens)",
+                  f"bar&{expr}", 20))
+    for name, expr, number in cases:
+        assert legacy_eval_bool(expr, truths) == simple_eval.eval_bool(
+            expr, truths)
+        print(f"{name}:")
+        legacy = bench("  legacy eval_bool", legacy_eval_bool,
+                       expr, truths, number)
+        simple_eval._compile_cached.cache_clear()
+        bench("  compile (uncached)",
+              lambda e, t: simple_eval._compile(e),
+              expr, truths, number)
+        bench("  eval_bool (cached compile)", simple_eval.eval_bool,
+              expr, truths, number)
+        compiled = simple_eval.compile_bool(expr)
+        truth_set = frozenset(truths)
+        fast = bench("  CompiledBool.evaluate",
+                     lambda e, t: compiled.evaluate(t),
+                     expr, truth_set, number)
+        print(f"  speedup vs legacy: {legacy / fast:.1f}x")
+    bench_batch()
+
+
+def bench_batch(rows=10000):
+    import random
+    random.seed(0)
+    columns = ["foo", "bar", "baz"]
+    matrix = [[random.random() < 0.5 for _ in columns] for _ in range(rows)]
+    expr = "(foo&~bar)|baz"
+    print(f"batch ({rows} assignments):")
+
+    def loop(expr, matrix):
+        return [simple_eval.eval_bool(
+                    expr, [c for c, v in zip(columns, row) if v])
+                for row in matrix]
+
+    bench("  eval_bool loop", loop, expr, matrix, 3)
+    compiled = simple_eval.compile_bool(expr)
+    bench("  evaluate_rows (pure Python)",
+          lambda e, m: compiled.evaluate_rows(m, columns), expr, matrix, 3)
+    if simple_eval.numpy is not None:
+        array = simple_eval.numpy.array(matrix)
+        bench("  eval_bool_batch (NumPy)",
+              lambda e, m: simple_eval.eval_bool_batch(e, m, columns),
+              expr, array, 3)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for IRC process startup with plugins.
+
+Launches a fresh Python process that loads all bundled plugins, connects
+to a minimal local IRC server and exits on signedOn. Reports the time
+from process launch to signedOn with eager and with lazy plugin loading.
+
+Run with: PYTHONPATH=. python benchmarks/bench_startup.py
+"""
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+PLUGINS = [
+    {"name": "example", "module": "plugins.example_plugin",
+     "handles": [{"event": "privmsg"}, {"event": "user_joined"},
+                 {"event": "signed_on"}],
+     "preload": False},
+    {"name": "eval", "module": "plugins.eval_plugin",
+     "handles": [{"event": "privmsg", "prefix": "!eval "}]},
+    {"name": "admin", "module": "plugins.admin_plugin",
+     "handles": [{"event": "privmsg",
+                  "prefix": ["!reincarnate", "!join", "!leave", "!stats",
+                             "!reload"]}]},
+    {"name": "title", "module": "plugins.title_plugin",
+     "handles": [{"event": "privmsg", "regex": "https?://"}]},
+]
+
+CHILD = """
+import sys
+from twisted.internet import reactor
+import nanobot
+from plugin import PluginRegistry
+
+
+class Bot:
+    nickname = "bench"
+    realname = "bench"
+
+
+class Protocol(nanobot.NanoBotProtocol):
+    def signedOn(self):
+        nanobot.NanoBotProtocol.signedOn(self)
+        print("signed on", flush=True)
+        reactor.stop()
+
+
+bot = Bot()
+bot.plugin_registry = PluginRegistry(reactor, {{}})
+bot.plugin_registry.load_plugins({plugins!r})
+factory = nanobot.ServerConnection(
+    reactor, {{"name": "bench", "hostname": "127.0.0.1", "port": {port}}}, bot)
+factory.protocol = Protocol
+factory.connect()
+reactor.run()
+"""
+
+
+def serve(listener):
+    """Accept connections and welcome each client once it registers."""
+    while True:
+        try:
+            conn, _ = listener.accept()
+        except OSError:
+            return
+        with conn:
+            data = b""
+            while b"USER" not in data:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+            conn.sendall(b":bench.local 001 bench :Welcome\r\n")
+            conn.recv(4096)
+
+
+def launch(port, lazy):
+    plugins = [dict(plugin, lazy=lazy) for plugin in PLUGINS]
+    code = CHILD.format(plugins=plugins, port=port)
+    env = dict(os.environ, PYTHONPATH=os.getcwd())
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", code], env=env,
+                            capture_output=True, text=True, timeout=60)
+    elapsed = time.perf_counter() - started
+    if "signed on" not in output.stdout:
+        raise RuntimeError(output.stderr)
+    return elapsed
+
+
+def main(repeat=5):
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(5)
+    port = listener.getsockname()[1]
+    threading.Thread(target=serve, args=(listener,), daemon=True).start()
+    print(f"{'mode':>6} {'best ms':>10} {'mean ms':>10}")
+    for lazy in (False, True):
+        times = [launch(port, lazy) for _ in range(repeat)]
+        print(f"{'lazy' if lazy else 'eager':>6} {min(times) * 1000:>10.1f} "
+              f"{sum(times) / len(times) * 1000:>10.1f}")
+    listener.close()
+
+
+if __name__ == "__main__":
+    main()
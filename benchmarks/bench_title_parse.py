@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for title extraction from large pages.
+
+Builds synthetic multi-megabyte HTML pages with the title in the head and
+delivers them in 64 KB chunks, comparing the original approach (parse the
+whole body, then query //title) with the streaming target parser that
+stops reading at </title>.
+
+Run with: PYTHONPATH=. python benchmarks/bench_title_parse.py
+"""
+import time
+
+import lxml.html
+from twisted.internet import defer
+
+from plugins.title_plugin import UrlHandler
+
+CHUNK = 64 * 1024
+
+
+class Headers(object):
+    def getRawHeaders(self, key):
+        return ["text/html; charset=utf-8"]
+
+
+class Response(object):
+    """Response that stops delivering chunks once the collector raises."""
+
+    code = 200
+    headers = Headers()
+
+    def __init__(self, body):
+        self.body = body
+        self.delivered = 0
+
+    def collect(self, collector):
+        for start in range(0, len(self.body), CHUNK):
+            chunk = self.body[start:start + CHUNK]
+            self.delivered += len(chunk)
+            try:
+                collector(chunk)
+            except Exception:
+                return defer.fail()
+        return defer.succeed(None)
+
+
+def make_page(size):
+    head = (b"<!DOCTYPE html><html><head><meta charset='utf-8'>"
+            b"<title>Synthetic benchmark page</title>"
+            b"<link rel='stylesheet' href='/style.css'></head><body>")
+    row = b"<div class='row'><a href='/item'>item</a> <span>text</span></div>\n"
+    body = row * ((size - len(head)) // len(row))
+    return head + body + b"</body></html>"
+
+
+def legacy_title(body):
+    """The extraction shipped before streaming: parse everything."""
+    parser = lxml.html.HTMLParser()
+    for start in range(0, len(body), CHUNK):
+        parser.feed(body[start:start + CHUNK])
+    root = parser.close()
+    titles = root.xpath("//title")
+    return " ".join(titles[0].text.split()), len(body)
+
+
+def streaming_title(body):
+    handler = UrlHandler(max_body=len(body),
+                         parser_class=lxml.html.HTMLParser)
+    response = Response(body)
+    d = defer.ensureDeferred(handler.handle_response(response))
+    results = []
+    d.addCallback(results.append)
+    return " ".join(results[0].split()), response.delivered
+
+
+def timed(function, body, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        title, read = function(body)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return title, read, best
+
+
+def main():
+    print(f"{'page MB':>8} {'method':>10} {'bytes read':>12} {'ms':>10}")
+    for megabytes in (1, 4, 16):
+        body = make_page(megabytes * 1024 * 1024)
+        for name, function in (("full", legacy_title),
+                               ("streaming", streaming_title)):
+            title, read, seconds = timed(function, body)
+            assert title == "Synthetic benchmark page", title
+            print(f"{megabytes:>8} {name:>10} {read:>12} "
+                  f"{seconds * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for simple_eval.tokenize.
+
+Compares the original character-by-character tokenizer with the
+regex-based one on inputs from 10 bytes to 1 MB. Per-byte cost should
+stay flat as the input grows.
+
+Run with: PYTHONPATH=. python benchmarks/bench_tokenize.py
+"""
+import timeit
+
+import simple_eval
+from simple_eval import BOOL_SYNTAX, WHITESPACE, IDENTIFIER, EvalError
+
+
+def legacy_tokenize(input_text, tokens, whitespace):
+    """The tokenizer shipped before the regex-based rewrite."""
+    identifier = set(tokens) | set(whitespace) | set(IDENTIFIER)
+    buf = ""
+    buf_pos = -1
+    for i, c in enumerate(input_text):
+        if c in whitespace:
+            if buf:
+                yield buf_pos, buf
+                buf = ""
+        elif c in tokens:
+            if buf:
+                yield buf_pos, buf
+                buf = ""
+            yield i, c
+        elif c not in identifier:
+            raise EvalError(i, c)
+        else:
+            if not buf:
+                buf_pos = i
+            buf += c
+    if buf:
+        yield buf_pos, buf
+
+
+def mixed(size):
+    unit = "(alpha_beta & ~gamma) | delta "
+    return (unit * (size // len(unit) + 1))[:size]
+
+
+def identifier(size):
+    return "x" * size
+
+
+def run(func, text):
+    for _ in func(text, BOOL_SYNTAX, WHITESPACE):
+        pass
+
+
+def main():
+    sizes = [10, 100, 1000, 10 ** 4, 10 ** 5, 10 ** 6]
+    for name, make in (("mixed", mixed), ("single identifier", identifier)):
+        print(f"{name}:")
+        print(f"{'bytes':>10} {'legacy ns/B':>14} {'regex ns/B':>14}")
+        for size in sizes:
+            text = make(size)
+            assert (list(legacy_tokenize(text, BOOL_SYNTAX, WHITESPACE)) ==
+                    list(simple_eval.tokenize(text, BOOL_SYNTAX, WHITESPACE)))
+            number = max(1, 10 ** 5 // size)
+            results = []
+            for func in (legacy_tokenize, simple_eval.tokenize):
+                seconds = min(timeit.repeat(lambda: run(func, text),
+                                            number=number, repeat=3))
+                results.append(seconds / number / size * 1e9)
+            print(f"{size:>10} {results[0]:>14.1f} {results[1]:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
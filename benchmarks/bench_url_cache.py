@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for UrlCache expiry.
+
+Fills a cache with 1M entries whose TTLs are spread over an hour and
+steps a fake clock through their expiry, timing every reaper call. The
+original reaper rebuilt the whole dict on every run; the timer wheel
+should keep each pause under a millisecond.
+
+Run with: PYTHONPATH=. python benchmarks/bench_url_cache.py
+"""
+import random
+import time
+
+from twisted.internet import task
+
+from plugins.title_plugin import UrlCache
+
+
+def legacy_reap(db, now, expiration):
+    """The reaper shipped before timer wheel expiry."""
+    return {key: value for key, value in db.items()
+            if now - value["timestamp"] < expiration}
+
+
+def bench_wheel(entries, horizon, step):
+    clock = task.Clock()
+    cache = UrlCache(clock, expiration=step, max_entries=entries)
+    rng = random.Random(0)
+    for i in range(entries):
+        cache.update(f"http://example.com/{i}", "title",
+                     ttl=rng.uniform(1, horizon))
+    pauses = []
+    reap = cache._reap
+
+    def timed_reap():
+        started = time.perf_counter()
+        reap()
+        pauses.append(time.perf_counter() - started)
+
+    cache._reap = timed_reap
+    cache._reaper.f = timed_reap
+    cache.enable()
+    while clock.seconds() < horizon + step:
+        clock.advance(step)
+    cache.disable()
+    assert not cache._db, len(cache._db)
+    return pauses
+
+
+def bench_legacy(entries, horizon, step):
+    rng = random.Random(0)
+    db = {f"http://example.com/{i}": {"value": "title",
+                                      "timestamp": rng.uniform(1, horizon)}
+          for i in range(entries)}
+    pauses = []
+    now = 0.0
+    while now < horizon + step and len(pauses) < 5:
+        now += step
+        started = time.perf_counter()
+        db = legacy_reap(db, now, horizon)
+        pauses.append(time.perf_counter() - started)
+    return pauses
+
+
+def report(name, pauses):
+    pauses = sorted(pauses)
+    print(f"{name:>8} {len(pauses):>8} "
+          f"{pauses[len(pauses) // 2] * 1000:>10.3f} "
+          f"{pauses[int(len(pauses) * 0.99)] * 1000:>10.3f} "
+          f"{pauses[-1] * 1000:>10.3f}")
+
+
+def main(entries=1000000, horizon=3600, step=1):
+    print(f"{entries} entries, TTLs up to {horizon} s, reaping every {step} s")
+    print(f"{'reaper':>8} {'calls':>8} {'p50 ms':>10} {'p99 ms':>10} "
+          f"{'max ms':>10}")
+    report("wheel", bench_wheel(entries, horizon, step))
+    report("legacy", bench_legacy(entries, horizon, step))
+
+
+if __name__ == "__main__":
+    main()
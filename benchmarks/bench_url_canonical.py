@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for title cache hit rates with canonical URL keys.
+
+Replays an IRC log through a UrlCache twice, once keyed on the raw
+matched URL as before and once on canonicalize_url, and reports the hit
+rate and number of fetches of each. Without arguments a synthetic log is
+generated in which popular links are reposted with the variations seen
+in practice: scheme, host case, trailing slashes, tracking parameters and
+sentence punctuation. Pass a plain-text log file to replay real traffic.
+
+Run with: PYTHONPATH=. python benchmarks/bench_url_canonical.py [LOG]
+"""
+import random
+import re
+import sys
+import time
+
+from twisted.internet import task
+
+from plugins.title_plugin import UrlCache, canonicalize_url, trim_url
+
+URL = re.compile("(https?://[^ ]+)")
+
+SITES = ["example.com", "news.example.org", "Blog.Example.net",
+         "en.wikipedia.org", "www.youtube.com"]
+
+
+def variant(rng, host, path):
+    scheme = rng.choice(["http", "https", "https", "https"])
+    if rng.random() < 0.2:
+        host = host.upper()
+    if rng.random() < 0.1:
+        host += ":443" if scheme == "https" else ":80"
+    if rng.random() < 0.3:
+        path += "/"
+    url = f"{scheme}://{host}{path}"
+    if rng.random() < 0.3:
+        url += "?utm_source=" + rng.choice(["twitter", "irc", "newsletter"])
+        if rng.random() < 0.5:
+            url += "&utm_medium=social"
+    elif rng.random() < 0.1:
+        url += "?fbclid=" + "".join(rng.choice("abcdef0123456789")
+                                    for _ in range(16))
+    return url
+
+
+def synthetic_log(lines, links, seed=0):
+    rng = random.Random(seed)
+    population = [(rng.choice(SITES), f"/article/{i}") for i in range(links)]
+    # A few links get most of the reposts
+    weights = [1 / (rank + 1) for rank in range(links)]
+    log = []
+    for _ in range(lines):
+        if rng.random() < 0.6:
+            log.append("just chatting, no links here")
+            continue
+        host, path = rng.choices(population, weights)[0]
+        url = variant(rng, host, path)
+        template = rng.choice(["{}", "check {}", "{}.", "(see {})",
+                               "is {} down?", "\"{}\""])
+        log.append(template.format(url))
+    return log
+
+
+def replay(log, key):
+    clock = task.Clock()
+    cache = UrlCache(clock, expiration=3600, max_entries=100000)
+    started = time.perf_counter()
+    for line in log:
+        for match in URL.finditer(line):
+            url = match.group(0)
+            cache_key = key(url)
+            if cache.fetch(cache_key) is None:
+                cache.update(cache_key, "title")
+    elapsed = time.perf_counter() - started
+    return cache.stats(), elapsed
+
+
+def main(argv):
+    if len(argv) > 1:
+        with open(argv[1], encoding="utf-8", errors="replace") as f:
+            log = f.read().splitlines()
+        source = argv[1]
+    else:
+        log = synthetic_log(lines=200000, links=2000)
+        source = "synthetic log"
+    print(f"{len(log)} lines from {source}")
+    print(f"{'key':>10} {'lookups':>8} {'fetches':>8} {'hit rate':>9} "
+          f"{'us/url':>8}")
+    for name, key in (("raw", lambda url: url),
+                      ("canonical",
+                       lambda url: canonicalize_url(trim_url(url)))):
+        stats, elapsed = replay(log, key)
+        lookups = stats["hits"] + stats["misses"]
+        print(f"{name:>10} {lookups:>8} {stats['misses']:>8} "
+              f"{stats['hits'] / lookups:>9.1%} "
+              f"{elapsed / lookups * 1e6:>8.2f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -5,11 +5,173 @@ from twisted.spread import pb
 import sys
 from collections import deque
 from twisted.logger import textFileLogObserver, globalLogPublisher, Logger
-from plugin import PluginRegistry
+from plugin import (PluginRegistry, PRIORITY_HIGH, PRIORITY_NORMAL,
+                    PRIORITY_LOW)
 
 log = Logger()
 
 
+class TokenBucket(object):
+    """
+    Token bucket holding up to burst tokens, refilled at rate per second.
+    """
+
+    def __init__(self, reactor, rate, burst):
+        self._reactor = reactor
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._updated = reactor.seconds()
+
+    def _refill(self):
+        now = self._reactor.seconds()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self):
+        """Seconds until a token is available, 0 if one is now."""
+        self._refill()
+        # Tolerate float error left over from refilling
+        if self.tokens >= 1 - 1e-9:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+    @property
+    def full(self):
+        self._refill()
+        return self.tokens >= self.burst
+
+
+class OutputScheduler(object):
+    """
+    Flood control for lines sent to IRC.
+
+    A line is sent once both the connection's token bucket and the
+    bucket of its target have a token. Higher priority lines go first,
+    lines to other targets are not held up by a target that is out of
+    tokens, and a line identical to one still queued is dropped. Each
+    line is a PRIVMSG or NOTICE command, passed to send with it. When
+    max_queue lines are waiting the newest line of a lower priority class
+    makes room, or the new line is dropped if there is none.
+    """
+
+    def __init__(self, reactor, send, rate=1.0, burst=5, target_rate=0.5,
+                 target_burst=3, max_queue=100):
+        self._reactor = reactor
+        self._send = send
+        self._target_rate = target_rate
+        self._target_burst = target_burst
+        self.max_queue = max_queue
+        self._connection = TokenBucket(reactor, rate, burst)
+        self._targets = {}
+        self._queues = [deque() for _ in (PRIORITY_HIGH, PRIORITY_NORMAL,
+                                          PRIORITY_LOW)]
+        self._queued = set()
+        self._pending = None
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    @property
+    def depth(self):
+        return len(self._queued)
+
+    def enqueue(self, target, text, priority=PRIORITY_NORMAL, length=None,
+                command="PRIVMSG"):
+        key = (command, target, text)
+        if key in self._queued:
+            self.coalesced += 1
+            return
+        if self.depth >= self.max_queue and not self._evict(priority):
+            self.dropped += 1
+            log.warn(f"Output queue full, dropped line to {target}")
+            return
+        self._queues[priority].append((command, target, text, length))
+        self._queued.add(key)
+        self._pump()
+
+    def _evict(self, priority):
+        for queue in reversed(self._queues[priority + 1:]):
+            if queue:
+                command, target, text, _ = queue.pop()
+                self._queued.discard((command, target, text))
+                self.dropped += 1
+                log.warn(f"Output queue full, dropped line to {target}")
+                return True
+        return False
+
+    def _bucket(self, target):
+        bucket = self._targets.get(target)
+        if bucket is None:
+            bucket = self._targets[target] = TokenBucket(
+                self._reactor, self._target_rate, self._target_burst)
+        return bucket
+
+    def _next_line(self):
+        """
+        Remove and return the first sendable line, or None and the delay
+        until the earliest target has a token.
+        """
+        wait = None
+        for queue in self._queues:
+            for position, line in enumerate(queue):
+                delay = self._bucket(line[1]).delay()
+                if not delay:
+                    del queue[position]
+                    return line, 0.0
+                wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def _pump(self):
+        wait = None
+        while self.depth:
+            wait = self._connection.delay()
+            if wait:
+                break
+            line, wait = self._next_line()
+            if line is None:
+                break
+            command, target, text, length = line
+            self._queued.discard((command, target, text))
+            self._connection.take()
+            self._bucket(target).take()
+            self.sent += 1
+            self._send(command, target, text, length)
+        if not self.depth:
+            # Full buckets are the same as new ones
+            self._targets = {target: bucket
+                             for target, bucket in self._targets.items()
+                             if not bucket.full}
+        elif self._pending is None or not self._pending.active():
+            self._pending = self._reactor.callLater(wait, self._pump)
+        elif self._pending.getTime() > self._reactor.seconds() + wait:
+            # A new line can go out sooner than the one waited for
+            self._pending.reset(wait)
+
+    def clear(self):
+        """Drop all queued lines, e.g. when the connection is lost."""
+        if self._pending is not None and self._pending.active():
+            self._pending.cancel()
+        self._pending = None
+        for queue in self._queues:
+            queue.clear()
+        self._queued.clear()
+
+    def stats(self):
+        return {
+            "queued": self.depth,
+            "queued_by_priority": [len(queue) for queue in self._queues],
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
+
+
 class RemoteProtocol(pb.Referenceable):
 
     def __init__(self, protocol):
@@ -59,6 +221,9 @@ class NanoBotProtocol(irc.IRCClient):
         self._reactor = reactor
         self.server = server
         self.bot = bot
+        network_config = getattr(server, 'network_config', {})
+        self.output = OutputScheduler(reactor, self._send_line,
+                                      **network_config.get('output', {}))
 
     @property
     def channels(self):
@@ -72,6 +237,8 @@ class NanoBotProtocol(irc.IRCClient):
         irc.IRCClient.signedOn(self)
         # Call plugin handlers for signedOn event
         self._dispatch_event('signed_on')
+        if hasattr(self.bot, 'plugin_registry'):
+            self.bot.plugin_registry.preload_plugins()
         for channel in self.channels:
             if 'key' in channel:
                 self.join(channel['name'], channel['key'])
@@ -80,8 +247,52 @@ class NanoBotProtocol(irc.IRCClient):
 
     def connectionLost(self, reason):
         log.info(f"Connection to {self.server.hostname} lost")
+        self.output.clear()
         irc.IRCClient.connectionLost(self, reason)
 
+    def msg(self, user, message, length=None, priority=PRIORITY_NORMAL):
+        """
+        Queue a message to a user or channel.
+
+        It is sent once the flood limits allow, see OutputScheduler.
+
+        Args:
+            user: Nick or channel to send to
+            message: Message text
+            length: Maximum line length, as for IRCClient.msg
+            priority: PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW
+        """
+        self.output.enqueue(user, message, priority, length)
+
+    def notice(self, user, message, length=None, priority=PRIORITY_NORMAL):
+        """
+        Queue a notice to a user or channel, flood controlled like msg.
+        """
+        self.output.enqueue(user, message, priority, length, "NOTICE")
+
+    def describe(self, channel, action, priority=PRIORITY_NORMAL):
+        """
+        Queue a CTCP ACTION, flood controlled like msg.
+        """
+        self.msg(channel, irc.ctcpStringify([("ACTION", action)]),
+                 priority=priority)
+
+    def _send_line(self, command, user, message, length):
+        if command == "NOTICE":
+            irc.IRCClient.notice(self, user, message, length)
+        else:
+            irc.IRCClient.msg(self, user, message, length)
+
+    def output_stats(self):
+        """
+        Get output queue depth and counters.
+
+        Returns:
+            Dictionary with the queued lines in total and per priority
+            class and the sent, dropped and coalesced line counts
+        """
+        return self.output.stats()
+
     def privmsg(self, user, channel, message):
         irc.IRCClient.privmsg(self, user, channel, message)
         # Call plugin handlers for privmsg event
@@ -141,12 +352,7 @@ class NanoBotProtocol(irc.IRCClient):
             **kwargs: Keyword arguments to pass to handlers
         """
         if hasattr(self.bot, 'plugin_registry'):
-            handlers = self.bot.plugin_registry.get_handlers(event_type)
-            for handler in handlers:
-                try:
-                    handler(self, *args, **kwargs)
-                except Exception as e:
-                    log.failure(f"Error in plugin handler for {event_type}: {e}")
+            self.bot.plugin_registry.dispatch(event_type, self, *args, **kwargs)
 
 
 class ServerConnection(protocol.ReconnectingClientFactory):
@@ -6,12 +6,452 @@ This module provides a plugin registry and base plugin class for extending
 nanobot functionality. Plugins can register handlers for IRC events and
 provide custom behavior.
 """
+import importlib
+import re
+import time
+from collections import deque
+from inspect import iscoroutine
+from twisted.internet import defer
 from twisted.logger import Logger
-from typing import Callable, Dict, List, Optional, Any
+from typing import (Callable, Dict, List, Optional, Any, Iterable, Pattern,
+                    Tuple, Union)
 from abc import ABC, abstractmethod
 
 log = Logger()
 
+# Events dispatched with (user, channel, message) arguments, the only
+# ones handler filters can be applied to.
+MESSAGE_EVENTS = ('privmsg', 'action')
+
+# Output priority classes for protocol.msg, lower is sent first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class HandlerFilter:
+    """
+    Declarative conditions a message event must meet to reach a handler.
+
+    Text conditions (prefix, regex) are resolved through the registry's
+    dispatch index; channel conditions are checked on the candidates.
+    """
+
+    def __init__(self, prefix: Union[str, Iterable[str], None] = None,
+                 regex: Union[str, Pattern, None] = None,
+                 channels: Optional[Iterable[str]] = None,
+                 private: Optional[bool] = None):
+        """
+        Initialize the filter.
+
+        Args:
+            prefix: Message prefix, or several alternative prefixes
+            regex: Pattern that must be found somewhere in the message
+            channels: Channels the handler is interested in
+            private: True for private messages only, False for channel
+                messages only, None for both
+        """
+        if isinstance(prefix, str):
+            prefix = (prefix,)
+        self.prefixes = tuple(prefix) if prefix is not None else None
+        if isinstance(regex, str):
+            regex = re.compile(regex)
+        self.regex = regex
+        self.channels = frozenset(channels) if channels is not None else None
+        self.private = private
+
+    def accepts_target(self, protocol, channel: str) -> bool:
+        """Check the channel conditions for a message sent to channel."""
+        if self.channels is not None and channel not in self.channels:
+            return False
+        if self.private is not None:
+            return (channel == protocol.nickname) == self.private
+        return True
+
+    def matches(self, protocol, channel: str, message: str) -> bool:
+        """Check every condition against a message event."""
+        if self.prefixes is not None and not message.startswith(self.prefixes):
+            return False
+        if self.regex is not None and not self.regex.search(message):
+            return False
+        return self.accepts_target(protocol, channel)
+
+
+class DispatchIndex:
+    """
+    Index over the filters of one message event type.
+
+    Prefixes are stored in a character trie and regexes are pre-screened
+    with a single combined pattern, so the cost of matching a message
+    depends on the handlers interested in it rather than on all of them.
+    Regexes with groups are tested on their own, since combining them
+    would renumber their backreferences.
+    """
+
+    _ENTRIES = ""
+
+    def __init__(self, entries: Tuple['HandlerEntry', ...]):
+        """
+        Build the index.
+
+        Args:
+            entries: Handler entries in registration order
+        """
+        self._entries = entries
+        self._unfiltered = []
+        self._trie: Dict[str, Any] = {}
+        self._regex = []
+        self._grouped = []
+        # Prefixed entries that also have a regex to check
+        self._prefixed_regex = set()
+        for position, entry in enumerate(entries):
+            handler_filter = entry.filter
+            if handler_filter is None or (handler_filter.prefixes is None and
+                                          handler_filter.regex is None):
+                self._unfiltered.append(position)
+            elif handler_filter.prefixes is not None:
+                if handler_filter.regex is not None:
+                    self._prefixed_regex.add(position)
+                for prefix in handler_filter.prefixes:
+                    node = self._trie
+                    for char in prefix:
+                        node = node.setdefault(char, {})
+                    node.setdefault(self._ENTRIES, []).append(position)
+            elif handler_filter.regex.groups:
+                self._grouped.append(position)
+            else:
+                self._regex.append(position)
+        self._combined = self._combine(
+            [entries[position].filter.regex for position in self._regex])
+
+    @staticmethod
+    def _combine(patterns: List[Pattern]) -> Optional[Pattern]:
+        if not patterns or len({p.flags for p in patterns}) != 1:
+            return None
+        try:
+            return re.compile("|".join(f"(?:{p.pattern})" for p in patterns),
+                              patterns[0].flags)
+        except re.error:
+            return None
+
+    def match(self, protocol, channel: str,
+              message: str) -> Tuple['HandlerEntry', ...]:
+        """
+        Find the handlers whose filters accept a message.
+
+        Returns:
+            Entries of the matching handlers in registration order
+        """
+        candidates = list(self._unfiltered)
+        node = self._trie
+        for char in message:
+            node = node.get(char)
+            if node is None:
+                break
+            candidates.extend(node.get(self._ENTRIES, ()))
+        if self._regex and (self._combined is None or
+                            self._combined.search(message)):
+            for position in self._regex:
+                if self._entries[position].filter.regex.search(message):
+                    candidates.append(position)
+        for position in self._grouped:
+            if self._entries[position].filter.regex.search(message):
+                candidates.append(position)
+        candidates.sort()
+        matched = []
+        last = None
+        for position in candidates:
+            if position == last:
+                continue
+            last = position
+            entry = self._entries[position]
+            if entry.filter is None:
+                matched.append(entry)
+            elif position in self._prefixed_regex:
+                if entry.filter.matches(protocol, channel, message):
+                    matched.append(entry)
+            elif entry.filter.accepts_target(protocol, channel):
+                matched.append(entry)
+        return tuple(matched)
+
+
+class HandlerEntry:
+    """A registered handler together with its filter and owning plugin."""
+
+    __slots__ = ('handler', 'filter', 'owner')
+
+    def __init__(self, handler: Callable, handler_filter: Optional[HandlerFilter],
+                 owner: Optional[str]):
+        self.handler = handler
+        self.filter = handler_filter
+        self.owner = owner
+
+
+class HandlerSnapshot:
+    """
+    Immutable view of the handlers registered for one event type.
+
+    The registry replaces snapshots wholesale on every registration
+    change instead of mutating them, so a dispatch that is iterating an
+    older snapshot is never affected by handlers being added or removed.
+    """
+
+    __slots__ = ('entries', 'handlers', 'index')
+
+    def __init__(self, entries: Tuple[HandlerEntry, ...]):
+        """
+        Initialize the snapshot.
+
+        Args:
+            entries: Handler entries in registration order
+        """
+        self.entries = entries
+        self.handlers = tuple(entry.handler for entry in entries)
+        if any(entry.filter is not None for entry in entries):
+            self.index = DispatchIndex(entries)
+        else:
+            self.index = None
+
+
+class LatencyHistogram:
+    """Count, total, maximum and log2 buckets of observed durations."""
+
+    __slots__ = ('count', 'total', 'maximum', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.buckets: Dict[int, int] = {}
+
+    def record(self, seconds: float) -> None:
+        """Record one duration in seconds."""
+        self.count += 1
+        self.total += seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+        # Bucket n holds durations below 2**n microseconds
+        bucket = int(seconds * 1e6).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Summarise the histogram.
+
+        Returns:
+            Dictionary with count, mean, max and a histogram mapping the
+            upper bound of each bucket in seconds to its count
+        """
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.maximum,
+            'histogram': {(1 << bucket) / 1e6: self.buckets[bucket]
+                          for bucket in sorted(self.buckets)},
+        }
+
+
+class HandlerTiming:
+    """Call statistics of one plugin for one event type."""
+
+    __slots__ = ('calls', 'errors', 'call', 'fire')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.call = LatencyHistogram()
+        self.fire = LatencyHistogram()
+
+
+class HandlerStats:
+    """
+    Handler call counts and latencies per plugin and event type.
+
+    Synchronous call time is measured with a wall clock since that is the
+    time the reactor is blocked. Deferred and coroutine results are also
+    timed from the call until they fire, using reactor time.
+    """
+
+    SLOW_THRESHOLD = 0.1
+
+    def __init__(self, reactor, slow_threshold: Optional[float] = SLOW_THRESHOLD,
+                 timer: Callable[[], float] = time.perf_counter):
+        """
+        Initialize the statistics.
+
+        Args:
+            reactor: Twisted reactor used to time returned Deferreds
+            slow_threshold: Seconds a synchronous call may block the
+                reactor before a warning is logged, None to never warn
+            timer: Wall clock used for synchronous calls
+        """
+        self.reactor = reactor
+        self.slow_threshold = slow_threshold
+        self.timer = timer
+        self._timings: Dict[Tuple[Optional[str], str], HandlerTiming] = {}
+
+    def record_call(self, owner: Optional[str], event_type: str,
+                    elapsed: float, failed: bool) -> HandlerTiming:
+        """Record a synchronous handler call and warn if it was slow."""
+        key = (owner, event_type)
+        timing = self._timings.get(key)
+        if timing is None:
+            timing = self._timings[key] = HandlerTiming()
+        timing.calls += 1
+        if failed:
+            timing.errors += 1
+        timing.call.record(elapsed)
+        if self.slow_threshold is not None and elapsed > self.slow_threshold:
+            log.warn(f"Plugin {owner} blocked the reactor for "
+                     f"{elapsed * 1000:.1f} ms handling {event_type}")
+        return timing
+
+    def track(self, timing: HandlerTiming, d: defer.Deferred) -> None:
+        """Record the time until a returned Deferred fires."""
+        started = self.reactor.seconds()
+
+        def fired(result):
+            timing.fire.record(self.reactor.seconds() - started)
+            return result
+
+        d.addBoth(fired)
+
+    def summary(self) -> Dict[Optional[str], Dict[str, Dict[str, Any]]]:
+        """
+        Summarise the statistics.
+
+        Returns:
+            Dictionary mapping plugin names to dictionaries mapping event
+            types to their calls, errors, call and fire summaries
+        """
+        result: Dict[Optional[str], Dict[str, Dict[str, Any]]] = {}
+        for (owner, event_type), timing in self._timings.items():
+            result.setdefault(owner, {})[event_type] = {
+                'calls': timing.calls,
+                'errors': timing.errors,
+                'call': timing.call.summary(),
+                'fire': timing.fire.summary(),
+            }
+        return result
+
+
+class PluginBudget:
+    """
+    Concurrency budget for the asynchronous work of one plugin.
+
+    Handlers returning a Deferred or coroutine count as in flight until
+    the result fires or the timeout cancels it. Events arriving while a
+    plugin is at its cap are queued up to max_queue, or dropped when the
+    overflow policy is 'drop' or the queue is full.
+    """
+
+    MAX_CONCURRENCY = 10
+    TIMEOUT = 120
+    OVERFLOW = 'queue'
+    MAX_QUEUE = 100
+
+    def __init__(self, reactor, name: Optional[str],
+                 max_concurrency: Optional[int] = MAX_CONCURRENCY,
+                 timeout: Optional[float] = TIMEOUT,
+                 overflow: str = OVERFLOW,
+                 max_queue: int = MAX_QUEUE,
+                 stats: Optional[HandlerStats] = None):
+        """
+        Initialize the budget.
+
+        Args:
+            reactor: Twisted reactor used for timeouts
+            name: Name of the plugin, None for handlers without an owner
+            max_concurrency: Maximum in-flight results, None for no cap
+            timeout: Seconds before an in-flight result is cancelled,
+                None for no timeout
+            overflow: 'queue' or 'drop'
+            max_queue: Maximum number of queued events
+            stats: Statistics to record handler calls in, None to disable
+        """
+        if overflow not in ('queue', 'drop'):
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.reactor = reactor
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.overflow = overflow
+        self.max_queue = max_queue
+        self.stats = stats
+        self.in_flight = 0
+        self.dropped = 0
+        self.queue: deque = deque()
+        self._draining = False
+
+    def submit(self, event_type: str, handler: Callable, protocol,
+               args: tuple, kwargs: dict) -> None:
+        """Run a handler now, or queue or drop it if at the cap."""
+        if (self.max_concurrency is not None and
+                self.in_flight >= self.max_concurrency):
+            if self.overflow == 'queue' and len(self.queue) < self.max_queue:
+                self.queue.append((event_type, handler, protocol, args, kwargs))
+            else:
+                self.dropped += 1
+                log.warn(f"Plugin {self.name} at concurrency cap, "
+                         f"dropping {event_type} event")
+            return
+        self._run(event_type, handler, protocol, args, kwargs)
+
+    def _run(self, event_type: str, handler: Callable, protocol,
+             args: tuple, kwargs: dict) -> None:
+        stats = self.stats
+        if stats is None:
+            try:
+                result = handler(protocol, *args, **kwargs)
+            except Exception as e:
+                log.failure(f"Error in plugin handler for {event_type}: {e}")
+                return
+        else:
+            started = stats.timer()
+            try:
+                result = handler(protocol, *args, **kwargs)
+            except Exception as e:
+                stats.record_call(self.name, event_type,
+                                  stats.timer() - started, True)
+                log.failure(f"Error in plugin handler for {event_type}: {e}")
+                return
+            timing = stats.record_call(self.name, event_type,
+                                       stats.timer() - started, False)
+        if iscoroutine(result):
+            result = defer.ensureDeferred(result)
+        if not isinstance(result, defer.Deferred):
+            return
+        self.in_flight += 1
+        if self.timeout is not None:
+            result.addTimeout(self.timeout, self.reactor)
+        if stats is not None:
+            stats.track(timing, result)
+
+        @result.addErrback
+        def failed(failure):
+            if failure.check(defer.TimeoutError):
+                log.warn(f"Plugin handler for {event_type} timed out "
+                         f"after {self.timeout} seconds")
+            else:
+                log.failure(f"Error in plugin handler for {event_type}",
+                            failure=failure)
+
+        result.addBoth(self._finished)
+
+    def _finished(self, _) -> None:
+        self.in_flight -= 1
+        if self._draining:
+            # A queued handler finished synchronously, the loop below
+            # picks up the freed slot without recursing
+            return
+        self._draining = True
+        try:
+            while self.queue and (self.max_concurrency is None or
+                                  self.in_flight < self.max_concurrency):
+                self._run(*self.queue.popleft())
+        finally:
+            self._draining = False
+
 
 class PluginRegistry:
     """
@@ -32,7 +472,16 @@ class PluginRegistry:
         self.reactor = reactor
         self.config = config or {}
         self.plugins: Dict[str, 'Plugin'] = {}
-        self.handlers: Dict[str, List[Callable]] = {}
+        self.budgets: Dict[Optional[str], PluginBudget] = {}
+        self._stats: Optional[HandlerStats] = None
+        self._snapshots: Dict[str, HandlerSnapshot] = {}
+        self._plugin_configs: Dict[str, Dict] = {}
+        self._lazy: Dict[str, Dict] = {}
+        self._staging: Dict[str, List[Tuple[str, HandlerEntry]]] = {}
+        stats_config = self.config.get('core', {}).get('handler_stats', {})
+        if stats_config.get('enabled', False):
+            self.enable_stats(stats_config.get(
+                'slow_threshold', HandlerStats.SLOW_THRESHOLD))
         
     def register_plugin(self, plugin: 'Plugin') -> None:
         """
@@ -47,17 +496,33 @@ class PluginRegistry:
         self.plugins[name] = plugin
         log.info(f"Registered plugin: {name}")
         
-    def register_handler(self, event_type: str, handler: Callable) -> None:
+    def register_handler(self, event_type: str, handler: Callable,
+                         owner: Optional[str] = None, **filters) -> None:
         """
         Register a handler for a specific event type.
         
         Args:
             event_type: Type of event to handle (e.g., 'privmsg', 'join', 'part')
             handler: Callable to invoke when event occurs
+            owner: Name of the plugin the handler belongs to
+            **filters: Optional HandlerFilter conditions (prefix, regex,
+                channels, private), only valid for message events
         """
-        if event_type not in self.handlers:
-            self.handlers[event_type] = []
-        self.handlers[event_type].append(handler)
+        handler_filter = None
+        if filters:
+            if event_type not in MESSAGE_EVENTS:
+                raise ValueError(f"Handler filters are not supported for "
+                                 f"event: {event_type}")
+            handler_filter = HandlerFilter(**filters)
+        snapshot = self._snapshots.get(event_type)
+        entries = snapshot.entries if snapshot is not None else ()
+        entry = HandlerEntry(handler, handler_filter, owner)
+        staged = self._staging.get(owner)
+        if staged is not None:
+            staged.append((event_type, entry))
+            log.debug(f"Staged handler of {owner} for event: {event_type}")
+            return
+        self._publish(event_type, entries + (entry,))
         log.debug(f"Registered handler for event: {event_type}")
         
     def unregister_handler(self, event_type: str, handler: Callable) -> None:
@@ -68,14 +533,61 @@ class PluginRegistry:
             event_type: Type of event
             handler: Handler to remove
         """
-        if event_type in self.handlers:
+        snapshot = self._snapshots.get(event_type)
+        if snapshot is not None:
             try:
-                self.handlers[event_type].remove(handler)
-                log.debug(f"Unregistered handler for event: {event_type}")
+                position = snapshot.handlers.index(handler)
             except ValueError:
                 log.warn(f"Handler not found for event: {event_type}")
+            else:
+                entries = snapshot.entries
+                self._publish(event_type,
+                              entries[:position] + entries[position + 1:])
+                log.debug(f"Unregistered handler for event: {event_type}")
+
+    def unregister_owner(self, owner: str) -> None:
+        """
+        Unregister every handler owned by a plugin.
+
+        Args:
+            owner: Plugin name
+        """
+        self._replace_owner(owner, [])
+
+    def _replace_owner(self, owner: str,
+                       staged: List[Tuple[str, HandlerEntry]]) -> None:
+        """
+        Replace the handlers owned by a plugin with staged ones.
+
+        New handlers take the place of the first old handler for the same
+        event type so dispatch order between plugins is kept.
+        """
+        event_types = set(self._snapshots)
+        event_types.update(event_type for event_type, _ in staged)
+        for event_type in event_types:
+            new = tuple(entry for staged_type, entry in staged
+                        if staged_type == event_type)
+            snapshot = self._snapshots.get(event_type)
+            entries = snapshot.entries if snapshot is not None else ()
+            kept = tuple(entry for entry in entries if entry.owner != owner)
+            if not new and len(kept) == len(entries):
+                continue
+            position = len(kept)
+            for index, entry in enumerate(entries):
+                if entry.owner == owner:
+                    position = index
+                    break
+            self._publish(event_type, kept[:position] + new + kept[position:])
+
+    def _publish(self, event_type: str,
+                 entries: Tuple[HandlerEntry, ...]) -> None:
+        """Replace the snapshot for an event type in a single assignment."""
+        if entries:
+            self._snapshots[event_type] = HandlerSnapshot(entries)
+        else:
+            self._snapshots.pop(event_type, None)
                 
-    def get_handlers(self, event_type: str) -> List[Callable]:
+    def get_handlers(self, event_type: str) -> Tuple[Callable, ...]:
         """
         Get all handlers registered for an event type.
         
@@ -83,9 +595,134 @@ class PluginRegistry:
             event_type: Type of event
             
         Returns:
-            List of handlers for the event type
+            Immutable tuple of handlers for the event type
+        """
+        snapshot = self._snapshots.get(event_type)
+        if snapshot is None:
+            return ()
+        return snapshot.handlers
+
+    def match_handlers(self, event_type: str, protocol,
+                       *args) -> Tuple[Callable, ...]:
+        """
+        Get the handlers an event should be dispatched to.
+
+        When no handler for the event has filters these are all of its
+        handlers; otherwise the snapshot's dispatch index selects the
+        handlers whose filters accept the message, as for dispatch.
+
+        Args:
+            event_type: Type of event
+            protocol: Protocol instance the event was received on
+            *args: Event arguments
+
+        Returns:
+            Tuple of handlers to invoke, in registration order
+        """
+        return tuple(entry.handler
+                     for entry in self._match_entries(event_type, protocol,
+                                                      args))
+
+    def set_budget(self, owner: Optional[str], **settings) -> PluginBudget:
+        """
+        Configure the concurrency budget of a plugin.
+
+        Args:
+            owner: Plugin name
+            **settings: PluginBudget settings (max_concurrency, timeout,
+                overflow, max_queue)
+
+        Returns:
+            The new budget
+        """
+        budget = self.budgets[owner] = PluginBudget(
+            self.reactor, owner, stats=self._stats, **settings)
+        return budget
+
+    def get_budget(self, owner: Optional[str]) -> PluginBudget:
+        """Get the budget of a plugin, creating a default one if needed."""
+        budget = self.budgets.get(owner)
+        if budget is None:
+            budget = self.set_budget(owner)
+        return budget
+
+    def enable_stats(self, slow_threshold: Optional[float] =
+                     HandlerStats.SLOW_THRESHOLD) -> None:
+        """
+        Start recording handler statistics, discarding earlier ones.
+
+        Args:
+            slow_threshold: Seconds a synchronous handler may block the
+                reactor before a warning is logged, None to never warn
         """
-        return self.handlers.get(event_type, [])
+        self._stats = HandlerStats(self.reactor, slow_threshold)
+        for budget in self.budgets.values():
+            budget.stats = self._stats
+
+    def disable_stats(self) -> None:
+        """Stop recording handler statistics."""
+        self._stats = None
+        for budget in self.budgets.values():
+            budget.stats = None
+
+    @property
+    def stats_enabled(self) -> bool:
+        """Whether handler statistics are being recorded."""
+        return self._stats is not None
+
+    def stats(self) -> Dict[Optional[str], Dict[str, Dict[str, Any]]]:
+        """
+        Get handler statistics per plugin and event type.
+
+        Returns:
+            Dictionary mapping plugin names to dictionaries mapping event
+            types to call counts, error counts and latency summaries of
+            the synchronous calls ('call') and of returned Deferreds
+            firing ('fire'); empty when statistics are disabled
+        """
+        if self._stats is None:
+            return {}
+        return self._stats.summary()
+
+    def in_flight(self) -> Dict[Optional[str], int]:
+        """
+        Get the number of in-flight handler results per plugin.
+
+        Returns:
+            Dictionary mapping plugin names to in-flight counts
+        """
+        return {owner: budget.in_flight
+                for owner, budget in self.budgets.items()}
+
+    def dispatch(self, event_type: str, protocol, *args, **kwargs) -> None:
+        """
+        Dispatch an event to the matching handlers.
+
+        Each handler runs under its plugin's budget. Deferred and
+        coroutine results are tracked as in-flight work, so a plugin
+        that falls behind has further events queued or dropped rather
+        than piling up without bound. Handler errors are logged.
+
+        Args:
+            event_type: Type of event to dispatch
+            protocol: Protocol instance the event was received on
+            *args: Positional arguments to pass to handlers
+            **kwargs: Keyword arguments to pass to handlers
+        """
+        for entry in self._match_entries(event_type, protocol, args):
+            self.get_budget(entry.owner).submit(event_type, entry.handler,
+                                                protocol, args, kwargs)
+
+    def _match_entries(self, event_type: str, protocol,
+                       args: tuple) -> Tuple[HandlerEntry, ...]:
+        """Get the entries of the handlers an event should reach."""
+        snapshot = self._snapshots.get(event_type)
+        if snapshot is None:
+            return ()
+        if snapshot.index is None:
+            return snapshot.entries
+        user, channel, message = args
+        return snapshot.index.match(protocol, channel, message)
         
     def load_plugins(self, plugin_configs: List[Dict]) -> None:
         """
@@ -106,12 +743,19 @@ class PluginRegistry:
             if not plugin_module:
                 log.error(f"Plugin {plugin_name} missing module path")
                 continue
+
+            if plugin_config.get('lazy', False):
+                self._install_lazy(plugin_name, plugin_config)
+                continue
                 
             try:
                 # Dynamic import of plugin module
                 module = __import__(plugin_module, fromlist=[''])
                 if hasattr(module, 'load'):
+                    self.set_budget(plugin_name,
+                                    **plugin_config.get('budget', {}))
                     plugin = module.load(self, plugin_config)
+                    self._plugin_configs[plugin_name] = plugin_config
                     if plugin:
                         self.register_plugin(plugin)
                 else:
@@ -129,11 +773,141 @@ class PluginRegistry:
         if plugin_name in self.plugins:
             plugin = self.plugins[plugin_name]
             plugin.unload()
+            self.unregister_owner(plugin_name)
             del self.plugins[plugin_name]
             log.info(f"Unloaded plugin: {plugin_name}")
+        elif plugin_name in self._lazy:
+            del self._lazy[plugin_name]
+            self.unregister_owner(plugin_name)
+            log.info(f"Unloaded plugin: {plugin_name}")
         else:
             log.warn(f"Plugin {plugin_name} not found")
 
+    def reload_plugin(self, plugin_name: str) -> bool:
+        """
+        Reload a plugin's module and swap in its new handlers.
+
+        The reloaded plugin registers its handlers into a staging area
+        while the old handlers keep serving events. Only once it has
+        loaded are the old handlers replaced and the old plugin unloaded;
+        if the reload fails the old plugin stays in place.
+
+        Args:
+            plugin_name: Name of a plugin loaded through load_plugins()
+
+        Returns:
+            True if the plugin was reloaded
+        """
+        if plugin_name in self._lazy:
+            return self._load_lazy(plugin_name)
+        plugin_config = self._plugin_configs.get(plugin_name)
+        if plugin_config is None:
+            log.warn(f"Plugin {plugin_name} was not loaded from configuration")
+            return False
+        if not self._load_staged(plugin_name, plugin_config, reload=True):
+            return False
+        log.info(f"Reloaded plugin: {plugin_name}")
+        return True
+
+    def _load_staged(self, plugin_name: str, plugin_config: Dict,
+                     reload: bool = False) -> bool:
+        """
+        Load a plugin with its registrations staged, then swap them in.
+
+        Handlers already owned by the plugin (an older version or lazy
+        stubs) are replaced in one step and an older plugin is unloaded.
+        """
+        staged: List[Tuple[str, HandlerEntry]] = []
+        self._staging[plugin_name] = staged
+        try:
+            module = importlib.import_module(plugin_config['module'])
+            if reload:
+                module = importlib.reload(module)
+            plugin = module.load(self, plugin_config)
+        except Exception as e:
+            action = "reload" if reload else "load"
+            log.failure(f"Failed to {action} plugin {plugin_name}: {e}")
+            return False
+        finally:
+            del self._staging[plugin_name]
+        self._replace_owner(plugin_name, staged)
+        old = self.plugins.pop(plugin_name, None)
+        if old is not None:
+            try:
+                old.unload()
+            except Exception as e:
+                log.failure(f"Error unloading old {plugin_name} plugin: {e}")
+        self._plugin_configs[plugin_name] = plugin_config
+        if plugin:
+            self.register_plugin(plugin)
+        return True
+
+    def _install_lazy(self, plugin_name: str, plugin_config: Dict) -> None:
+        """
+        Register stub handlers for a plugin whose module is imported later.
+
+        The config's 'handles' list declares the events the plugin
+        handles, each a dictionary with an 'event' key and optional
+        HandlerFilter conditions.
+        """
+        self.set_budget(plugin_name, **plugin_config.get('budget', {}))
+        self._lazy[plugin_name] = plugin_config
+        for declared in plugin_config.get('handles', []):
+            filters = dict(declared)
+            event_type = filters.pop('event')
+            self.register_handler(event_type,
+                                  self._lazy_stub(plugin_name, event_type),
+                                  owner=plugin_name, **filters)
+        log.info(f"Deferred loading of plugin {plugin_name}")
+
+    def _lazy_stub(self, plugin_name: str, event_type: str) -> Callable:
+        """Create a handler that loads a lazy plugin and forwards the event."""
+        def stub(protocol, *args, **kwargs):
+            if plugin_name not in self._lazy:
+                # Loaded by another stub during the same dispatch
+                return
+            log.info(f"Loading plugin {plugin_name} on {event_type} event")
+            if not self._load_lazy(plugin_name):
+                return
+            budget = self.get_budget(plugin_name)
+            for entry in self._match_entries(event_type, protocol, args):
+                if entry.owner == plugin_name:
+                    budget.submit(event_type, entry.handler, protocol,
+                                  args, kwargs)
+        return stub
+
+    def _load_lazy(self, plugin_name: str) -> bool:
+        """Import and load a lazy plugin, replacing its stubs."""
+        plugin_config = self._lazy.pop(plugin_name)
+        if self._load_staged(plugin_name, plugin_config):
+            return True
+        # Drop the stubs rather than retrying the import on every event
+        self.unregister_owner(plugin_name)
+        return False
+
+    def preload_plugins(self) -> None:
+        """
+        Load the remaining lazy plugins in the background.
+
+        One plugin is loaded per reactor iteration so that connection
+        traffic is served in between. Plugins configured with
+        "preload": false stay lazy until a matching event arrives.
+        """
+        pending = deque(name for name, plugin_config in self._lazy.items()
+                        if plugin_config.get('preload', True))
+
+        def load_next():
+            while pending:
+                plugin_name = pending.popleft()
+                if plugin_name in self._lazy:
+                    self._load_lazy(plugin_name)
+                    break
+            if pending:
+                self.reactor.callLater(0, load_next)
+
+        if pending:
+            self.reactor.callLater(0, load_next)
+
 
 class Plugin(ABC):
     """
@@ -175,12 +949,15 @@ class Plugin(ABC):
         """
         pass
         
-    def register_handler(self, event_type: str, handler: Callable) -> None:
+    def register_handler(self, event_type: str, handler: Callable,
+                         **filters) -> None:
         """
         Convenience method to register a handler.
         
         Args:
             event_type: Type of event to handle
             handler: Callable to invoke when event occurs
+            **filters: Optional HandlerFilter conditions for message events
         """
-        self.registry.register_handler(event_type, handler)
+        self.registry.register_handler(event_type, handler, owner=self.name,
+                                       **filters)
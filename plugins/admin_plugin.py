@@ -2,11 +2,11 @@
 """
 Admin plugin for nanobot.
 
-Handles admin commands: !reincarnate, !join, !leave.
+Handles admin commands: !reincarnate, !join, !leave, !stats, !reload.
 Role-based access is resolved via the configured SQLite database.
 """
 import sqlite3
-from plugin import Plugin
+from plugin import Plugin, PRIORITY_HIGH
 from twisted.logger import Logger
 
 log = Logger()
@@ -17,6 +17,8 @@ _user_query = (
     "natural join userroles where usermask.mask=?);"
 )
 
+COMMANDS = ("reincarnate", "join", "leave", "stats", "reload")
+
 
 class AdminPlugin(Plugin):
     """Plugin that handles admin commands with role-based access control."""
@@ -25,7 +27,8 @@ class AdminPlugin(Plugin):
         """Load the plugin and register handlers."""
         log.info(f"Loading {self.name} plugin")
         self._db = self.registry.config.get('core', {}).get('db')
-        self.register_handler('privmsg', self.on_privmsg)
+        self.register_handler('privmsg', self.on_privmsg,
+                              prefix=tuple(f"!{c}" for c in COMMANDS))
         log.info(f"{self.name} plugin loaded successfully")
 
     def _resolve_roles(self, user):
@@ -45,6 +48,34 @@ class AdminPlugin(Plugin):
             res = cur.execute(_user_query, (user,))
             return [role[0] for role in res.fetchall()]
 
+    def _reply_target(self, protocol, user, channel):
+        """Reply to the sender of private messages, else to the channel."""
+        if channel == protocol.nickname:
+            return user.split('!')[0]
+        return channel
+
+    def _format_stats(self):
+        """
+        Format handler statistics for IRC, one line per plugin and event.
+
+        Returns:
+            List of lines, slowest mean call time first
+        """
+        rows = []
+        for owner, events in self.registry.stats().items():
+            for event_type, stats in events.items():
+                call, fire = stats['call'], stats['fire']
+                line = (f"{owner} {event_type}: {stats['calls']} calls, "
+                        f"{stats['errors']} errors, "
+                        f"call mean {call['mean'] * 1000:.2f} ms "
+                        f"max {call['max'] * 1000:.2f} ms")
+                if fire['count']:
+                    line += (f", fire mean {fire['mean'] * 1000:.0f} ms "
+                             f"max {fire['max'] * 1000:.0f} ms")
+                rows.append((call['mean'], line))
+        rows.sort(key=lambda row: row[0], reverse=True)
+        return [line for _, line in rows]
+
     def on_privmsg(self, protocol, user, channel, message):
         """
         Handle privmsg events, responding to admin commands.
@@ -59,7 +90,7 @@ class AdminPlugin(Plugin):
             return
 
         command, _, suffix = message[1:].partition(" ")
-        if command not in ("reincarnate", "join", "leave"):
+        if command not in COMMANDS:
             return
 
         roles = self._resolve_roles(user)
@@ -94,6 +125,28 @@ class AdminPlugin(Plugin):
                 else:
                     log.info(f"Leaving {chan}")
                 protocol.leave(chan, reason)
+        elif command == "reload":
+            name = suffix.strip()
+            if "superadmin" in roles and name:
+                log.info(f"Reloading plugin {name}")
+                if self.registry.reload_plugin(name):
+                    protocol.msg(self._reply_target(protocol, user, channel),
+                                 f"Reloaded plugin {name}",
+                                 priority=PRIORITY_HIGH)
+                else:
+                    protocol.msg(self._reply_target(protocol, user, channel),
+                                 f"Failed to reload plugin {name}",
+                                 priority=PRIORITY_HIGH)
+        elif command == "stats":
+            if "superadmin" in roles:
+                target = self._reply_target(protocol, user, channel)
+                if not self.registry.stats_enabled:
+                    protocol.msg(target, "Handler statistics are disabled",
+                                 priority=PRIORITY_HIGH)
+                    return
+                lines = self._format_stats() or ["No handler calls recorded"]
+                for line in lines[:self.config.get('max_stats_lines', 5)]:
+                    protocol.msg(target, line, priority=PRIORITY_HIGH)
 
 
 def load(registry, config):
@@ -6,6 +6,7 @@ Handles the !eval command for boolean expression evaluation.
 """
 import simple_eval
 from plugin import Plugin
+from twisted.internet import defer, threads
 from twisted.logger import Logger
 
 log = Logger()
@@ -15,9 +16,18 @@ class EvalPlugin(Plugin):
     """Plugin that handles the !eval command for boolean expression evaluation."""
 
     def load(self):
-        """Load the plugin and register handlers."""
+        """Load the plugin, read evaluation limits and register handlers."""
         log.info(f"Loading {self.name} plugin")
-        self.register_handler('privmsg', self.on_privmsg)
+        self._limits = simple_eval.EvalLimits(
+            max_length=self.config.get('max_length', 512),
+            max_tokens=self.config.get('max_tokens', 256),
+            max_depth=self.config.get('max_depth', 32),
+            max_steps=self.config.get('max_steps', 1024),
+        )
+        # Expressions longer than this are evaluated in the reactor's
+        # thread pool so they cannot stall other connections.
+        self._thread_threshold = self.config.get('thread_threshold', 128)
+        self.register_handler('privmsg', self.on_privmsg, prefix="!eval ")
         log.info(f"{self.name} plugin loaded successfully")
 
     def on_privmsg(self, protocol, user, channel, message):
@@ -41,13 +51,26 @@ class EvalPlugin(Plugin):
 
         truth, _, expr = suffix.partition(":")
         truth = [s.strip() for s in truth.split(",")]
-        try:
-            ret = simple_eval.eval_bool(expr, truth)
-        except simple_eval.EvalError as e:
-            protocol.msg(target, str(e))
+        if len(expr) > self._thread_threshold:
+            d = threads.deferToThreadPool(
+                self.reactor, self.reactor.getThreadPool(),
+                simple_eval.eval_bool, expr, truth, self._limits)
         else:
+            d = defer.maybeDeferred(simple_eval.eval_bool, expr, truth,
+                                    self._limits)
+
+        @d.addCallback
+        def reply(ret):
             protocol.msg(target, "Result: %s" % ret)
 
+        @d.addErrback
+        def report(failure):
+            failure.trap(simple_eval.EvalError)
+            protocol.msg(target, str(failure.value))
+
+        d.addErrback(lambda f: log.failure("Error in eval plugin", failure=f))
+        return d
+
 
 def load(registry, config):
     """
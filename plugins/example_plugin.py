@@ -6,7 +6,9 @@ This plugin shows how to:
 1. Register for IRC events
 2. Respond to messages
 3. Use the RemoteProtocol API
+4. Filter which messages reach a handler
 """
+import re
 from plugin import Plugin
 from twisted.logger import Logger
 
@@ -25,8 +27,15 @@ class ExamplePlugin(Plugin):
         """Load the plugin and register handlers."""
         log.info(f"Loading {self.name} plugin")
         
-        # Register for privmsg events
-        self.register_handler('privmsg', self.on_privmsg)
+        # Register for privmsg events, only receiving messages that
+        # contain one of the keywords when any are configured
+        keywords = self.config.get('keywords', [])
+        if keywords:
+            pattern = "|".join(re.escape(keyword) for keyword in keywords)
+            self.register_handler('privmsg', self.on_privmsg,
+                                  regex=re.compile(pattern, re.IGNORECASE))
+        else:
+            self.register_handler('privmsg', self.on_privmsg)
         
         # Register for user join events
         self.register_handler('user_joined', self.on_user_joined)
@@ -6,16 +6,28 @@ Fetches and announces the HTML title of URLs posted in IRC channels.
 """
 import re
 import codecs
+import functools
 import ipaddress
+import heapq
+import math
+import socket
+import sqlite3
+from collections import OrderedDict
 import lxml.html
 import Levenshtein
 import treq
 from urllib import parse as urlparse
 
-from twisted.internet import task, defer
+from twisted.internet import task, defer, endpoints
+from twisted.names import client as dns_client, dns, hosts, resolve
+from twisted.python.failure import Failure
+from twisted.web.client import (Agent, BrowserLikePolicyForHTTPS,
+                                HTTPConnectionPool)
+from twisted.web.iweb import IAgentEndpointFactory
 from twisted.logger import Logger
+from zope.interface import implementer
 
-from plugin import Plugin
+from plugin import Plugin, PRIORITY_LOW
 
 log = Logger()
 
@@ -25,16 +37,73 @@ class AppException(Exception):
 
 
 BLOCKLIST = [
+    ipaddress.IPv4Network('0.0.0.0/8'),
     ipaddress.IPv4Network('127.0.0.0/8'),
     ipaddress.IPv4Network('192.168.0.0/16'),
     ipaddress.IPv4Network('10.0.0.0/8'),
     ipaddress.IPv4Network('172.16.0.0/12'),
+    ipaddress.IPv4Network('169.254.0.0/16'),
     ipaddress.IPv6Network('::1'),
     ipaddress.IPv6Network('fe80::/10'),
+    ipaddress.IPv6Network('fc00::/7'),
 ]
 
 
-def acceptable_netloc(hostname):
+class IPBlocklist(object):
+    """
+    Set of IPv4 and IPv6 networks with fast address membership tests.
+
+    Networks are kept in one hash set per prefix length, keyed by their
+    network bits, so a lookup costs one set probe per distinct prefix
+    length in the list however many networks it holds. IPv4-mapped IPv6
+    addresses are checked as the IPv4 address they map.
+    """
+
+    def __init__(self, networks=()):
+        # Per IP version: prefix length -> set of shifted network addresses
+        self._tables = {4: {}, 6: {}}
+        self._lengths = {4: [], 6: []}
+        self._size = 0
+        for network in networks:
+            self.add(network)
+
+    def add(self, network):
+        if not isinstance(network, (ipaddress.IPv4Network,
+                                    ipaddress.IPv6Network)):
+            network = ipaddress.ip_network(network, strict=False)
+        table = self._tables[network.version]
+        shift = network.max_prefixlen - network.prefixlen
+        prefixes = table.get(network.prefixlen)
+        if prefixes is None:
+            prefixes = table[network.prefixlen] = set()
+            self._lengths[network.version] = sorted(table)
+        key = int(network.network_address) >> shift
+        if key not in prefixes:
+            prefixes.add(key)
+            self._size += 1
+
+    def __contains__(self, address):
+        if not isinstance(address, (ipaddress.IPv4Address,
+                                    ipaddress.IPv6Address)):
+            address = ipaddress.ip_address(address)
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        table = self._tables[address.version]
+        value = int(address)
+        bits = address.max_prefixlen
+        for length in self._lengths[address.version]:
+            if value >> (bits - length) in table[length]:
+                return True
+        return False
+
+    def __len__(self):
+        return self._size
+
+
+DEFAULT_BLOCKLIST = IPBlocklist(BLOCKLIST)
+
+
+def acceptable_netloc(hostname, blocklist=DEFAULT_BLOCKLIST):
     try:
         address = ipaddress.ip_address(hostname)
     except ValueError:
@@ -43,43 +112,368 @@ def acceptable_netloc(hostname):
         else:
             return True
     else:
-        for network in BLOCKLIST:
-            if address in network:
-                return False
+        return address not in blocklist
+
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# Query parameters that only track where a link was shared
+TRACKING_PARAMS = frozenset([
+    "fbclid", "gclid", "dclid", "gbraid", "wbraid", "msclkid", "mc_cid",
+    "mc_eid", "igshid", "yclid",
+])
+
+TRAILING_PUNCTUATION = ".,;:!?'\""
+
+BRACKETS = {")": "(", "]": "[", "}": "{", ">": "<"}
+
+
+def trim_url(url):
+    """
+    Strip punctuation ending the sentence around a URL.
+
+    Closing brackets are only stripped when unbalanced so links like
+    https://en.wikipedia.org/wiki/Python_(programming_language) survive.
+    """
+    while url:
+        last = url[-1]
+        if last in TRAILING_PUNCTUATION:
+            url = url[:-1]
+        elif (last in BRACKETS and
+                url.count(BRACKETS[last]) < url.count(last)):
+            url = url[:-1]
         else:
-            return True
+            break
+    return url
+
+
+# Stops at whitespace, quotes, angle brackets as in <http://...> and IRC
+# formatting codes such as \x02 (bold) and \x03 (colour)
+URL_PATTERN = re.compile(r'https?://[^\s<>"\x00-\x1f\x7f]+')
+
+
+def extract_urls(message):
+    """Return the URLs in a message with sentence punctuation trimmed."""
+    # Most messages have no links, skip the regex for them
+    if "://" not in message:
+        return []
+    return [trim_url(url) for url in URL_PATTERN.findall(message)]
+
+
+def is_tracking_param(name):
+    name = name.lower()
+    return name.startswith("utm_") or name in TRACKING_PARAMS
+
+
+def canonicalize_url(url):
+    """
+    Return the cache and coalescing key of a URL.
+
+    Trivial variants of a URL share a key: the scheme is left out, the
+    host is case folded and IDNA encoded, and default ports, tracking
+    parameters, trailing slashes and the fragment, which is never sent
+    to the server, are dropped.
+    """
+    parts = urlparse.urlsplit(url)
+    host = parts.hostname or ""
+    if not host.isascii():
+        try:
+            host = host.encode("idna").decode("ascii")
+        except UnicodeError:
+            pass
+    if ":" in host:
+        host = f"[{host}]"
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port is not None and port != DEFAULT_PORTS.get(parts.scheme.lower()):
+        host = f"{host}:{port}"
+    key = "//" + host + (parts.path.rstrip("/") or "/")
+    query = "&".join(param for param in parts.query.split("&")
+                     if param and
+                     not is_tracking_param(param.partition("=")[0]))
+    if query:
+        key += "?" + query
+    return key
+
+
+BOMS = (
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16le"),
+    (codecs.BOM_UTF16_BE, "utf-16be"),
+)
+
+# Bytes of the document searched for a <meta> charset declaration
+SNIFF_BYTES = 4096
+
+META_CHARSET = re.compile(
+    rb"""<meta[^>]*?charset\s*=\s*["']?\s*([\w.:-]+)""", re.IGNORECASE)
+
+
+def normalize_encoding(label):
+    """
+    Return an encoding label usable for decoding, or None if unknown.
+
+    Latin-1 and ASCII are decoded as windows-1252 like browsers do.
+    """
+    try:
+        name = codecs.lookup(label).name
+    except LookupError:
+        return None
+    if name in ("iso8859-1", "ascii"):
+        return "windows-1252"
+    return label
+
+
+def detect_encoding(head, declared=None):
+    """
+    Pick the encoding of a document from the start of its body.
+
+    A byte order mark wins over the encoding declared in Content-Type,
+    which wins over a <meta> declaration. Undeclared documents are
+    UTF-8 if their start decodes as such and windows-1252 otherwise.
+    """
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+    if declared:
+        return declared
+    match = META_CHARSET.search(head, 0, SNIFF_BYTES)
+    if match:
+        encoding = normalize_encoding(match.group(1).decode("ascii"))
+        if encoding and encoding.lower().startswith("utf-16"):
+            # A document readable as ASCII cannot be UTF-16
+            return "utf-8"
+        if encoding:
+            return encoding
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # A character cut off at the end of the head is still UTF-8
+        if e.start < len(head) - 3:
+            return "windows-1252"
+    return "utf-8"
+
+
+class TitleConnectionPool(HTTPConnectionPool):
+    """
+    Persistent connection pool with a total cap and per-host statistics.
+
+    At most maxPersistent idle connections are kept across all hosts; a
+    connection that would exceed it is closed instead of cached.
+    """
+
+    maxPersistent = 32
+
+    def __init__(self, reactor):
+        HTTPConnectionPool.__init__(self, reactor, persistent=True)
+        self.host_stats = {}
+
+    def _host_stats(self, key):
+        host = key[1] if isinstance(key, tuple) and len(key) > 1 else key
+        if isinstance(host, bytes):
+            host = host.decode("ascii", "replace")
+        stats = self.host_stats.get(host)
+        if stats is None:
+            stats = self.host_stats[host] = {"requests": 0, "connections": 0}
+        return stats
+
+    def getConnection(self, key, endpoint):
+        self._host_stats(key)["requests"] += 1
+        return HTTPConnectionPool.getConnection(self, key, endpoint)
+
+    def _newConnection(self, key, endpoint):
+        self._host_stats(key)["connections"] += 1
+        return HTTPConnectionPool._newConnection(self, key, endpoint)
+
+    def _putConnection(self, key, connection):
+        cached = sum(len(connections)
+                     for connections in self._connections.values())
+        if (cached >= self.maxPersistent and
+                len(self._connections.get(key, ())) <
+                self.maxPersistentPerHost):
+            connection.transport.loseConnection()
+            return
+        HTTPConnectionPool._putConnection(self, key, connection)
+
+    def stats(self):
+        return {host: dict(stats,
+                           reused=stats["requests"] - stats["connections"])
+                for host, stats in self.host_stats.items()}
+
+
+class StopReading(Exception):
+    """Raised from UrlHandler.feed to stop downloading the body."""
+
+
+class TitleTarget(object):
+    """
+    lxml parser target that keeps only the text of the first <title>.
+
+    It is done once that title ends or the body starts, after which the
+    rest of the document is not needed.
+    """
+
+    def __init__(self):
+        self.done = False
+        self._parts = None
+        self._title = None
+
+    def start(self, tag, attrib):
+        if tag == "title" and self._title is None and self._parts is None:
+            self._parts = []
+        elif tag == "body":
+            self.done = True
+
+    def end(self, tag):
+        if tag == "title" and self._parts is not None and self._title is None:
+            self._title = "".join(self._parts)
+            self.done = True
+
+    def data(self, data):
+        if self._parts is not None and self._title is None:
+            self._parts.append(data)
+
+    def close(self):
+        if self._title is None and self._parts is not None:
+            # Document cut off inside the title
+            return "".join(self._parts)
+        return self._title
+
+
+class HostCapabilities(object):
+    """
+    Remembers per host whether Range requests and HEAD are honoured.
+
+    Only the most recently seen max_hosts hosts are remembered.
+    """
+
+    def __init__(self, max_hosts=4096):
+        self._max_hosts = max_hosts
+        self._hosts = OrderedDict()
+
+    def get(self, host, feature):
+        """Return True or False if known, None if the host is unknown."""
+        return self._hosts.get(host, {}).get(feature)
+
+    def set(self, host, feature, value):
+        self._hosts.setdefault(host, {})[feature] = value
+        self._hosts.move_to_end(host)
+        while len(self._hosts) > self._max_hosts:
+            self._hosts.popitem(last=False)
+
+
+class FetchStats(object):
+    """Request, byte and early rejection counters per fetch strategy."""
+
+    def __init__(self):
+        self._counters = {}
+
+    def record(self, strategy, requests=0, body_bytes=0, rejected=0):
+        counters = self._counters.get(strategy)
+        if counters is None:
+            counters = self._counters[strategy] = {
+                "requests": 0, "bytes": 0, "rejected": 0}
+        counters["requests"] += requests
+        counters["bytes"] += body_bytes
+        counters["rejected"] += rejected
+
+    def stats(self):
+        return {strategy: dict(counters)
+                for strategy, counters in self._counters.items()}
 
 
 class UrlHandler(object):
+    """
+    Fetches a URL and extracts its title.
+
+    The fetch strategy decides how much is requested up front:
+
+    - "get": a plain GET
+    - "range": a GET for the first range_bytes bytes, repeated without
+      the Range header if the title is not in them
+    - "head": a HEAD request first so unsupported content types are
+      rejected before any body is sent, then as "range"
+
+    Hosts that ignore Range or reject HEAD are remembered in
+    capabilities and not asked again.
+    """
 
     TIMEOUT = 30
+    STRATEGIES = ("get", "range", "head")
 
     def __init__(self, max_body, parser_class,
                  accepted_mimes=("text/html",),
                  headers={"Accept-Language": "en-US",
                           "User-Agent": ("nanobot title fetching, contacts to"
                                          "http://github.com/nanonyme/nanobot")
-                          }):
+                          },
+                 pool=None, streaming=True, strategy="get", range_bytes=65536,
+                 capabilities=None, fetch_stats=None, agent=None):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown fetch strategy {strategy}")
         self.max_body = max_body
         self.bytes = 0
         self.parser_class = parser_class
         self.parser = None
+        self.target = None
+        self.declared_encoding = None
+        self.encoding = None
+        self._head = None
         self.accepted_mimes = accepted_mimes
         self.headers = headers
+        self.pool = pool
+        self.agent = agent
+        self.streaming = streaming
+        self.strategy = strategy
+        self.range_bytes = range_bytes
+        self.capabilities = (HostCapabilities() if capabilities is None
+                             else capabilities)
+        self.fetch_stats = FetchStats() if fetch_stats is None else fetch_stats
+
+    def start_parser(self):
+        chunks = self._head
+        head = b"".join(chunks)
+        self._head = None
+        self.encoding = detect_encoding(head, self.declared_encoding)
+        try:
+            self.parser = self.make_parser(self.encoding)
+        except LookupError:
+            log.info(f"Parser does not support {self.encoding}")
+            self.parser = self.make_parser(None)
+        # Feed as received so parsing can stop at the end of the title
+        for chunk in chunks:
+            self.parser.feed(chunk)
+            if self.target is not None and self.target.done:
+                break
+
+    def make_parser(self, encoding):
+        if self.streaming:
+            self.target = TitleTarget()
+            return self.parser_class(target=self.target, encoding=encoding)
+        return self.parser_class(encoding=encoding)
 
     def feed(self, data):
-        if self.bytes < self.max_body:
-            if len(data) > self.max_body - self.bytes:
-                data = data[:self.max_body - self.bytes]
-            data_len = len(data)
-            self.bytes += data_len
-            self.parser.feed(data)
+        if len(data) > self.max_body - self.bytes:
+            data = data[:self.max_body - self.bytes]
+        self.bytes += len(data)
+        if self.parser is None:
+            self._head.append(data)
+            # Without a declared encoding wait for enough of the document
+            # to find a <meta> declaration
+            if (self.declared_encoding is None and
+                    self.bytes < min(SNIFF_BYTES, self.max_body)):
+                return
+            self.start_parser()
         else:
-            self.connection.cancel()
+            self.parser.feed(data)
+        if self.bytes >= self.max_body or (self.target is not None and
+                                           self.target.done):
+            # Makes treq close the connection instead of reading on
+            raise StopReading()
 
-    async def handle_response(self, response):
-        if response.code != 200:
-            raise AppException(f"Response code {response.code}")
+    def check_headers(self, response):
         try:
             headers = response.headers.getRawHeaders("Content-Type")
         except KeyError:
@@ -89,32 +483,101 @@ class UrlHandler(object):
         else:
             header = headers[0]
             log.info(f"Header line {header}")
-            mime, _, encoding = header.partition(";")
-            if encoding:
-                _, _, encoding = encoding.strip().partition("=")
-                try:
-                    codecs.lookup(encoding)
-                except LookupError:
-                    encoding = None
+            mime, _, params = header.partition(";")
+            encoding = None
+            for param in params.split(";"):
+                key, _, value = param.partition("=")
+                if key.strip().lower() == "charset":
+                    encoding = normalize_encoding(value.strip().strip("\"'"))
             if mime not in self.accepted_mimes:
+                self.fetch_stats.record(self.strategy, rejected=1)
                 raise AppException(f"Mime {mime} not supported")
-        if encoding:
-            log.info(f"Using encoding {encoding} to handle response")
-        self.parser = self.parser_class()
-        await response.collect(self.feed)
+        return encoding
+
+    async def handle_response(self, response):
+        if response.code not in (200, 206):
+            raise AppException(f"Response code {response.code}")
+        self.declared_encoding = self.check_headers(response)
+        self.bytes = 0
+        self.parser = None
+        self.target = None
+        self._head = []
+        try:
+            await response.collect(self.feed)
+        except StopReading:
+            log.info(f"Stopped reading after {self.bytes} bytes")
+        finally:
+            self.fetch_stats.record(self.strategy, body_bytes=self.bytes)
+        if self.parser is None:
+            # The whole body was shorter than SNIFF_BYTES
+            self.start_parser()
         return self.parser.close()
 
+    def client_options(self):
+        # The agent brings its own pool
+        if self.agent is not None:
+            return {"agent": self.agent}
+        return {"pool": self.pool}
+
+    async def request(self, method, url, headers):
+        self.fetch_stats.record(self.strategy, requests=1)
+        return await treq.request(method, url, timeout=self.TIMEOUT,
+                                  headers=headers, **self.client_options())
+
     async def get_url(self, url):
-        return await treq.get(url, timeout=self.TIMEOUT, headers=self.headers)
+        self.fetch_stats.record(self.strategy, requests=1)
+        return await treq.get(url, timeout=self.TIMEOUT, headers=self.headers,
+                              **self.client_options())
+
+    async def probe_head(self, url, host):
+        response = await self.request("HEAD", url, self.headers)
+        if response.code in (405, 501):
+            self.capabilities.set(host, "head", False)
+            return
+        self.capabilities.set(host, "head", True)
+        if response.code == 200:
+            self.check_headers(response)
+
+    async def get_range(self, url, host):
+        headers = dict(self.headers)
+        headers["Range"] = f"bytes=0-{self.range_bytes - 1}"
+        response = await self.request("GET", url, headers)
+        if response.code == 206:
+            self.capabilities.set(host, "range", True)
+        elif response.code in (200, 416):
+            # Some servers refuse ranges of empty or generated resources
+            self.capabilities.set(host, "range", False)
+        return response
+
+    async def fetch(self, url):
+        """Fetch a URL with the configured strategy and parse it."""
+        host = urlparse.urlparse(url).netloc.lower()
+        if (self.strategy == "head" and
+                self.capabilities.get(host, "head") is not False):
+            await self.probe_head(url, host)
+        if (self.strategy == "get" or
+                self.capabilities.get(host, "range") is False):
+            return await self.handle_response(await self.get_url(url))
+        response = await self.get_range(url, host)
+        if response.code == 416:
+            return await self.handle_response(await self.get_url(url))
+        result = await self.handle_response(response)
+        if (response.code == 206 and self.streaming and result is None and
+                self.bytes >= self.range_bytes):
+            # No title in the first range_bytes, read the whole page
+            result = await self.handle_response(await self.get_url(url))
+        return result
 
     async def get_title(self, url):
-        response = await self.get_url(url)
-        root = await self.handle_response(response)
+        result = await self.fetch(url)
 
-        titles = root.xpath("//title")
-        if not titles:
-            return ""
-        title = titles[0].text
+        if self.streaming:
+            title = result
+        else:
+            titles = result.xpath("//title")
+            if not titles:
+                return ""
+            title = titles[0].text
 
         if not title:
             return ""
@@ -122,24 +585,38 @@ class UrlHandler(object):
             return " ".join(title.split())
 
 
+# Edit distance from which a title counts as different from a URL
+DIFFERENCE = 7
+
+
 def difference_check(a, s):
     if len(a) < 14 or len(s) < 14:
-        if len(a) != len(s):
-            return True
-        else:
-            return a != s
-    else:
-        return Levenshtein.distance(a, s) >= 7
+        return a != s
+    if abs(len(a) - len(s)) >= DIFFERENCE:
+        # The distance is at least the difference in length
+        return True
+    # Stops computing once the distance is known to exceed the cutoff
+    return Levenshtein.distance(a, s,
+                                score_cutoff=DIFFERENCE - 1) >= DIFFERENCE
 
 def dynsearch(l, s):
-    a, b = l[0], l[1:]
-    if not b:
-        return difference_check(a, s)
-    else:
-        if not dynsearch(b, s):
+    """
+    Check that title s differs from every tail of the path segments l.
+
+    A single segment is compared as is; otherwise the joins of l[k:] are
+    compared from the last segment alone up to l[1:].
+    """
+    if len(l) == 1:
+        return difference_check(l[0], s)
+    suffix = ""
+    for segment in reversed(l[1:]):
+        suffix = segment + suffix
+        if len(suffix) - len(s) >= DIFFERENCE:
+            # This and all longer tails differ by length alone
+            return True
+        if not difference_check(suffix, s):
             return False
-        else:
-            return difference_check("".join(b), s)
+    return True
 
 def prepare_url(url):
     path = urlparse.unquote(urlparse.urlparse(url).path).replace("-", "")
@@ -147,86 +624,331 @@ def prepare_url(url):
     path = path.rstrip("0123456789")
     return path.split("/")
 
+TITLE_SEPARATOR = re.compile("[-–]")
+
+
 def prepare_title(title):
     title = title.replace("+", "").replace(" ", "").replace("_", "").lower()
-    return re.split("[-–]", title)[0]
+    return TITLE_SEPARATOR.split(title, 1)[0]
 
 class MessageHandler(object):
 
     _URL_HANDLER_CLASS = UrlHandler
 
-    def __init__(self, reactor, hits, misses, callback, max_len):
+    MAX_PARALLEL = 4
+
+    def __init__(self, reactor, hits, misses, callback, max_len,
+                 in_flight=None, limiter=None, max_parallel=MAX_PARALLEL,
+                 pool=None, fetch_options=None, blocklist=None):
         self._reactor = reactor
         self._hits = hits
         self._misses = misses
         self._max_len = max_len
         self._callback = callback
+        # Fetches in progress by URL, shared between handlers so
+        # concurrent lookups of one URL make a single request
+        self._in_flight = {} if in_flight is None else in_flight
+        # Fetch caps for this message and, if given, across all messages
+        self._semaphore = defer.DeferredSemaphore(max_parallel)
+        self._limiter = limiter
+        self._pool = pool
+        # Extra UrlHandler arguments such as the fetch strategy
+        self._fetch_options = fetch_options or {}
+        self._blocklist = DEFAULT_BLOCKLIST if blocklist is None \
+            else blocklist
 
     async def success(self, title, url):
         log.info(f"Got title {title}")
         if dynsearch(prepare_url(url), prepare_title(title)):
             log.info("Will try to send title as a message")
             await self._callback("title: %s" % title)
-            await task.deferLater(self._reactor, 2, defer.succeed,
-                                  None)
 
-    def fail(self, url):
-        self._misses.update(url, "miss")
+    def fail(self, url, key=None):
+        self._misses.update(canonicalize_url(url) if key is None else key,
+                            "miss")
         log.failure(f"Adding {url} to temporary block list")
 
+    def fetch_title(self, url, key=None):
+        """
+        Fetch the title of a URL, joining a fetch already in progress.
+
+        Fetches are shared by canonical key. Every caller gets its own
+        Deferred so cancelling one waiter does not affect the others; the
+        shared fetch is only cancelled once nobody waits for it. Only the
+        request itself takes a slot from the per-message and global caps,
+        callers joining a fetch do not.
+        """
+        if key is None:
+            key = canonicalize_url(url)
+        entry = self._in_flight.get(key)
+
+        def abandon(waiter):
+            waiters = entry[1]
+            waiters.remove(waiter)
+            if not waiters:
+                entry[0].cancel()
+
+        waiter = defer.Deferred(abandon)
+        if entry is not None:
+            entry[1].append(waiter)
+            return waiter
+        entry = self._in_flight[key] = [None, [waiter]]
+        handler = self._URL_HANDLER_CLASS(
+            max_body=2 * 1024 ** 2, parser_class=lxml.html.HTMLParser,
+            pool=self._pool, **self._fetch_options)
+
+        def get_title():
+            return defer.ensureDeferred(handler.get_title(url))
+
+        if self._limiter is not None:
+            get_title = functools.partial(self._limiter.run, get_title)
+        # The fetch may complete before run returns
+        entry[0] = fetch = self._semaphore.run(get_title)
+        fetch.addBoth(self._fetched, key)
+        return waiter
+
+    def _fetched(self, result, key):
+        _, waiters = self._in_flight.pop(key)
+        for waiter in waiters:
+            if isinstance(result, Failure):
+                waiter.errback(result)
+            else:
+                waiter.callback(result)
+
     async def find_links(self, message):
-        for m in re.finditer("(https?://[^ ]+)", message):
-            url = m.group(0)
-            if not acceptable_netloc(urlparse.urlparse(url).netloc):
-                continue
-            if self._misses.fetch(url):
-                log.info((f"Skipped title check for URL {url} because of "
-                    "previous failures"))
+        lookups = []
+        for url in extract_urls(message):
+            host = urlparse.urlparse(url).hostname
+            if not host or not acceptable_netloc(host, self._blocklist):
                 continue
-            title = self._hits.fetch(url)
-            if title is None:
-                log.info(f"Cache miss for URL {url}")
-                handler = self._URL_HANDLER_CLASS(
-                    max_body=2 * 1024 ** 2, parser_class=lxml.html.HTMLParser)
-                try:
-                    title = await handler.get_title(url)
-                except Exception:
-                    self.fail(url)
-                else:
-                    if len(title) > self._max_len:
-                        title = title[:self._max_len]
-                    if title:
-                        self._hits.update(url, title)
-                        await self.success(title, url)
-            else:
-                log.info(f"Cache hit for URL {url}")
-                await self.success(title, url)
+            lookups.append((url, defer.ensureDeferred(
+                self.lookup(url, canonicalize_url(url)))))
+        try:
+            # Fetches run concurrently but titles are sent in message order
+            for url, lookup in lookups:
+                title = await lookup
+                if title:
+                    await self.success(title, url)
+        except defer.CancelledError:
+            for _, lookup in lookups:
+                lookup.cancel()
+            raise
+
+    async def lookup(self, url, key=None):
+        if key is None:
+            key = canonicalize_url(url)
+        if self._misses.fetch(key):
+            log.info((f"Skipped title check for URL {url} because of "
+                "previous failures"))
+            return None
+        title = self._hits.fetch(key)
+        if title is not None:
+            log.info(f"Cache hit for URL {url}")
+            return title
+        log.info(f"Cache miss for URL {url}")
+        try:
+            title = await self.fetch_title(url, key)
+        except defer.CancelledError:
+            raise
+        except Exception:
+            self.fail(url, key)
+            return None
+        if len(title) > self._max_len:
+            title = title[:self._max_len]
+        if title:
+            self._hits.update(key, title)
+        return title
+
+
+class CacheStore(object):
+    """
+    On-disk cache tier kept in sqlite so cached titles survive restarts.
+
+    Entries are kept per namespace so one database can back several
+    UrlCache instances. Writes are collected for FLUSH_DELAY seconds and
+    committed in one transaction instead of one commit per update. Once
+    closed the store stays empty and ignores writes, so lookups still in
+    progress when the plugin is unloaded can finish.
+    """
+
+    FLUSH_DELAY = 1.0
+
+    _SCHEMA = ("create table if not exists cache "
+               "(namespace text, key text, value text, expires real, "
+               "primary key (namespace, key))",
+               "create index if not exists cache_expires on cache (expires)")
+
+    def __init__(self, reactor, path, flush_delay=FLUSH_DELAY):
+        self._reactor = reactor
+        self._flush_delay = flush_delay
+        self._pending = {}
+        self._flush_call = None
+        self._conn = sqlite3.connect(path)
+        with self._conn:
+            for statement in self._SCHEMA:
+                self._conn.execute(statement)
+
+    def get(self, namespace, key, now):
+        if self._conn is None:
+            return None
+        row = self._pending.get((namespace, key))
+        if row is None:
+            row = self._conn.execute(
+                "select value, expires from cache "
+                "where namespace=? and key=?", (namespace, key)).fetchone()
+        if row is None or row[1] <= now:
+            return None
+        return row
+
+    def put(self, namespace, key, value, expires):
+        if self._conn is None:
+            return
+        self._pending[(namespace, key)] = (value, expires)
+        if self._flush_call is None:
+            self._flush_call = self._reactor.callLater(self._flush_delay,
+                                                       self.flush)
+
+    def flush(self):
+        """Commit the collected writes."""
+        if self._flush_call is not None and self._flush_call.active():
+            self._flush_call.cancel()
+        self._flush_call = None
+        if not self._pending:
+            return
+        rows = [(namespace, key, value, expires)
+                for (namespace, key), (value, expires)
+                in self._pending.items()]
+        self._pending = {}
+        with self._conn:
+            self._conn.executemany(
+                "insert or replace into cache values (?, ?, ?, ?)", rows)
+
+    def delete_expired(self, now):
+        if self._conn is None:
+            return
+        self.flush()
+        with self._conn:
+            self._conn.execute("delete from cache where expires<=?", (now,))
+
+    def size(self, namespace):
+        if self._conn is None:
+            return 0
+        self.flush()
+        return self._conn.execute(
+            "select count(*) from cache where namespace=?",
+            (namespace,)).fetchone()[0]
+
+    def close(self):
+        if self._conn is None:
+            return
+        self.flush()
+        self._conn.close()
+        self._conn = None
 
 
 class UrlCache(object):
+    """
+    LRU cache with per-entry expiry times.
 
-    def __init__(self, reactor, expiration=60):
+    Keys are also filed in a timer wheel of RESOLUTION second slots, with
+    a heap of the occupied slots, so the reaper only visits entries that
+    have expired, at most REAP_BATCH of them per reactor iteration. Keys
+    that were since updated or evicted are skipped when their slot comes.
+    """
+
+    RESOLUTION = 1.0
+    REAP_BATCH = 1000
+
+    def __init__(self, reactor, expiration=60, max_entries=1024,
+                 store=None, namespace="urls"):
         self._reactor = reactor
         self._expiration = expiration
-        self._db = {}
+        self._max_entries = max_entries
+        self._store = store
+        self._namespace = namespace
+        self._db = OrderedDict()
+        self._wheel = {}
+        self._slots = []
+        self._scheduled = 0
+        self._next_batch = None
         self._reaper = task.LoopingCall(self._reap)
         self._reaper.clock = reactor
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
 
     def fetch(self, key):
+        now = self._reactor.seconds()
         try:
-            value = self._db[key]["value"]
+            value, expires = self._db[key]
         except KeyError:
-            value = None
+            value = self._fetch_stored(key, now)
+        else:
+            if expires <= now:
+                del self._db[key]
+                value = None
+            else:
+                self._db.move_to_end(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def _fetch_stored(self, key, now):
+        if self._store is None:
+            return None
+        row = self._store.get(self._namespace, key, now)
+        if row is None:
+            return None
+        self.disk_hits += 1
+        value, expires = row
+        self._remember(key, value, expires)
         return value
 
-    def update(self, key, value):
-        self._db[key] = {"value": value,
-                         "timestamp": self._reactor.seconds()}
+    def update(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self._expiration
+        expires = self._reactor.seconds() + ttl
+        self._remember(key, value, expires)
+        if self._store is not None:
+            self._store.put(self._namespace, key, value, expires)
+
+    def _remember(self, key, value, expires):
+        self._db[key] = (value, expires)
+        self._db.move_to_end(key)
+        self._schedule(key, expires)
+        while len(self._db) > self._max_entries:
+            self._db.popitem(last=False)
+        if self._scheduled > 2 * len(self._db) + self.REAP_BATCH:
+            # Mostly superseded keys, rebuild from the live entries
+            self._wheel = {}
+            self._slots = []
+            self._scheduled = 0
+            for key, (_, expires) in self._db.items():
+                self._schedule(key, expires)
 
-    def _valid(self):
-        for key, value in self._db.items():
-            if self._reactor.seconds() - value["timestamp"] < self._expiration:
-                yield key, value
+    def _schedule(self, key, expires):
+        slot = math.ceil(expires / self.RESOLUTION)
+        keys = self._wheel.get(slot)
+        if keys is None:
+            keys = self._wheel[slot] = []
+            heapq.heappush(self._slots, slot)
+        keys.append(key)
+        self._scheduled += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self._db),
+            "max_size": self._max_entries,
+            "disk_size": (self._store.size(self._namespace)
+                          if self._store is not None else 0),
+        }
 
     def enable(self):
         if not self._reaper.running:
@@ -235,9 +957,173 @@ class UrlCache(object):
     def disable(self):
         if self._reaper.running:
             self._reaper.stop()
+        if self._next_batch is not None and self._next_batch.active():
+            self._next_batch.cancel()
 
     def _reap(self):
-        self._db = dict(self._valid())
+        if self._next_batch is not None and self._next_batch.active():
+            return
+        self._next_batch = None
+        now = self._reactor.seconds()
+        db = self._db
+        slots = self._slots
+        budget = self.REAP_BATCH
+        while slots and slots[0] * self.RESOLUTION <= now:
+            keys = self._wheel[slots[0]]
+            while keys and budget:
+                key = keys.pop()
+                budget -= 1
+                self._scheduled -= 1
+                entry = db.get(key)
+                if entry is not None and entry[1] <= now:
+                    del db[key]
+            if keys:
+                self._next_batch = self._reactor.callLater(0, self._reap)
+                return
+            del self._wheel[heapq.heappop(slots)]
+        if self._store is not None:
+            self._store.delete_expired(now)
+
+
+RESOLV_CONF = b"/etc/resolv.conf"
+HOSTS_FILE = b"/etc/hosts"
+
+
+class CachingResolver(object):
+    """
+    Resolves host names to addresses through twisted.names.
+
+    Answers are cached for their DNS TTL, clamped to [min_ttl, max_ttl].
+    """
+
+    def __init__(self, reactor, resolver=None, min_ttl=30, max_ttl=3600,
+                 max_entries=1024):
+        self._reactor = reactor
+        self._resolver = resolver
+        self._client = None
+        self._min_ttl = min_ttl
+        self._max_ttl = max_ttl
+        self.cache = UrlCache(reactor, expiration=min_ttl,
+                              max_entries=max_entries, namespace="dns")
+
+    @property
+    def resolver(self):
+        if self._resolver is None:
+            # Same chain as createResolver, which always uses the global
+            # reactor, minus its cache since answers are cached here
+            self._client = dns_client.Resolver(resolv=RESOLV_CONF,
+                                               reactor=self._reactor)
+            self._resolver = resolve.ResolverChain([
+                hosts.Resolver(HOSTS_FILE), self._client])
+        return self._resolver
+
+    def close(self):
+        """Stop re-reading resolv.conf for the default resolver."""
+        parse_call = getattr(self._client, "_parseCall", None)
+        if parse_call is not None and parse_call.active():
+            parse_call.cancel()
+
+    async def resolve(self, host):
+        """Return the IPv4 and IPv6 addresses of host, IPv4 first."""
+        addresses = self.cache.fetch(host)
+        if addresses is not None:
+            return addresses
+        results = await defer.DeferredList(
+            [self.resolver.lookupAddress(host),
+             self.resolver.lookupIPV6Address(host)], consumeErrors=True)
+        addresses = []
+        ttls = []
+        for success, result in results:
+            if not success:
+                continue
+            for record in result[0]:
+                if record.type == dns.A:
+                    addresses.append(record.payload.dottedQuad())
+                elif record.type == dns.AAAA:
+                    addresses.append(socket.inet_ntop(socket.AF_INET6,
+                                                      record.payload.address))
+                else:
+                    continue
+                ttls.append(record.ttl)
+        if not addresses:
+            for success, result in results:
+                if not success:
+                    result.raiseException()
+            raise AppException(f"No addresses for {host}")
+        ttl = min(max(min(ttls), self._min_ttl), self._max_ttl)
+        addresses = tuple(addresses)
+        self.cache.update(host, addresses, ttl=ttl)
+        return addresses
+
+
+class VettedEndpoint(object):
+    """
+    Client endpoint that resolves its host when connecting and only
+    connects to it if none of its addresses are blocked.
+
+    The connection is pinned to the vetted address so a second lookup
+    cannot swap in a different one.
+    """
+
+    def __init__(self, reactor, resolver, host, port, tls=None,
+                 blocklist=DEFAULT_BLOCKLIST):
+        self._reactor = reactor
+        self._resolver = resolver
+        self._host = host
+        self._port = port
+        self._tls = tls
+        self._blocklist = blocklist
+
+    async def _connect(self, factory):
+        try:
+            addresses = (str(ipaddress.ip_address(self._host)),)
+        except ValueError:
+            addresses = await self._resolver.resolve(self._host)
+        for address in addresses:
+            if address in self._blocklist:
+                raise AppException(
+                    f"Address {address} of {self._host} is blocked")
+        address = addresses[0]
+        if ":" in address:
+            endpoint = endpoints.TCP6ClientEndpoint(self._reactor, address,
+                                                    self._port)
+        else:
+            endpoint = endpoints.TCP4ClientEndpoint(self._reactor, address,
+                                                    self._port)
+        if self._tls is not None:
+            endpoint = endpoints.wrapClientTLS(self._tls, endpoint)
+        return await endpoint.connect(factory)
+
+    def connect(self, factory):
+        return defer.ensureDeferred(self._connect(factory))
+
+
+@implementer(IAgentEndpointFactory)
+class VettedEndpointFactory(object):
+    """
+    Endpoint factory for Agent that vets every connection, including
+    those made to follow redirects, against a blocklist.
+    """
+
+    def __init__(self, reactor, resolver, policy=None,
+                 blocklist=DEFAULT_BLOCKLIST):
+        self._reactor = reactor
+        self._resolver = resolver
+        self._policy = BrowserLikePolicyForHTTPS() if policy is None \
+            else policy
+        self._blocklist = blocklist
+
+    def endpointForURI(self, uri):
+        host = uri.host.decode("ascii").lower()
+        if host.startswith("["):
+            host = host[1:-1]
+        tls = None
+        if uri.scheme == b"https":
+            tls = self._policy.creatorForNetloc(uri.host, uri.port)
+        elif uri.scheme != b"http":
+            raise AppException(f"Unsupported scheme {uri.scheme}")
+        return VettedEndpoint(self._reactor, self._resolver, host, uri.port,
+                              tls, self._blocklist)
 
 
 class TitlePlugin(Plugin):
@@ -248,12 +1134,52 @@ class TitlePlugin(Plugin):
     def load(self):
         """Load the plugin, initialise URL caches and register privmsg handler."""
         log.info(f"Loading {self.name} plugin")
-        self._good_urls = UrlCache(self.reactor, expiration=3600)
+        cache_path = self.config.get('cache_path')
+        self._store = CacheStore(self.reactor, cache_path) \
+            if cache_path else None
+        cache_size = self.config.get('cache_size', 1024)
+        self._good_urls = UrlCache(self.reactor, expiration=3600,
+                                   max_entries=cache_size,
+                                   store=self._store, namespace="good")
         self._good_urls.enable()
-        self._bad_urls = UrlCache(self.reactor, expiration=60)
+        self._bad_urls = UrlCache(self.reactor, expiration=60,
+                                  max_entries=cache_size,
+                                  store=self._store, namespace="bad")
         self._bad_urls.enable()
         self._max_len = self.config.get('max_title_length', 200)
-        self.register_handler('privmsg', self.on_privmsg)
+        self._in_flight = {}
+        self._max_parallel = self.config.get(
+            'max_parallel_per_message', MessageHandler.MAX_PARALLEL)
+        self._fetch_limiter = defer.DeferredSemaphore(
+            self.config.get('max_parallel_fetches', 16))
+        self._pool = TitleConnectionPool(self.reactor)
+        self._pool.maxPersistentPerHost = self.config.get(
+            'max_persistent_per_host', 4)
+        self._pool.maxPersistent = self.config.get('max_persistent', 32)
+        self._pool.cachedConnectionTimeout = self.config.get(
+            'idle_timeout', 240)
+        self._resolver = CachingResolver(
+            self.reactor, min_ttl=self.config.get('dns_min_ttl', 30),
+            max_ttl=self.config.get('dns_max_ttl', 3600),
+            max_entries=self.config.get('dns_cache_size', 1024))
+        self._resolver.cache.enable()
+        # Operator ranges are added to the built-in ones
+        self._blocklist = IPBlocklist(BLOCKLIST +
+                                      self.config.get('blocklist', []))
+        self._agent = Agent.usingEndpointFactory(
+            self.reactor, VettedEndpointFactory(self.reactor, self._resolver,
+                                                blocklist=self._blocklist),
+            pool=self._pool)
+        self._capabilities = HostCapabilities()
+        self._fetch_stats = FetchStats()
+        self._fetch_options = {
+            "strategy": self.config.get('fetch_strategy', 'get'),
+            "range_bytes": self.config.get('range_bytes', 65536),
+            "capabilities": self._capabilities,
+            "fetch_stats": self._fetch_stats,
+            "agent": self._agent,
+        }
+        self.register_handler('privmsg', self.on_privmsg, regex="https?://")
         log.info(f"{self.name} plugin loaded successfully")
 
     def unload(self):
@@ -261,6 +1187,41 @@ class TitlePlugin(Plugin):
         log.info(f"Unloading {self.name} plugin")
         self._good_urls.disable()
         self._bad_urls.disable()
+        self._resolver.cache.disable()
+        self._resolver.close()
+        if self._store is not None:
+            self._store.close()
+        self._pool.closeCachedConnections()
+
+    def cache_stats(self):
+        """
+        Get hit-rate and size metrics of the title caches.
+
+        Returns:
+            Dictionary with the stats of the 'good' and 'bad' caches
+        """
+        return {"good": self._good_urls.stats(),
+                "bad": self._bad_urls.stats()}
+
+    def pool_stats(self):
+        """
+        Get per-host connection pool statistics.
+
+        Returns:
+            Dictionary mapping host names to their request, new connection
+            and reused connection counts
+        """
+        return self._pool.stats()
+
+    def fetch_stats(self):
+        """
+        Get request and byte counters per fetch strategy.
+
+        Returns:
+            Dictionary mapping strategy names to their request count,
+            body bytes read and responses rejected by content type
+        """
+        return self._fetch_stats.stats()
 
     def on_privmsg(self, protocol, user, channel, message):
         """
@@ -279,14 +1240,18 @@ class TitlePlugin(Plugin):
             target = channel
 
         async def callback(text):
-            protocol.msg(target, text)
+            # Titles wait behind replies to commands
+            protocol.msg(target, text, priority=PRIORITY_LOW)
 
         handler = MessageHandler(
             self.reactor, self._good_urls, self._bad_urls,
-            callback, self._max_len,
+            callback, self._max_len, in_flight=self._in_flight,
+            limiter=self._fetch_limiter, max_parallel=self._max_parallel,
+            pool=self._pool, fetch_options=self._fetch_options,
+            blocklist=self._blocklist,
         )
         d = defer.ensureDeferred(handler.find_links(message))
-        d.addErrback(lambda f: log.failure("Error in title plugin: {f}", f=f))
+        d.addErrback(lambda f: log.failure("Error in title plugin", failure=f))
         return d
 
 
@@ -1,4 +1,11 @@
+import re
 import string
+import functools
+from collections import namedtuple
+try:
+    import numpy
+except ImportError:
+    numpy = None
 BOOL_AND = "&"
 BOOL_OR = "|"
 BOOL_NOT = "~"
@@ -13,6 +20,13 @@ BOOL_SYNTAX = {
 }
 IDENTIFIER = string.ascii_letters + "_"
 WHITESPACE = " \t\r\n"
+COMPILE_CACHE_SIZE = 256
+
+_VAR = 0
+_CONST = 1
+_NOT = 2
+_AND = 3
+_OR = 4
 
 class EvalError(ValueError):
     def __init__(self, position, token):
@@ -21,29 +35,59 @@ class EvalError(ValueError):
         s = f"Invalid token {self.token} at position {self.position}"
         super(EvalError, self).__init__(s)
 
+class LimitError(EvalError):
+    def __init__(self, position, limit, maximum):
+        self.position = position
+        self.token = None
+        self.limit = limit
+        self.maximum = maximum
+        s = f"Expression exceeds {limit} of {maximum} at position {position}"
+        super(EvalError, self).__init__(s)
+
+# Resource limits for untrusted input; None disables a limit. Evaluation
+# visits every node at most once, so max_steps bounds the node count.
+EvalLimits = namedtuple("EvalLimits",
+                        ["max_length", "max_tokens", "max_depth", "max_steps"],
+                        defaults=(None, None, None, None))
+
+@functools.lru_cache(maxsize=None)
+def _tokenizer(tokens, whitespace):
+    # Whitespace wins over tokens, and both win over identifier characters,
+    # mirroring the order of checks in a character-by-character scan.
+    tokens = "".join(c for c in tokens if c not in whitespace)
+    identifier = "".join(c for c in IDENTIFIER
+                         if c not in tokens and c not in whitespace)
+    alternatives = [f"[{re.escape(identifier)}]+"]
+    if tokens:
+        alternatives.insert(0, f"[{re.escape(tokens)}]")
+    token_pattern = re.compile("|".join(alternatives))
+    invalid_pattern = re.compile(
+        f"[^{re.escape(whitespace + tokens + identifier)}]", re.DOTALL)
+    return token_pattern, invalid_pattern, identifier
+
+
+_BOOL_TOKENIZER = _tokenizer("".join(BOOL_SYNTAX), WHITESPACE)
+
+
 def tokenize(input_text, tokens, whitespace):
-    identifier = set(tokens) | set(whitespace) | set(IDENTIFIER)
-    buf = ""
-    buf_pos = -1
-    for i, c in enumerate(input_text):
-        if c in whitespace:
-            if buf:
-                yield buf_pos, buf
-                buf = ""
-        elif c in tokens:
-            if buf:
-                yield buf_pos, buf
-                buf = ""
-            yield i, c
-        elif c not in identifier:
-            raise EvalError(i, c)
-        else:
-            if not buf:
-                buf_pos = i
-            buf += c
-    if buf:
-        yield buf_pos, buf
-        
+    if tokens is BOOL_SYNTAX and whitespace is WHITESPACE:
+        token_pattern, invalid_pattern, identifier = _BOOL_TOKENIZER
+    else:
+        token_pattern, invalid_pattern, identifier = _tokenizer(
+            "".join(tokens), "".join(whitespace))
+    invalid = invalid_pattern.search(input_text)
+    if invalid is None:
+        end = len(input_text)
+    else:
+        # An identifier running into the invalid character is never
+        # emitted, so stop scanning where it starts.
+        end = len(input_text[:invalid.start()].rstrip(identifier))
+    # Everything before end is tokens or whitespace, which finditer skips.
+    for match in token_pattern.finditer(input_text, 0, end):
+        yield match.start(), match.group()
+    if invalid is not None:
+        raise EvalError(invalid.start(), invalid.group())
+
 def infix_to_postfix(tokens, syntax):
     stack = []
     for pos, token in tokens:
@@ -84,38 +128,272 @@ def boolify(token, truths):
     else:
         return False
 
-def eval_bool(input, truths):
+def eval_bool(input, truths, limits=None):
+    if limits is None:
+        return compile_bool(input).evaluate(truths)
+    return compile_bool(input, limits).evaluate(truths, limits.max_steps)
+
+class _Node(object):
+    __slots__ = ("op", "left", "right", "index")
+
+    def __init__(self, op, left, right, index):
+        self.op = op
+        # Identifier for _VAR, value for _CONST, operands otherwise
+        self.left = left
+        self.right = right
+        self.index = index
+
+
+class _Builder(object):
+    """
+    Builds a hash-consed expression DAG from postfix operations.
+
+    Identical sub-expressions share one node, and subtrees whose value
+    does not depend on the truths (x&~x, x|~x and anything absorbing
+    them) are folded into constants.
+    """
+
+    def __init__(self):
+        self._nodes = {}
+
+    def _node(self, key, op, left, right=None):
+        try:
+            return self._nodes[key]
+        except KeyError:
+            node = self._nodes[key] = _Node(op, left, right, len(self._nodes))
+            return node
+
+    def var(self, name):
+        return self._node((_VAR, name), _VAR, name)
+
+    def const(self, value):
+        return self._node((_CONST, value), _CONST, value)
+
+    def negate(self, node):
+        if node.op is _CONST:
+            return self.const(not node.left)
+        elif node.op is _NOT:
+            return node.left
+        return self._node((_NOT, node.index), _NOT, node)
+
+    def binary(self, op, left, right):
+        # absorbing is the value that decides the result on its own
+        absorbing = op is _OR
+        for a, b in ((left, right), (right, left)):
+            if a.op is _CONST:
+                return a if a.left is absorbing else b
+            if b.op is _NOT and b.left is a:
+                return self.const(absorbing)
+        if left is right:
+            return left
+        key = (op, min(left.index, right.index), max(left.index, right.index))
+        return self._node(key, op, left, right)
+
+
+def _topological(*roots):
+    order = []
+    seen = set()
+    stack = [(root, False) for root in roots]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            order.append(node)
+        elif node.index not in seen:
+            seen.add(node.index)
+            stack.append((node, True))
+            if node.op is _NOT:
+                stack.append((node.left, False))
+            elif node.op is not _VAR and node.op is not _CONST:
+                stack.append((node.right, False))
+                stack.append((node.left, False))
+    return order
+
+
+class CompiledBool(object):
+    """
+    Boolean expression compiled to a de-duplicated, constant-folded DAG.
+
+    Instances are immutable and can be evaluated any number of times
+    against different truth sets without re-tokenizing the source.
+    Evaluation short-circuits & and |, so a decided left operand skips
+    the right one entirely.
+    """
+    __slots__ = ("source", "_root", "_nodes", "_trailing")
+
+    def __init__(self, source, root, trailing=None):
+        self.source = source
+        self._root = root
+        # Position and node of a computed operand left over on the stack;
+        # reported with its value, exactly like the interpreter did.
+        self._trailing = trailing
+        roots = [root] if trailing is None else [root, trailing[1]]
+        nodes = _topological(*roots)
+        for index, node in enumerate(nodes):
+            node.index = index
+        self._nodes = tuple(nodes)
+
+    def _value(self, root, truths):
+        values = [None] * len(self._nodes)
+        stack = [root]
+        while stack:
+            node = stack[-1]
+            op = node.op
+            if op is _VAR:
+                values[node.index] = node.left in truths
+            elif op is _CONST:
+                values[node.index] = node.left
+            elif op is _NOT:
+                value = values[node.left.index]
+                if value is None:
+                    stack.append(node.left)
+                    continue
+                values[node.index] = not value
+            else:
+                value = values[node.left.index]
+                if value is None:
+                    stack.append(node.left)
+                    continue
+                # False decides &, True decides |
+                if value is (op is _AND):
+                    value = values[node.right.index]
+                    if value is None:
+                        stack.append(node.right)
+                        continue
+                values[node.index] = value
+            stack.pop()
+        return values[root.index]
+
+    def evaluate(self, truths, max_steps=None):
+        if max_steps is not None and len(self._nodes) > max_steps:
+            raise LimitError(0, "max_steps", max_steps)
+        if not isinstance(truths, (set, frozenset)):
+            truths = frozenset(truths)
+        if self._trailing is not None:
+            pos, node = self._trailing
+            raise EvalError(pos, self._value(node, truths))
+        return self._value(self._root, truths)
+
+    __call__ = evaluate
+
+    def evaluate_rows(self, truth_matrix, columns):
+        """Evaluate once per row of truth_matrix, in pure Python."""
+        columns = _column_index(columns)
+        results = []
+        for row in truth_matrix:
+            truths = {name for name, i in columns.items() if row[i]}
+            results.append(self.evaluate(truths))
+        return results
+
+    def evaluate_matrix(self, truth_matrix, columns):
+        """Evaluate against a NumPy boolean matrix, one result per row."""
+        columns = _column_index(columns)
+        matrix = numpy.asarray(truth_matrix, dtype=bool)
+        if matrix.ndim != 2 or matrix.shape[1] != len(columns):
+            raise ValueError(f"Expected a matrix with {len(columns)} columns, "
+                             f"got shape {matrix.shape}")
+        rows = matrix.shape[0]
+        values = []
+        for node in self._nodes:
+            op = node.op
+            if op is _VAR:
+                i = columns.get(node.left)
+                if i is None:
+                    values.append(numpy.zeros(rows, dtype=bool))
+                else:
+                    values.append(matrix[:, i])
+            elif op is _CONST:
+                values.append(numpy.full(rows, node.left, dtype=bool))
+            elif op is _NOT:
+                values.append(~values[node.left.index])
+            elif op is _AND:
+                values.append(values[node.left.index] &
+                              values[node.right.index])
+            else:
+                values.append(values[node.left.index] |
+                              values[node.right.index])
+        if self._trailing is not None and rows:
+            pos, node = self._trailing
+            raise EvalError(pos, bool(values[node.index][0]))
+        return numpy.array(values[self._root.index], dtype=bool)
+
+
+def _column_index(columns):
+    index = {name: i for i, name in enumerate(columns)}
+    if len(index) != len(columns):
+        raise ValueError("Duplicate identifier in columns")
+    return index
+
+
+def _limit_tokens(tokens, max_tokens, max_depth):
+    depth = 0
+    for count, (pos, token) in enumerate(tokens, 1):
+        if max_tokens is not None and count > max_tokens:
+            raise LimitError(pos, "max_tokens", max_tokens)
+        if token == LEFT_PAREN:
+            depth += 1
+            if max_depth is not None and depth > max_depth:
+                raise LimitError(pos, "max_depth", max_depth)
+        elif token == RIGHT_PAREN:
+            depth -= 1
+        yield pos, token
+
+
+def _compile(input, max_tokens=None, max_depth=None):
+    builder = _Builder()
+    # (position, node, identifier or None for computed values) per slot
     stack = []
     tokens = tokenize(input, BOOL_SYNTAX, WHITESPACE)
-    tokens = infix_to_postfix(tokens, BOOL_SYNTAX)
-    for pos, token in tokens:
+    if max_tokens is not None or max_depth is not None:
+        tokens = _limit_tokens(tokens, max_tokens, max_depth)
+    for pos, token in infix_to_postfix(tokens, BOOL_SYNTAX):
         if token == BOOL_NOT:
-            try:
-                pos_sym, sym = stack.pop()
-            except IndexError:
+            if not stack:
                 raise EvalError(pos, token)
-            else:
-                stack.append((pos_sym, not boolify(sym, truths)))
+            pos_sym, node, _ = stack[-1]
+            stack[-1] = (pos_sym, builder.negate(node), None)
         elif token in BOOL_SYNTAX:
             try:
-                pos_a, a = stack.pop()
-                pos_b, b = stack.pop()
+                pos_a, a, _ = stack.pop()
+                _, b, _ = stack.pop()
             except IndexError:
                 raise EvalError(pos, token)
+            if token == BOOL_AND:
+                node = builder.binary(_AND, b, a)
+            elif token == BOOL_OR:
+                node = builder.binary(_OR, b, a)
             else:
-                if a in BOOL_SYNTAX or b in BOOL_SYNTAX:
-                    raise EvalError(s)
-                a = boolify(a, truths)
-                b = boolify(b, truths)
-                if token == BOOL_AND:
-                    stack.append((pos_a, a and b))
-                elif token == BOOL_OR:
-                    stack.append((pos_a, a or b))
-                else:
-                    raise EvalError(pos, token)
+                raise EvalError(pos, token)
+            stack.append((pos_a, node, None))
         else:
-            stack.append((pos, token))
-    pos, token = stack.pop()
+            stack.append((pos, builder.var(token), token))
+    pos, node, token = stack.pop()
     if stack:
-        raise EvalError(pos, token)
-    return boolify(token, truths)
+        if token is not None:
+            raise EvalError(pos, token)
+        return CompiledBool(input, stack[0][1], (pos, node))
+    return CompiledBool(input, node)
+
+
+_compile_cached = functools.lru_cache(maxsize=COMPILE_CACHE_SIZE)(_compile)
+
+
+def compile_bool(input, limits=None):
+    if limits is None:
+        return _compile_cached(input)
+    if limits.max_length is not None and len(input) > limits.max_length:
+        raise LimitError(limits.max_length, "max_length", limits.max_length)
+    return _compile_cached(input, limits.max_tokens, limits.max_depth)
+
+
+def eval_bool_batch(input, truth_matrix, columns):
+    """
+    Evaluate input once per row of truth_matrix.
+
+    Columns of the matrix correspond to the identifiers in columns and
+    rows to truth assignments. Returns a NumPy boolean array when NumPy
+    is available, otherwise a list of bools.
+    """
+    compiled = compile_bool(input)
+    if numpy is None:
+        return compiled.evaluate_rows(truth_matrix, columns)
+    return compiled.evaluate_matrix(truth_matrix, columns)
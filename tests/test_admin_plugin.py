@@ -33,8 +33,12 @@ class MockProtocol:
         self.nickname = nickname
         self.joined = []
         self.left = []
+        self.sent = []
         self.bot = MockBot()
 
+    def msg(self, target, text, priority=None):
+        self.sent.append((target, text))
+
     def join(self, channel, key=None):
         self.joined.append((channel, key))
 
@@ -193,3 +197,63 @@ class AdminPluginWithDbTests(unittest.TestCase):
             self.protocol, "nobody!u@h", "#chan", "!reincarnate"
         )
         self.assertEqual(len(self.protocol.bot._proc.signals), 0)
+
+    def test_stats_when_disabled(self):
+        """Test !stats reports that statistics are disabled."""
+        self.plugin.on_privmsg(
+            self.protocol, self.superadmin_mask, "#chan", "!stats"
+        )
+        self.assertEqual(self.protocol.sent,
+                         [("#chan", "Handler statistics are disabled")])
+
+    def test_stats_as_superadmin(self):
+        """Test !stats reports per-plugin handler statistics."""
+        self.registry.enable_stats()
+        self.registry.dispatch('user_joined', self.protocol, 'nick', '#chan')
+        self.registry.register_handler(
+            'user_joined', lambda protocol, *args: None, owner='greeter')
+        self.registry.dispatch('user_joined', self.protocol, 'nick', '#chan')
+        self.plugin.on_privmsg(
+            self.protocol, self.superadmin_mask, "testbot", "!stats"
+        )
+        self.assertEqual(len(self.protocol.sent), 1)
+        target, text = self.protocol.sent[0]
+        self.assertEqual(target, "superuser")
+        self.assertTrue(text.startswith("greeter user_joined: 1 calls, "
+                                        "0 errors, call mean"))
+
+    def test_stats_as_non_superadmin(self):
+        """Test !stats by a non-admin sends nothing."""
+        self.registry.enable_stats()
+        self.plugin.on_privmsg(
+            self.protocol, "nobody!u@h", "#chan", "!stats"
+        )
+        self.assertEqual(self.protocol.sent, [])
+
+    def test_reload_as_superadmin(self):
+        """Test !reload reports the result of reloading a plugin."""
+        reloaded = []
+
+        def reload_plugin(name):
+            reloaded.append(name)
+            return name == "title"
+
+        self.registry.reload_plugin = reload_plugin
+        self.plugin.on_privmsg(
+            self.protocol, self.superadmin_mask, "#chan", "!reload title"
+        )
+        self.plugin.on_privmsg(
+            self.protocol, self.superadmin_mask, "#chan", "!reload nope"
+        )
+        self.assertEqual(reloaded, ["title", "nope"])
+        self.assertEqual(self.protocol.sent,
+                         [("#chan", "Reloaded plugin title"),
+                          ("#chan", "Failed to reload plugin nope")])
+
+    def test_reload_as_non_superadmin(self):
+        """Test !reload by a non-admin does not reload anything."""
+        self.registry.reload_plugin = lambda name: self.fail(name)
+        self.plugin.on_privmsg(
+            self.protocol, "nobody!u@h", "#chan", "!reload title"
+        )
+        self.assertEqual(self.protocol.sent, [])
@@ -112,7 +112,7 @@ class MockIRCProtocol:
         self.describes = []
         self.notices = []
     
-    def msg(self, user, message):
+    def msg(self, user, message, priority=None):
         self.sent.append(("msg", user, message))
     
     def join(self, channel, key=None):
@@ -232,6 +232,47 @@ class NanoBotProtocolTests(unittest.TestCase):
         self.assertEqual(len(handler_calls), 1)
         self.assertEqual(handler_calls[0], ("user1!~user@host", "#test", "test message"))
 
+    def test_event_dispatch_applies_filters(self):
+        """Test that filtered handlers only receive matching events"""
+        from plugin import PluginRegistry
+
+        registry = PluginRegistry(self.clock, {})
+        handler_calls = []
+
+        def test_handler(protocol, user, channel, message):
+            handler_calls.append(message)
+
+        registry.register_handler('privmsg', test_handler, prefix='!cmd')
+        self.bot.plugin_registry = registry
+
+        self.protocol.privmsg("user1!~user@host", "#test", "test message")
+        self.protocol.privmsg("user1!~user@host", "#test", "!cmd arg")
+
+        self.assertEqual(handler_calls, ["!cmd arg"])
+
+    def test_event_dispatch_survives_unregister(self):
+        """Test that handlers unregistered mid-dispatch do not skip others"""
+        from plugin import PluginRegistry
+
+        registry = PluginRegistry(self.clock, {})
+        calls = []
+
+        def first(protocol, *args):
+            calls.append('first')
+            registry.unregister_handler('privmsg', first)
+
+        def second(protocol, *args):
+            calls.append('second')
+
+        registry.register_handler('privmsg', first)
+        registry.register_handler('privmsg', second)
+        self.bot.plugin_registry = registry
+
+        self.protocol.privmsg("user1!~user@host", "#test", "test")
+        self.protocol.privmsg("user1!~user@host", "#test", "test")
+
+        self.assertEqual(calls, ['first', 'second', 'second'])
+
     def test_event_dispatch_handles_handler_errors(self):
         """Test that handler errors don't break event dispatching"""
         from plugin import PluginRegistry
@@ -261,6 +302,148 @@ class NanoBotProtocolTests(unittest.TestCase):
         self.assertEqual(len(errors), 1)
 
 
+    def test_msg_is_flood_controlled(self):
+        """Test that msg sends through the output scheduler"""
+        self.server.network_config['output'] = {'burst': 2, 'rate': 1,
+                                                'target_burst': 10}
+        protocol = nanobot.NanoBotProtocol(self.clock, self.server, self.bot)
+        transport = proto_helpers.StringTransport()
+        protocol.makeConnection(transport)
+        for i in range(3):
+            protocol.msg("#test1", f"line {i}")
+        self.assertEqual(transport.value().count(b"PRIVMSG"), 2)
+        self.assertEqual(protocol.output_stats()["queued"], 1)
+        self.clock.advance(1)
+        self.assertIn(b"PRIVMSG #test1 :line 2", transport.value())
+
+    def test_msg_priority(self):
+        """Test that high priority messages overtake queued ones"""
+        self.server.network_config['output'] = {'burst': 1, 'rate': 1}
+        protocol = nanobot.NanoBotProtocol(self.clock, self.server, self.bot)
+        transport = proto_helpers.StringTransport()
+        protocol.makeConnection(transport)
+        protocol.msg("#test1", "first")
+        protocol.msg("#test1", "title", priority=nanobot.PRIORITY_LOW)
+        protocol.msg("user1", "reply", priority=nanobot.PRIORITY_HIGH)
+        self.clock.advance(1)
+        lines = transport.value().decode().splitlines()
+        self.assertEqual(lines[-1], "PRIVMSG user1 :reply")
+
+    def test_notice_and_describe_are_flood_controlled(self):
+        """Test that notices and actions share the msg flood limits"""
+        self.server.network_config['output'] = {'burst': 2, 'rate': 1,
+                                                'target_burst': 10}
+        protocol = nanobot.NanoBotProtocol(self.clock, self.server, self.bot)
+        transport = proto_helpers.StringTransport()
+        protocol.makeConnection(transport)
+        remote = nanobot.RemoteProtocol(protocol)
+        remote.remote_msg("#test1", "same")
+        remote.remote_notice("#test1", "same")
+        remote.remote_describe("#test1", "waves")
+        self.assertEqual(transport.value().decode().splitlines()[-2:],
+                         ["PRIVMSG #test1 :same", "NOTICE #test1 :same"])
+        self.assertEqual(protocol.output_stats()["queued"], 1)
+        self.clock.advance(1)
+        self.assertEqual(transport.value().decode().splitlines()[-1],
+                         "PRIVMSG #test1 :\x01ACTION waves\x01")
+
+    def test_connection_lost_clears_output(self):
+        """Test that queued output is dropped with the connection"""
+        for i in range(10):
+            self.protocol.msg("#test1", f"line {i}")
+        self.protocol.connectionLost(None)
+        self.assertEqual(self.protocol.output_stats()["queued"], 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+class OutputSchedulerTests(unittest.TestCase):
+    """Tests for OutputScheduler flood control"""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.sent = []
+
+    def make_scheduler(self, **kwargs):
+        def send(command, target, text, length):
+            self.sent.append((self.clock.seconds(), target, text))
+        return nanobot.OutputScheduler(self.clock, send, **kwargs)
+
+    def test_connection_bucket(self):
+        """Test burst followed by the connection rate"""
+        scheduler = self.make_scheduler(burst=2, rate=1, target_burst=10)
+        for i in range(4):
+            scheduler.enqueue("#a", f"line {i}")
+        self.clock.pump([0.5] * 8)
+        self.assertEqual([at for at, _, _ in self.sent], [0, 0, 1, 2])
+
+    def test_target_bucket(self):
+        """Test that a busy target does not hold up other targets"""
+        scheduler = self.make_scheduler(burst=10, target_burst=1,
+                                        target_rate=0.5)
+        scheduler.enqueue("#a", "one")
+        scheduler.enqueue("#a", "two")
+        scheduler.enqueue("#b", "three")
+        self.clock.pump([1] * 3)
+        self.assertEqual(self.sent, [(0, "#a", "one"), (0, "#b", "three"),
+                                     (2, "#a", "two")])
+
+    def test_priority_order(self):
+        """Test that higher priority lines are sent first"""
+        scheduler = self.make_scheduler(burst=1, rate=1, target_burst=10)
+        scheduler.enqueue("#a", "now")
+        scheduler.enqueue("#a", "low", nanobot.PRIORITY_LOW)
+        scheduler.enqueue("#a", "normal")
+        scheduler.enqueue("#b", "high", nanobot.PRIORITY_HIGH)
+        self.clock.pump([1] * 3)
+        self.assertEqual([text for _, _, text in self.sent],
+                         ["now", "high", "normal", "low"])
+
+    def test_coalesce_duplicates(self):
+        """Test that a line identical to a queued one is dropped"""
+        scheduler = self.make_scheduler(burst=1, rate=1)
+        scheduler.enqueue("#a", "now")
+        scheduler.enqueue("#a", "same")
+        scheduler.enqueue("#a", "same")
+        scheduler.enqueue("#b", "same")
+        self.clock.pump([1] * 5)
+        self.assertEqual([(target, text) for _, target, text in self.sent],
+                         [("#a", "now"), ("#a", "same"), ("#b", "same")])
+        self.assertEqual(scheduler.stats()["coalesced"], 1)
+
+    def test_full_queue_evicts_lower_priority(self):
+        """Test that a full queue makes room by dropping lower priority"""
+        scheduler = self.make_scheduler(burst=1, rate=1, max_queue=2)
+        scheduler.enqueue("#a", "now")
+        scheduler.enqueue("#a", "title 1", nanobot.PRIORITY_LOW)
+        scheduler.enqueue("#a", "title 2", nanobot.PRIORITY_LOW)
+        scheduler.enqueue("#a", "reply", nanobot.PRIORITY_HIGH)
+        scheduler.enqueue("#a", "title 3", nanobot.PRIORITY_LOW)
+        stats = scheduler.stats()
+        self.assertEqual(stats["queued_by_priority"], [1, 0, 1])
+        self.assertEqual(stats["dropped"], 2)
+        self.clock.pump([2] * 3)
+        self.assertEqual([text for _, _, text in self.sent],
+                         ["now", "reply", "title 1"])
+
+    def test_stats(self):
+        """Test queue depth and counters"""
+        scheduler = self.make_scheduler(burst=1, rate=1)
+        scheduler.enqueue("#a", "one")
+        scheduler.enqueue("#a", "two", nanobot.PRIORITY_LOW)
+        self.assertEqual(scheduler.stats(), {
+            "queued": 1, "queued_by_priority": [0, 0, 1], "sent": 1,
+            "dropped": 0, "coalesced": 0})
+
+    def test_idle_buckets_forgotten(self):
+        """Test that per-target buckets do not accumulate"""
+        scheduler = self.make_scheduler(target_burst=1, target_rate=1)
+        scheduler.enqueue("#a", "one")
+        scheduler.enqueue("#b", "two")
+        self.clock.advance(1)
+        scheduler.enqueue("#c", "three")
+        self.assertEqual(list(scheduler._targets), ["#c"])
+
+
 class ServerConnectionTests(unittest.TestCase):
     """Tests for ServerConnection factory"""
     
@@ -1,11 +1,23 @@
 from twisted.trial import unittest
-from twisted.internet import task, defer
+from twisted.internet import task, defer, protocol
+from twisted.internet.testing import MemoryReactorClock
+from twisted.names import client as dns_client, dns, error
+from twisted.protocols.tls import TLSMemoryBIOFactory
+from twisted.web.client import URI
 from collections import OrderedDict
 import nanobot
 import app
+import codecs
+import ipaddress
+import random
 import string
 import twisted.internet.base
-from plugins.title_plugin import UrlCache, MessageHandler, AppException
+from plugins import title_plugin
+from plugins.title_plugin import (UrlCache, CacheStore, MessageHandler,
+                                  AppException, TitleConnectionPool,
+                                  UrlHandler)
+import lxml.html
+import Levenshtein
 twisted.internet.base.DelayedCall.debug = True
 
 class CacheTests(unittest.TestCase):
@@ -41,6 +53,150 @@ class CacheTests(unittest.TestCase):
         self.assertEquals(self.cache.fetch("foo"),
                           "bar", "Expected cache to have 'foo' for 'bar'")
 
+    def testFetchSkipsExpiredBeforeReap(self):
+        self.cache.update("foo", "bar", ttl=10)
+        self.clock.advance(10)
+        self.assertIs(self.cache.fetch("foo"), None)
+
+    def testPerEntryTtl(self):
+        self.cache.update("short", "a", ttl=5)
+        self.cache.update("long", "b")
+        self.clock.advance(30)
+        self.assertIs(self.cache.fetch("short"), None)
+        self.assertEqual(self.cache.fetch("long"), "b")
+
+    def testLruEviction(self):
+        cache = UrlCache(reactor=self.clock, expiration=60, max_entries=2)
+        cache.update("a", "1")
+        cache.update("b", "2")
+        cache.fetch("a")
+        cache.update("c", "3")
+        self.assertEqual(cache.fetch("a"), "1")
+        self.assertIs(cache.fetch("b"), None)
+        self.assertEqual(cache.stats()["size"], 2)
+
+    def testStats(self):
+        self.cache.update("foo", "bar")
+        self.cache.fetch("foo")
+        self.cache.fetch("foo")
+        self.cache.fetch("missing")
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 1)
+        self.assertAlmostEqual(stats["hit_rate"], 2 / 3)
+        self.assertEqual(stats["size"], 1)
+
+    def testReapOnlyExpired(self):
+        self.cache.update("short", "a", ttl=5)
+        self.cache.update("long", "b", ttl=600)
+        self.clock.advance(60)
+        self.assertEqual(list(self.cache._db), ["long"])
+        self.assertEqual(self.cache._scheduled, 1)
+        self.assertEqual(len(self.cache._slots), 1)
+
+    def testReapSkipsRefreshedEntries(self):
+        self.cache.update("foo", "old", ttl=10)
+        self.cache.update("foo", "new", ttl=100)
+        self.clock.advance(60)
+        self.assertEqual(self.cache.fetch("foo"), "new")
+
+    def testReapInBatches(self):
+        self.cache.REAP_BATCH = 10
+        for i in range(25):
+            self.cache.update(i, i, ttl=1)
+        self.cache.update("keep", "x", ttl=600)
+        self.clock.advance(30)
+        self.cache._reap()
+        self.assertEqual(len(self.cache._db), 16)
+        self.clock.advance(0)
+        self.assertEqual(list(self.cache._db), ["keep"])
+
+    def testDisableCancelsPendingBatch(self):
+        self.cache.REAP_BATCH = 1
+        self.cache.update("a", "1", ttl=1)
+        self.cache.update("b", "2", ttl=1)
+        self.clock.advance(30)
+        self.cache._reap()
+        self.cache.disable()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def testSupersededItemsCompacted(self):
+        cache = UrlCache(reactor=self.clock, expiration=60, max_entries=1)
+        for i in range(5000):
+            cache.update(i, i)
+        self.assertLessEqual(cache._scheduled, 2 + cache.REAP_BATCH + 1)
+
+
+class PersistentCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.path = self.mktemp()
+        self.store = CacheStore(self.clock, self.path)
+        self.addCleanup(self.store.close)
+
+    def testSurvivesRestart(self):
+        cache = UrlCache(reactor=self.clock, expiration=60, store=self.store)
+        cache.update("foo", "bar")
+        self.store.close()
+        self.store = CacheStore(self.clock, self.path)
+        cache = UrlCache(reactor=self.clock, expiration=60, store=self.store)
+        self.assertEqual(cache.fetch("foo"), "bar")
+        self.assertEqual(cache.stats()["disk_hits"], 1)
+
+    def testDiskTierBehindEvictedEntries(self):
+        cache = UrlCache(reactor=self.clock, expiration=60, max_entries=1,
+                         store=self.store)
+        cache.update("a", "1")
+        cache.update("b", "2")
+        self.assertEqual(cache.fetch("a"), "1")
+        stats = cache.stats()
+        self.assertEqual(stats["size"], 1)
+        self.assertEqual(stats["disk_size"], 2)
+
+    def testDiskEntriesExpire(self):
+        cache = UrlCache(reactor=self.clock, expiration=60, max_entries=1,
+                         store=self.store)
+        cache.update("a", "1", ttl=5)
+        cache.update("b", "2")
+        self.clock.advance(5)
+        self.assertIs(cache.fetch("a"), None)
+        cache._reap()
+        self.assertEqual(cache.stats()["disk_size"], 1)
+
+    def testWritesAreBatched(self):
+        cache = UrlCache(reactor=self.clock, expiration=60, max_entries=1,
+                         store=self.store)
+        commits = []
+        self.store._conn.set_trace_callback(
+            lambda statement: commits.append(statement)
+            if statement == "COMMIT" else None)
+        for i in range(10):
+            cache.update(str(i), str(i))
+        self.assertEqual(commits, [])
+        self.assertEqual(cache.fetch("0"), "0")
+        self.clock.advance(CacheStore.FLUSH_DELAY)
+        self.assertEqual(commits, ["COMMIT"])
+        self.assertEqual(cache.stats()["disk_size"], 10)
+
+    def testClosedStoreIgnoresWrites(self):
+        cache = UrlCache(reactor=self.clock, expiration=60, store=self.store)
+        cache.update("a", "1")
+        self.store.close()
+        cache.update("b", "2")
+        self.assertEqual(cache.fetch("b"), "2")
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.store = CacheStore(self.clock, self.path)
+        self.assertEqual(self.store.size("urls"), 1)
+
+    def testNamespacesAreSeparate(self):
+        good = UrlCache(reactor=self.clock, store=self.store, namespace="good")
+        bad = UrlCache(reactor=self.clock, store=self.store, namespace="bad")
+        good.update("http://foo/", "Foo")
+        self.assertIs(bad.fetch("http://foo/"), None)
+        bad.update("http://foo/", "miss")
+        self.assertEqual(good.fetch("http://foo/"), "Foo")
+
+
 class IgnorantCache(object):
     def __init__(self):
         pass
@@ -54,6 +210,8 @@ class IgnorantCache(object):
 
 class MockResponse(object):
     def __init__(self, data, headers, code):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
         self.data = data
         self.code = code or 200
         if headers is None:
@@ -88,6 +246,24 @@ class MockTreq(object):
         return defer.succeed(MockResponse(data, headers, code))
 
 
+class PendingTreq(object):
+    """Treq stand-in whose requests complete when the test fires them."""
+
+    def __init__(self):
+        self.requests = []
+        self.cancelled = []
+
+    def get(self, url, timeout=None, headers={}):
+        d = defer.Deferred(lambda _: self.cancelled.append(url))
+        self.requests.append((url, d))
+        return d
+
+    def respond(self, index, title, code=None):
+        template = "<html><head><title>%s</title></head></html>"
+        self.requests[index][1].callback(
+            MockResponse(template % title, None, code))
+
+
 def patch_handler(handler, mock_treq):
 
     original_handler_class = handler._URL_HANDLER_CLASS
@@ -238,3 +414,894 @@ class TestMessageHandler(unittest.TestCase):
 def title_from_url(url):
     _, _, title = url.partition("#")
     return title
+
+
+class TestRequestCoalescing(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.in_flight = {}
+        self.treq = PendingTreq()
+        self.titles = []
+
+    def make_handler(self, misses=None, limiter=None):
+        async def callback(title):
+            self.titles.append(title)
+
+        handler = MessageHandler(self.clock, IgnorantCache(),
+                                 misses or IgnorantCache(), callback, 255,
+                                 in_flight=self.in_flight, limiter=limiter)
+        patch_handler(handler, self.treq)
+        return handler
+
+    def find_links(self, message, **kwargs):
+        return defer.ensureDeferred(
+            self.make_handler(**kwargs).find_links(message))
+
+    def testConcurrentLookupsShareFetch(self):
+        url = "http://meep.com/foo#shared"
+        first = self.find_links(url)
+        second = self.find_links("see " + url)
+        self.assertEqual(len(self.treq.requests), 1)
+        self.treq.respond(0, "shared")
+        self.clock.advance(2)
+        self.assertEqual(self.titles, ["title: shared", "title: shared"])
+        self.assertEqual(self.in_flight, {})
+        return defer.gatherResults([first, second])
+
+    def testWaitersTakeNoFetchSlot(self):
+        limiter = defer.DeferredSemaphore(2)
+        url = "http://meep.com/foo#shared"
+        first = self.find_links(url, limiter=limiter)
+        second = self.find_links(url, limiter=limiter)
+        self.assertEqual(limiter.tokens, 1)
+        third = self.find_links("http://meep.com/other", limiter=limiter)
+        self.assertEqual(len(self.treq.requests), 2)
+        self.treq.respond(0, "shared")
+        self.treq.respond(1, "other")
+        self.assertEqual(limiter.tokens, 2)
+        return defer.gatherResults([first, second, third])
+
+    def testFailureReachesAllWaiters(self):
+        url = "http://meep.com/foo#shared"
+        misses = []
+
+        class RecordingCache(IgnorantCache):
+            def update(self, key, value):
+                misses.append(key)
+
+        first = self.find_links(url, misses=RecordingCache())
+        second = self.find_links(url, misses=RecordingCache())
+        self.treq.respond(0, "shared", code=404)
+        self.assertEqual(misses, ["//meep.com/foo"] * 2)
+        self.assertEqual(len(self.flushLoggedErrors(AppException)), 2)
+        return defer.gatherResults([first, second])
+
+    def testUrlVariantsShareFetch(self):
+        first = self.find_links("http://meep.com/foo")
+        second = self.find_links(
+            "(see https://MEEP.com:443/foo/?utm_source=irc&fbclid=x).")
+        self.assertEqual(self.treq.requests[0][0], "http://meep.com/foo")
+        self.assertEqual(len(self.treq.requests), 1)
+        self.treq.respond(0, "shared")
+        self.clock.advance(2)
+        self.assertEqual(self.titles, ["title: shared", "title: shared"])
+        return defer.gatherResults([first, second])
+
+    def testLookupFetchesTrimmedUrl(self):
+        d = self.find_links("have you seen http://meep.com/foo_(bar)?!")
+        self.assertEqual(self.treq.requests[0][0],
+                         "http://meep.com/foo_(bar)")
+        self.treq.respond(0, "foo bar")
+        self.clock.advance(2)
+        return d
+
+    def testLaterLookupStartsNewFetch(self):
+        url = "http://meep.com/foo#shared"
+        first = self.find_links(url)
+        self.treq.respond(0, "shared")
+        self.clock.advance(2)
+        second = self.find_links(url)
+        self.assertEqual(len(self.treq.requests), 2)
+        self.treq.respond(1, "shared")
+        self.clock.advance(2)
+        return defer.gatherResults([first, second])
+
+    def testCancelledWaiterLeavesOthers(self):
+        url = "http://meep.com/foo#shared"
+        first = self.find_links(url)
+        second = self.find_links(url)
+        first.cancel()
+        self.failureResultOf(first, defer.CancelledError)
+        self.assertEqual(self.treq.cancelled, [])
+        self.treq.respond(0, "shared")
+        self.clock.advance(2)
+        self.assertEqual(self.titles, ["title: shared"])
+        return second
+
+    def testLastCancelledWaiterCancelsFetch(self):
+        url = "http://meep.com/foo#shared"
+        first = self.find_links(url)
+        second = self.find_links(url)
+        first.cancel()
+        second.cancel()
+        self.failureResultOf(first, defer.CancelledError)
+        self.failureResultOf(second, defer.CancelledError)
+        self.assertEqual(self.treq.cancelled, [url])
+        self.assertEqual(self.in_flight, {})
+
+
+class TestCanonicalUrl(unittest.TestCase):
+
+    def assertSameKey(self, *urls):
+        keys = {title_plugin.canonicalize_url(url) for url in urls}
+        self.assertEqual(len(keys), 1, keys)
+
+    def testSchemeAndHostCase(self):
+        self.assertSameKey("http://example.com/a", "HTTPS://Example.COM/a")
+
+    def testPathCaseKept(self):
+        self.assertNotEqual(title_plugin.canonicalize_url("http://x/a"),
+                            title_plugin.canonicalize_url("http://x/A"))
+
+    def testDefaultPorts(self):
+        self.assertSameKey("http://example.com:80/", "https://example.com:443",
+                           "http://example.com")
+        self.assertEqual(title_plugin.canonicalize_url("http://x:8080/a"),
+                         "//x:8080/a")
+
+    def testTrailingSlash(self):
+        self.assertSameKey("http://x/a", "http://x/a/")
+
+    def testTrackingParameters(self):
+        self.assertEqual(title_plugin.canonicalize_url(
+            "http://x/a?utm_source=irc&id=3&UTM_medium=x&gclid=1&fbclid=2"),
+            "//x/a?id=3")
+
+    def testFragmentDropped(self):
+        self.assertSameKey("https://x.com/a#top", "https://x.com/a#bottom",
+                           "https://x.com/a")
+        self.assertEqual(title_plugin.canonicalize_url("http://x/a?b=1#c"),
+                         "//x/a?b=1")
+
+    def testIdna(self):
+        self.assertSameKey("http://Bücher.example/",
+                           "http://xn--bcher-kva.example/")
+
+    def testIpv6(self):
+        self.assertEqual(title_plugin.canonicalize_url("http://[::1]:80/a"),
+                         "//[::1]/a")
+
+    def testInvalidPort(self):
+        self.assertEqual(title_plugin.canonicalize_url("http://x:port/a"),
+                         "//x/a")
+
+    def testTrimUrl(self):
+        trim = title_plugin.trim_url
+        self.assertEqual(trim("http://x/a."), "http://x/a")
+        self.assertEqual(trim("http://x/a\"),"), "http://x/a")
+        self.assertEqual(trim("http://x/a)"), "http://x/a")
+        self.assertEqual(trim("http://x/a_(b)"), "http://x/a_(b)")
+        self.assertEqual(trim("http://x/a_(b))."), "http://x/a_(b)")
+        self.assertEqual(trim("http://x/?q=a>"), "http://x/?q=a")
+
+
+class DelayedTreq(object):
+    """Treq stand-in answering each URL after a per-URL delay."""
+
+    def __init__(self, clock, delays):
+        self.clock = clock
+        self.delays = delays
+        self.started = []
+
+    def get(self, url, timeout=None, headers={}):
+        self.started.append((self.clock.seconds(), url))
+        _, _, title = url.partition("#")
+        data = "<html><head><title>%s</title></head></html>" % title
+        return task.deferLater(self.clock, self.delays[url], MockResponse,
+                               data, None, None)
+
+
+class TestParallelFetch(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.urls = ["http://meep.com/foo/bar.baz.html?page=%d#title%d"
+                     % (i, i) for i in range(5)]
+        # The first URL is the slowest
+        self.treq = DelayedTreq(self.clock, {
+            url: 5 - i for i, url in enumerate(self.urls)})
+        self.sent = []
+
+    def make_handler(self, **kwargs):
+        async def callback(title):
+            self.sent.append((self.clock.seconds(), title))
+
+        handler = MessageHandler(self.clock, IgnorantCache(),
+                                 IgnorantCache(), callback, 255, **kwargs)
+        patch_handler(handler, self.treq)
+        return handler
+
+    def run_message(self, **kwargs):
+        handler = self.make_handler(**kwargs)
+        d = defer.ensureDeferred(handler.find_links(" ".join(self.urls)))
+        self.clock.pump([1] * 30)
+        self.successResultOf(d)
+
+    def testLatencyTracksSlowestUrl(self):
+        self.run_message(max_parallel=5)
+        self.assertEqual([started for started, _ in self.treq.started],
+                         [0] * 5)
+        # All titles once the slowest fetch is done, in message order;
+        # pacing them is left to the protocol's output scheduler
+        self.assertEqual(self.sent, [
+            (5, "title: title%d" % i) for i in range(5)])
+
+    def testPerMessageCap(self):
+        self.run_message(max_parallel=2)
+        self.assertEqual([started for started, _ in self.treq.started],
+                         [0, 0, 4, 5, 7])
+        self.assertEqual([title for _, title in self.sent],
+                         ["title: title%d" % i for i in range(5)])
+
+    def testGlobalCap(self):
+        limiter = defer.DeferredSemaphore(1)
+        first = self.make_handler(limiter=limiter)
+        second = self.make_handler(limiter=limiter)
+        d1 = defer.ensureDeferred(first.find_links(self.urls[0]))
+        d2 = defer.ensureDeferred(second.find_links(self.urls[1]))
+        self.assertEqual(len(self.treq.started), 1)
+        self.clock.pump([1] * 20)
+        self.assertEqual([started for started, _ in self.treq.started],
+                         [0, 5])
+        self.successResultOf(d1)
+        self.successResultOf(d2)
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.closed = False
+
+    def loseConnection(self):
+        self.closed = True
+
+
+class FakeConnection(object):
+    state = "QUIESCENT"
+
+    def __init__(self):
+        self.transport = FakeTransport()
+
+    def abort(self):
+        self.transport.loseConnection()
+        return defer.succeed(None)
+
+
+class FakeEndpoint(object):
+    def connect(self, factory):
+        return defer.succeed(FakeConnection())
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.pool = TitleConnectionPool(self.clock)
+        self.pool.retryAutomatically = False
+
+    def tearDown(self):
+        self.pool.closeCachedConnections()
+
+    def request(self, host):
+        key = ("https", host, 443)
+        connection = self.successResultOf(
+            self.pool.getConnection(key, FakeEndpoint()))
+        self.pool._putConnection(key, connection)
+        return connection
+
+    def testHostStats(self):
+        self.request(b"example.com")
+        self.request(b"example.com")
+        self.request(b"github.com")
+        self.assertEqual(self.pool.stats(), {
+            "example.com": {"requests": 2, "connections": 1, "reused": 1},
+            "github.com": {"requests": 1, "connections": 1, "reused": 0}})
+
+    def testTotalCap(self):
+        self.pool.maxPersistent = 1
+        first = self.request(b"example.com")
+        second = self.request(b"github.com")
+        self.assertFalse(first.transport.closed)
+        self.assertTrue(second.transport.closed)
+
+    def testIdleTimeout(self):
+        self.pool.cachedConnectionTimeout = 10
+        connection = self.request(b"example.com")
+        self.clock.advance(10)
+        self.assertTrue(connection.transport.closed)
+
+    def testUrlHandlerUsesPool(self):
+        calls = []
+
+        def get(url, **kwargs):
+            calls.append(kwargs)
+            return defer.succeed(None)
+
+        self.patch(title_plugin.treq, "get", get)
+        handler = UrlHandler(max_body=10, parser_class=None, pool=self.pool)
+        self.successResultOf(defer.ensureDeferred(
+            handler.get_url("http://example.com")))
+        self.assertIs(calls[0]["pool"], self.pool)
+
+
+class ChunkedResponse(MockResponse):
+    """Response delivering its body in chunks, stopping like treq does."""
+
+    def __init__(self, chunks, headers=None):
+        if headers is None:
+            headers = {"content-type": ("text/html; charset=utf-8",)}
+        MockResponse.__init__(self, None, headers, 200)
+        self.chunks = chunks
+        self.delivered = 0
+
+    def collect(self, collector):
+        for chunk in self.chunks:
+            self.delivered += 1
+            try:
+                collector(chunk)
+            except Exception:
+                return defer.fail()
+        return defer.succeed(None)
+
+
+class TestStreamingTitle(unittest.TestCase):
+
+    def get_title(self, chunks, **kwargs):
+        response = ChunkedResponse(chunks)
+        handler = UrlHandler(max_body=kwargs.pop("max_body", 2 * 1024 ** 2),
+                             parser_class=lxml.html.HTMLParser, **kwargs)
+
+        async def get_url(url):
+            return response
+
+        handler.get_url = get_url
+        title = self.successResultOf(
+            defer.ensureDeferred(handler.get_title("http://foo/")))
+        return title, response, handler
+
+    def testStopsAfterTitle(self):
+        chunks = [b"<html><head><title>Some", b" Title</title></head>",
+                  b"<body>" + b"x" * 1000, b"y" * 1000]
+        title, response, _ = self.get_title(chunks)
+        self.assertEqual(title, "Some Title")
+        self.assertEqual(response.delivered, 2)
+
+    def testStopsAtBody(self):
+        chunks = [b"<html><head></head>", b"<body><p>text", b"more"]
+        title, response, _ = self.get_title(chunks)
+        self.assertEqual(title, "")
+        self.assertEqual(response.delivered, 2)
+
+    def testTitleWhitespaceAndEntities(self):
+        chunks = [b"<title>\n  Fish &amp;\n Chips  </title>"]
+        title, _, _ = self.get_title(chunks)
+        self.assertEqual(title, "Fish & Chips")
+
+    def testOnlyFirstTitle(self):
+        chunks = [b"<title>First</title><svg><title>Second</title></svg>"]
+        title, _, _ = self.get_title(chunks)
+        self.assertEqual(title, "First")
+
+    def testBodyLimitStopsReading(self):
+        chunks = [b"<html><head><title>Big</title>"[:16], b"x" * 100,
+                  b"y" * 100]
+        title, response, handler = self.get_title(chunks, max_body=50)
+        self.assertEqual(response.delivered, 2)
+        self.assertEqual(handler.bytes, 50)
+
+    def testTitleAfterLongHead(self):
+        chunks = [b"<html><head>", b"<meta name='x'>" * 1000,
+                  b"<title>Late</title>", b"<body>"]
+        title, response, _ = self.get_title(chunks)
+        self.assertEqual(title, "Late")
+        self.assertEqual(response.delivered, 3)
+
+    def testNonStreamingReadsEverything(self):
+        chunks = [b"<title>Some Title</title>", b"<body>", b"rest"]
+        title, response, _ = self.get_title(chunks, streaming=False)
+        self.assertEqual(title, "Some Title")
+        self.assertEqual(response.delivered, 3)
+
+
+class StrategyServer(object):
+    """Treq stand-in serving one page, optionally honouring Range and HEAD."""
+
+    def __init__(self, body, mime="text/html", ranges=True, head=True,
+                 unsatisfiable=False):
+        self.body = body
+        self.mime = mime
+        self.ranges = ranges
+        self.unsatisfiable = unsatisfiable
+        self.head = head
+        self.requests = []
+
+    def request(self, method, url, headers=None, **kwargs):
+        headers = headers or {}
+        self.requests.append((method, headers.get("Range")))
+        content_type = {"content-type": (f"{self.mime}; charset=utf-8",)}
+        if method == "HEAD":
+            code = 200 if self.head else 405
+            return defer.succeed(MockResponse(b"", content_type, code))
+        body = self.body
+        code = 200
+        if self.unsatisfiable and "Range" in headers:
+            body = b""
+            code = 416
+        elif self.ranges and "Range" in headers:
+            end = int(headers["Range"].split("-")[1])
+            body = body[:end + 1]
+            code = 206
+        response = ChunkedResponse([body[i:i + 1024]
+                                    for i in range(0, len(body), 1024)],
+                                   content_type)
+        response.code = code
+        return defer.succeed(response)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+
+class TestFetchStrategy(unittest.TestCase):
+
+    PAGE = b"<html><head><title>Title</title></head><body>" + b"x" * 10000
+
+    def setUp(self):
+        self.capabilities = title_plugin.HostCapabilities()
+        self.stats = title_plugin.FetchStats()
+
+    def get_title(self, server, strategy, range_bytes=4096):
+        self.patch(title_plugin.treq, "request", server.request)
+        self.patch(title_plugin.treq, "get", server.get)
+        handler = UrlHandler(max_body=2 * 1024 ** 2,
+                             parser_class=lxml.html.HTMLParser,
+                             strategy=strategy, range_bytes=range_bytes,
+                             capabilities=self.capabilities,
+                             fetch_stats=self.stats)
+        return defer.ensureDeferred(handler.get_title("http://Example.com/"))
+
+    def testRangeAccepted(self):
+        server = StrategyServer(self.PAGE)
+        title = self.successResultOf(self.get_title(server, "range"))
+        self.assertEqual(title, "Title")
+        self.assertEqual(server.requests, [("GET", "bytes=0-4095")])
+        self.assertTrue(self.capabilities.get("example.com", "range"))
+
+    def testRangeIgnoredRemembered(self):
+        server = StrategyServer(self.PAGE, ranges=False)
+        self.successResultOf(self.get_title(server, "range"))
+        self.assertIs(self.capabilities.get("example.com", "range"), False)
+        title = self.successResultOf(self.get_title(server, "range"))
+        self.assertEqual(title, "Title")
+        self.assertEqual(server.requests,
+                         [("GET", "bytes=0-4095"), ("GET", None)])
+
+    def testUnsatisfiableRangeFallsBack(self):
+        server = StrategyServer(self.PAGE, unsatisfiable=True)
+        title = self.successResultOf(self.get_title(server, "range"))
+        self.assertEqual(title, "Title")
+        self.assertEqual(server.requests, [("GET", "bytes=0-4095"),
+                                           ("GET", None)])
+        self.assertIs(self.capabilities.get("example.com", "range"), False)
+
+    def testTitleBeyondRangeRefetches(self):
+        page = b"<html><head>" + b"<meta name='x'>" * 500 + \
+            b"<title>Late</title></head>"
+        server = StrategyServer(page)
+        title = self.successResultOf(self.get_title(server, "range",
+                                                    range_bytes=1024))
+        self.assertEqual(title, "Late")
+        self.assertEqual(server.requests,
+                         [("GET", "bytes=0-1023"), ("GET", None)])
+
+    def testHeadRejectsBeforeBody(self):
+        server = StrategyServer(self.PAGE, mime="video/mp4")
+        self.failureResultOf(self.get_title(server, "head"), AppException)
+        self.assertEqual(server.requests, [("HEAD", None)])
+        stats = self.stats.stats()["head"]
+        self.assertEqual(stats["rejected"], 1)
+        self.assertEqual(stats["bytes"], 0)
+
+    def testHeadRejectedRemembered(self):
+        server = StrategyServer(self.PAGE, head=False)
+        self.successResultOf(self.get_title(server, "head"))
+        self.successResultOf(self.get_title(server, "head"))
+        self.assertEqual(server.requests,
+                         [("HEAD", None), ("GET", "bytes=0-4095"),
+                          ("GET", "bytes=0-4095")])
+
+    def testByteCountersPerStrategy(self):
+        server = StrategyServer(self.PAGE)
+        self.successResultOf(self.get_title(server, "get"))
+        self.successResultOf(self.get_title(server, "range"))
+        stats = self.stats.stats()
+        self.assertEqual(stats["get"]["requests"], 1)
+        self.assertEqual(stats["range"]["requests"], 1)
+        self.assertEqual(stats["range"]["bytes"], 1024)
+
+    def testUnknownStrategy(self):
+        self.assertRaises(ValueError, UrlHandler, max_body=10,
+                          parser_class=None, strategy="post")
+
+
+# (title, body encoding, Content-Type charset, <meta> declaration)
+CHARSET_CORPUS = [
+    ("Päivää “maailma”", "utf-8", "utf-8", None),
+    ("Päivää “maailma”", "utf-8", None, "<meta charset='utf-8'>"),
+    ("Päivää “maailma”", "utf-8", None, None),
+    ("Päivää", "latin-1", "iso-8859-1", None),
+    ("Päivää", "latin-1", None,
+     '<meta http-equiv="Content-Type" content="text/html; charset=latin1">'),
+    ("Päivää", "latin-1", None, None),
+    ("Price 5 €", "windows-1252", "ISO-8859-1", None),
+    ("日本語のページ", "shift_jis", "Shift_JIS", None),
+    ("日本語のページ", "shift_jis", None, '<meta charset="Shift_JIS">'),
+    ("日本語のページ", "shift_jis", "bogus", '<meta charset="shift_jis">'),
+    ("Plain title", "ascii", None, None),
+]
+
+
+class TestCharset(unittest.TestCase):
+
+    def get_title(self, body, charset=None, chunk_size=7):
+        content_type = "text/html"
+        if charset:
+            content_type += f"; charset={charset}"
+        chunks = [body[i:i + chunk_size]
+                  for i in range(0, len(body), chunk_size)]
+        response = ChunkedResponse(chunks,
+                                   {"content-type": (content_type,)})
+        handler = UrlHandler(max_body=2 * 1024 ** 2,
+                             parser_class=lxml.html.HTMLParser)
+
+        async def get_url(url):
+            return response
+
+        handler.get_url = get_url
+        title = self.successResultOf(
+            defer.ensureDeferred(handler.get_title("http://foo/")))
+        return title, handler
+
+    def make_page(self, title, encoding, meta):
+        head = (meta or "") + f"<title>{title}</title>"
+        return (f"<html><head>{head}</head><body><p>{title}</p>"
+                f"</body></html>").encode(encoding)
+
+    def testCorpus(self):
+        wrong = []
+        for title, encoding, charset, meta in CHARSET_CORPUS:
+            page = self.make_page(title, encoding, meta)
+            result, _ = self.get_title(page, charset)
+            if result != title:
+                wrong.append((title, encoding, charset, meta, result))
+        self.assertEqual(wrong, [])
+
+    def testByteOrderMarkWinsOverHeader(self):
+        page = codecs.BOM_UTF8 + self.make_page("Päivää", "utf-8", None)
+        title, handler = self.get_title(page, "iso-8859-1")
+        self.assertEqual(title, "Päivää")
+        self.assertEqual(handler.encoding, "utf-8")
+
+    def testMetaAfterTitle(self):
+        page = self.make_page("Päivää", "latin-1", None).replace(
+            b"</title>", b"</title><meta charset='iso-8859-1'>")
+        title, handler = self.get_title(page)
+        self.assertEqual(title, "Päivää")
+        self.assertEqual(handler.encoding, "windows-1252")
+
+    def testDeclaredEncodingDoesNotWaitForSniffing(self):
+        page = self.make_page("Title", "utf-8", None) + b"x" * 10000
+        _, handler = self.get_title(page, "utf-8", chunk_size=1024)
+        self.assertEqual(handler.bytes, 1024)
+
+    def testUnsupportedByParser(self):
+        page = self.make_page("Title", "utf-8", None)
+        # Known to Python but not to libxml2
+        title, handler = self.get_title(page, "euc_jp")
+        self.assertEqual(title, "Title")
+        self.assertEqual(handler.encoding, "euc_jp")
+
+
+class FakeResolver(object):
+    """twisted.names resolver stand-in answering from a static table."""
+
+    def __init__(self, records):
+        self.records = records
+        self.queries = []
+
+    def _lookup(self, name, record_type):
+        self.queries.append((name, record_type))
+        answers = []
+        for address, ttl in self.records.get(name, ()):
+            if (":" in address) == (record_type == dns.AAAA):
+                payload = (dns.Record_AAAA(address, ttl)
+                           if record_type == dns.AAAA
+                           else dns.Record_A(address, ttl))
+                answers.append(dns.RRHeader(name, record_type, ttl=ttl,
+                                            payload=payload))
+        if name not in self.records:
+            return defer.fail(error.DNSNameError(name))
+        return defer.succeed((answers, [], []))
+
+    def lookupAddress(self, name):
+        return self._lookup(name, dns.A)
+
+    def lookupIPV6Address(self, name):
+        return self._lookup(name, dns.AAAA)
+
+
+class TestVettedEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.reactor = MemoryReactorClock()
+        self.dns = FakeResolver({
+            "example.com": [("93.184.216.34", 300)],
+            "short.example.com": [("93.184.216.35", 1)],
+            "v6.example.com": [("2606:2800:220:1::1", 300)],
+            "evil.example.com": [("127.0.0.1", 300)],
+            "mixed.example.com": [("93.184.216.34", 300),
+                                  ("10.0.0.1", 300)],
+        })
+        self.resolver = title_plugin.CachingResolver(self.reactor, self.dns,
+                                                     min_ttl=30)
+        self.factory = title_plugin.VettedEndpointFactory(self.reactor,
+                                                          self.resolver)
+
+    def connect(self, url):
+        endpoint = self.factory.endpointForURI(URI.fromBytes(url))
+        return endpoint.connect(protocol.Factory.forProtocol(
+            protocol.Protocol))
+
+    def testPinsResolvedAddress(self):
+        self.connect(b"http://example.com:8080/")
+        host, port = self.reactor.tcpClients[0][:2]
+        self.assertEqual((host, port), ("93.184.216.34", 8080))
+
+    def testIpv6Address(self):
+        self.connect(b"http://v6.example.com/")
+        self.assertEqual(self.reactor.tcpClients[0][0], "2606:2800:220:1::1")
+
+    def testHttpsWrapsTls(self):
+        self.connect(b"https://example.com/")
+        host, port, factory = self.reactor.tcpClients[0][:3]
+        self.assertEqual((host, port), ("93.184.216.34", 443))
+        # The TCP endpoint wraps the factory it is given
+        self.assertIsInstance(factory._wrappedFactory, TLSMemoryBIOFactory)
+
+    def testBlockedResolvedAddress(self):
+        d = self.connect(b"http://evil.example.com/")
+        self.failureResultOf(d, AppException)
+        self.assertEqual(self.reactor.tcpClients, [])
+
+    def testAnyBlockedAddressRejects(self):
+        d = self.connect(b"http://mixed.example.com/")
+        self.failureResultOf(d, AppException)
+
+    def testBlockedLiteralSkipsResolver(self):
+        for url in (b"http://127.0.0.1:8080/", b"http://[::1]/"):
+            self.failureResultOf(self.connect(url), AppException)
+        self.assertEqual(self.dns.queries, [])
+
+    def testUnknownHost(self):
+        d = self.connect(b"http://missing.example.com/")
+        self.failureResultOf(d, error.DNSNameError)
+
+    def testCachedForTtl(self):
+        self.connect(b"http://example.com/")
+        self.connect(b"http://EXAMPLE.com/other")
+        self.assertEqual(len(self.dns.queries), 2)
+        self.reactor.advance(300)
+        self.connect(b"http://example.com/")
+        self.assertEqual(len(self.dns.queries), 4)
+
+    def testTtlClampedToMinimum(self):
+        self.connect(b"http://short.example.com/")
+        self.reactor.advance(10)
+        self.connect(b"http://short.example.com/")
+        self.assertEqual(len(self.dns.queries), 2)
+
+    def testDefaultResolver(self):
+        hosts = self.mktemp()
+        with open(hosts, "w") as f:
+            f.write("192.0.2.7 hosted.example.com\n")
+        resolv_conf = self.mktemp()
+        with open(resolv_conf, "w") as f:
+            f.write("nameserver 192.0.2.53\n")
+        self.patch(title_plugin, "HOSTS_FILE", hosts.encode())
+        self.patch(title_plugin, "RESOLV_CONF", resolv_conf.encode())
+        lookups = []
+
+        def lookup(resolver, name, cls, record_type, timeout):
+            lookups.append((resolver._reactor, name, record_type))
+            answers = []
+            if record_type == dns.A:
+                answers.append(dns.RRHeader(
+                    name, dns.A, ttl=300,
+                    payload=dns.Record_A("93.184.216.36", 300)))
+            return defer.succeed((answers, [], []))
+
+        self.patch(dns_client.Resolver, "_lookup", lookup)
+        resolver = title_plugin.CachingResolver(self.reactor)
+        factory = title_plugin.VettedEndpointFactory(self.reactor, resolver)
+        factory.endpointForURI(URI.fromBytes(b"http://hosted.example.com/")) \
+            .connect(protocol.Factory.forProtocol(protocol.Protocol))
+        factory.endpointForURI(URI.fromBytes(b"http://dns.example.com/")) \
+            .connect(protocol.Factory.forProtocol(protocol.Protocol))
+        self.assertEqual([client[0] for client in self.reactor.tcpClients],
+                         ["192.0.2.7", "93.184.216.36"])
+        self.assertEqual(lookups,
+                         [(self.reactor, b"hosted.example.com", dns.AAAA),
+                          (self.reactor, b"dns.example.com", dns.A),
+                          (self.reactor, b"dns.example.com", dns.AAAA)])
+
+    def testUrlHandlerUsesAgent(self):
+        calls = []
+
+        def get(url, **kwargs):
+            calls.append(kwargs)
+            return defer.succeed(None)
+
+        self.patch(title_plugin.treq, "get", get)
+        agent = object()
+        handler = UrlHandler(max_body=10, parser_class=None, agent=agent)
+        self.successResultOf(defer.ensureDeferred(
+            handler.get_url("http://example.com")))
+        self.assertIs(calls[0]["agent"], agent)
+        self.assertNotIn("pool", calls[0])
+
+
+class TestIPBlocklist(unittest.TestCase):
+
+    def testDefaults(self):
+        for address in ("127.0.0.1", "10.1.2.3", "172.31.255.255",
+                        "169.254.169.254", "::1", "fe80::1", "fd00::1"):
+            self.assertFalse(title_plugin.acceptable_netloc(address), address)
+        for address in ("93.184.216.34", "172.32.0.1", "2606:4700::1"):
+            self.assertTrue(title_plugin.acceptable_netloc(address), address)
+
+    def testNetworkBoundaries(self):
+        blocklist = title_plugin.IPBlocklist(["198.51.100.0/25"])
+        self.assertIn("198.51.100.0", blocklist)
+        self.assertIn("198.51.100.127", blocklist)
+        self.assertNotIn("198.51.100.128", blocklist)
+        self.assertNotIn("198.51.99.255", blocklist)
+
+    def testIpv4MappedAddress(self):
+        self.assertIn("::ffff:127.0.0.1", title_plugin.DEFAULT_BLOCKLIST)
+
+    def testHostBitsAndDuplicates(self):
+        blocklist = title_plugin.IPBlocklist(["198.51.100.7/24",
+                                              "198.51.100.0/24"])
+        self.assertEqual(len(blocklist), 1)
+        self.assertIn("198.51.100.200", blocklist)
+
+    def testCustomBlocklist(self):
+        blocklist = title_plugin.IPBlocklist(["0.0.0.0/0"])
+        self.assertFalse(title_plugin.acceptable_netloc("93.184.216.34",
+                                                        blocklist))
+        self.assertTrue(title_plugin.acceptable_netloc("::1", blocklist))
+
+    def testMatchesLinearScan(self):
+        rng = random.Random(0)
+        networks = []
+        for _ in range(500):
+            cls, bits = rng.choice([(ipaddress.IPv4Network, 32),
+                                    (ipaddress.IPv6Network, 128)])
+            networks.append(cls((rng.getrandbits(bits),
+                                 rng.randint(8, bits)), strict=False))
+        blocklist = title_plugin.IPBlocklist(networks)
+        for _ in range(2000):
+            network = rng.choice(networks)
+            address_class = type(network.network_address)
+            # Both ends of a network and an address anywhere at all
+            for address in (network.network_address,
+                            network.broadcast_address,
+                            address_class(rng.getrandbits(
+                                network.max_prefixlen))):
+                expected = any(address in n for n in networks)
+                self.assertEqual(address in blocklist, expected, address)
+
+
+def reference_difference_check(a, s):
+    """difference_check as it was before the bounded distance."""
+    if len(a) < 14 or len(s) < 14:
+        if len(a) != len(s):
+            return True
+        else:
+            return a != s
+    else:
+        return Levenshtein.distance(a, s) >= 7
+
+
+def reference_dynsearch(l, s):
+    """The recursive dynsearch replaced by the iterative one."""
+    a, b = l[0], l[1:]
+    if not b:
+        return reference_difference_check(a, s)
+    else:
+        if not reference_dynsearch(b, s):
+            return False
+        else:
+            return reference_difference_check("".join(b), s)
+
+
+class TestDynsearch(unittest.TestCase):
+
+    def mutate(self, rng, text, edits):
+        text = list(text)
+        for _ in range(edits):
+            position = rng.randrange(len(text) + 1)
+            operation = rng.choice("ids")
+            if operation == "i" or not text:
+                text.insert(position, rng.choice("abcde"))
+            elif position < len(text):
+                if operation == "d":
+                    del text[position]
+                else:
+                    text[position] = rng.choice("abcde")
+        return "".join(text)
+
+    def testMatchesRecursiveImplementation(self):
+        rng = random.Random(0)
+        for _ in range(5000):
+            segments = ["".join(rng.choice("abcde")
+                                for _ in range(rng.randint(0, 12)))
+                        for _ in range(rng.randint(1, 8))]
+            # Titles close to some tail of the path, or unrelated
+            tail = "".join(segments[rng.randrange(len(segments)):])
+            title = rng.choice([
+                self.mutate(rng, tail, rng.randint(0, 9)),
+                "".join(rng.choice("abcde")
+                        for _ in range(rng.randint(0, 40)))])
+            self.assertEqual(title_plugin.dynsearch(segments, title),
+                             reference_dynsearch(segments, title),
+                             (segments, title))
+
+    def testDifferenceCheckThreshold(self):
+        base = "abcdefghijklmnopqrst"
+        for edits in range(12):
+            changed = base[:len(base) - edits] + "z" * edits
+            self.assertEqual(title_plugin.difference_check(changed, base),
+                             reference_difference_check(changed, base))
+
+
+class TestExtractUrls(unittest.TestCase):
+
+    def testNoLinks(self):
+        self.assertEqual(title_plugin.extract_urls("just chatting"), [])
+        self.assertEqual(title_plugin.extract_urls("see http:// later"), [])
+
+    def testSeparators(self):
+        self.assertEqual(
+            title_plugin.extract_urls("http://a.com/1\thttp://b.com/2 x"),
+            ["http://a.com/1", "http://b.com/2"])
+
+    def testAngleBracketsAndQuotes(self):
+        self.assertEqual(
+            title_plugin.extract_urls('<http://a.com/x> "https://b.com/y"'),
+            ["http://a.com/x", "https://b.com/y"])
+
+    def testIrcFormatting(self):
+        self.assertEqual(
+            title_plugin.extract_urls(
+                "\x02http://a.com/x\x02 \x0304,01http://b.com/y\x0f"),
+            ["http://a.com/x", "http://b.com/y"])
+
+    def testPunctuation(self):
+        self.assertEqual(
+            title_plugin.extract_urls(
+                "(see http://a.com/x_(y)), http://b.com/z."),
+            ["http://a.com/x_(y)", "http://b.com/z"])
+
+    def testPrepareTitle(self):
+        self.assertEqual(title_plugin.prepare_title("Some Page - Site – X"),
+                         "somepage")
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 """Tests for the eval plugin."""
+import threading
 from twisted.trial import unittest
 from twisted.internet import task
+import simple_eval
 from plugin import PluginRegistry
 from plugins.eval_plugin import EvalPlugin, load
 
@@ -13,7 +15,7 @@ class MockProtocol:
         self.nickname = nickname
         self.sent = []
 
-    def msg(self, target, text):
+    def msg(self, target, text, priority=None):
         self.sent.append((target, text))
 
 
@@ -83,9 +85,67 @@ class EvalPluginTests(unittest.TestCase):
         self.plugin.on_privmsg(self.protocol, "user!u@h", "#chan", "hello world")
         self.assertEqual(len(self.protocol.sent), 0)
 
+    def test_limit_exceeded_reports_error(self):
+        """Test that an expression over a configured limit is rejected."""
+        registry = PluginRegistry(self.clock, {})
+        plugin = EvalPlugin('eval', registry, {'max_depth': 2})
+        plugin.load()
+        plugin.on_privmsg(self.protocol, "user!u@h", "#chan",
+                          "!eval foo:(((foo)))")
+        self.assertEqual(len(self.protocol.sent), 1)
+        _, text = self.protocol.sent[0]
+        self.assertIn("max_depth", text)
+
+    def test_default_limits(self):
+        """Test that limits default to values sized for IRC lines."""
+        self.assertEqual(self.plugin._limits,
+                         simple_eval.EvalLimits(512, 256, 32, 1024))
+
     def test_load_function(self):
         """Test the module-level load() function creates an EvalPlugin."""
         registry = PluginRegistry(self.clock, {})
         plugin = load(registry, {'name': 'eval', 'config': {}})
         self.assertIsInstance(plugin, EvalPlugin)
         self.assertEqual(plugin.name, 'eval')
+
+
+class EvalPluginThreadTests(unittest.TestCase):
+    """Tests for evaluating large expressions off the reactor thread."""
+
+    def setUp(self):
+        from twisted.internet import reactor
+        self.registry = PluginRegistry(reactor, {})
+        self.plugin = EvalPlugin('eval', self.registry,
+                                 {'thread_threshold': 10})
+        self.plugin.load()
+        self.protocol = MockProtocol()
+
+    def test_reactor_runs_during_heavy_eval(self):
+        """Test that the reactor keeps servicing events during an eval."""
+        from twisted.internet import reactor
+        ticked = threading.Event()
+        original = simple_eval.eval_bool
+
+        def blocking_eval(*args):
+            # Only completes once the reactor has run a scheduled call,
+            # which it cannot do if this blocks the reactor thread.
+            if not ticked.wait(5):
+                raise RuntimeError("reactor did not run during eval")
+            return original(*args)
+
+        self.patch(simple_eval, 'eval_bool', blocking_eval)
+        reactor.callLater(0, ticked.set)
+        d = self.plugin.on_privmsg(self.protocol, "user!u@h", "#chan",
+                                   "!eval foo:(foo & bar) | ~baz")
+
+        def check(_):
+            self.assertEqual(self.protocol.sent, [("#chan", "Result: True")])
+
+        d.addCallback(check)
+        return d
+
+    def test_short_expression_evaluated_inline(self):
+        """Test that expressions under the threshold reply synchronously."""
+        self.plugin.on_privmsg(self.protocol, "user!u@h", "#chan",
+                               "!eval foo:foo")
+        self.assertEqual(self.protocol.sent, [("#chan", "Result: True")])
@@ -16,7 +16,7 @@ class MockProtocol:
     def __init__(self):
         self.sent = []
 
-    def msg(self, channel, message):
+    def msg(self, channel, message, priority=None):
         self.sent.append((channel, message))
 
 
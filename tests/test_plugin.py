@@ -1,5 +1,7 @@
+import os
+import sys
 from twisted.trial import unittest
-from twisted.internet import task
+from twisted.internet import task, defer
 from plugin import PluginRegistry, Plugin
 
 
@@ -83,8 +85,33 @@ class PluginRegistryTests(unittest.TestCase):
     def test_get_handlers_empty(self):
         """Test getting handlers for unregistered event"""
         handlers = self.registry.get_handlers('nonexistent')
-        self.assertEqual(handlers, [])
+        self.assertEqual(handlers, ())
     
+    def test_get_handlers_returns_snapshot(self):
+        """Test that registration changes do not alter earlier snapshots"""
+        def handler1(protocol, *args):
+            pass
+
+        def handler2(protocol, *args):
+            pass
+
+        self.registry.register_handler('privmsg', handler1)
+        snapshot = self.registry.get_handlers('privmsg')
+        self.assertIsInstance(snapshot, tuple)
+        self.registry.register_handler('privmsg', handler2)
+        self.registry.unregister_handler('privmsg', handler1)
+        self.assertEqual(snapshot, (handler1,))
+        self.assertEqual(self.registry.get_handlers('privmsg'), (handler2,))
+
+    def test_get_handlers_is_not_copied(self):
+        """Test that unchanged registrations return the same snapshot"""
+        def handler(protocol, *args):
+            pass
+
+        self.registry.register_handler('privmsg', handler)
+        self.assertIs(self.registry.get_handlers('privmsg'),
+                      self.registry.get_handlers('privmsg'))
+
     def test_unload_plugin(self):
         """Test unloading a plugin"""
         plugin = TestPlugin('test', self.registry)
@@ -111,6 +138,669 @@ class PluginRegistryTests(unittest.TestCase):
         self.assertEqual(self.registry.plugins['test'], plugin2)
 
 
+class MockProtocol:
+    """Mock protocol exposing the bot nickname"""
+
+    nickname = 'testbot'
+
+
+class HandlerFilterTests(unittest.TestCase):
+    """Tests for filtered handler registration and the dispatch index"""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.registry = PluginRegistry(self.clock, {})
+        self.protocol = MockProtocol()
+
+    def match(self, channel, message, event_type='privmsg'):
+        return self.registry.match_handlers(
+            event_type, self.protocol, 'nick!user@host', channel, message)
+
+    def test_unfiltered_handler_always_matches(self):
+        """Test that handlers without filters receive every message"""
+        def handler(protocol, *args):
+            pass
+
+        self.registry.register_handler('privmsg', handler)
+        self.assertEqual(self.match('#chan', 'anything'), (handler,))
+
+    def test_prefix_filter(self):
+        """Test that prefix filters only match messages starting with it"""
+        def handler(protocol, *args):
+            pass
+
+        self.registry.register_handler('privmsg', handler, prefix='!eval ')
+        self.assertEqual(self.match('#chan', '!eval foo:foo'), (handler,))
+        self.assertEqual(self.match('#chan', '!evaluate'), ())
+        self.assertEqual(self.match('#chan', 'say !eval foo'), ())
+
+    def test_multiple_prefixes(self):
+        """Test that any one of several prefixes matches"""
+        def handler(protocol, *args):
+            pass
+
+        self.registry.register_handler('privmsg', handler,
+                                       prefix=('!join', '!leave'))
+        self.assertEqual(self.match('#chan', '!join #x'), (handler,))
+        self.assertEqual(self.match('#chan', '!leave #x'), (handler,))
+        self.assertEqual(self.match('#chan', '!quit'), ())
+
+    def test_nested_prefixes(self):
+        """Test that a short prefix and a longer one both match"""
+        def short(protocol, *args):
+            pass
+
+        def long(protocol, *args):
+            pass
+
+        self.registry.register_handler('privmsg', long, prefix='!eval')
+        self.registry.register_handler('privmsg', short, prefix='!')
+        self.assertEqual(self.match('#chan', '!eval'), (long, short))
+        self.assertEqual(self.match('#chan', '!join'), (short,))
+
+    def test_regex_filter(self):
+        """Test that regex filters match anywhere in the message"""
+        def urls(protocol, *args):
+            pass
+
+        def shouting(protocol, *args):
+            pass
+
+        self.registry.register_handler('privmsg', urls, regex='https?://')
+        self.registry.register_handler('privmsg', shouting, regex='[A-Z]{5}')
+        self.assertEqual(self.match('#chan', 'see https://x'), (urls,))
+        self.assertEqual(self.match('#chan', 'see HTTPS://x'), (shouting,))
+        self.assertEqual(self.match('#chan', 'nothing here'), ())
+
+    def test_prefix_and_regex_filter(self):
+        """Test that a filter with a prefix and a regex needs both"""
+        def handler(protocol, *args):
+            pass
+
+        self.registry.register_handler('privmsg', handler, prefix='!t',
+                                       regex=r'\d+$')
+        self.assertEqual(self.match('#chan', '!t 42'), (handler,))
+        self.assertEqual(self.match('#chan', '!t hello'), ())
+        self.assertEqual(self.match('#chan', 'x 42'), ())
+
+    def test_regex_backreferences(self):
+        """Test that regexes with groups keep their own group numbers"""
+        def word(protocol, *args):
+            pass
+
+        def doubled(protocol, *args):
+            pass
+
+        def plain(protocol, *args):
+            pass
+
+        self.registry.register_handler('privmsg', word, regex=r'(foo)')
+        self.registry.register_handler('privmsg', doubled, regex=r'(x)\1')
+        self.registry.register_handler('privmsg', plain, regex='bar')
+        self.assertEqual(self.match('#chan', 'xx'), (doubled,))
+        self.assertEqual(self.match('#chan', 'foo bar'), (word, plain))
+        self.assertEqual(self.match('#chan', 'x y'), ())
+
+    def test_channel_filter(self):
+        """Test that channel filters restrict the channels handled"""
+        def handler(protocol, *args):
+            pass
+
+        self.registry.register_handler('privmsg', handler, channels=['#a'])
+        self.assertEqual(self.match('#a', 'hi'), (handler,))
+        self.assertEqual(self.match('#b', 'hi'), ())
+
+    def test_private_filter(self):
+        """Test that private filters select private or channel messages"""
+        def private(protocol, *args):
+            pass
+
+        def public(protocol, *args):
+            pass
+
+        self.registry.register_handler('privmsg', private, private=True)
+        self.registry.register_handler('privmsg', public, private=False)
+        self.assertEqual(self.match('testbot', 'hi'), (private,))
+        self.assertEqual(self.match('#chan', 'hi'), (public,))
+
+    def test_registration_order_preserved(self):
+        """Test that matches are returned in registration order"""
+        calls = []
+        handlers = [lambda *args, i=i: calls.append(i) for i in range(4)]
+        self.registry.register_handler('privmsg', handlers[0], regex='!')
+        self.registry.register_handler('privmsg', handlers[1], prefix='!a')
+        self.registry.register_handler('privmsg', handlers[2])
+        self.registry.register_handler('privmsg', handlers[3], prefix='!')
+        self.assertEqual(self.match('#chan', '!a'), tuple(handlers))
+
+    def test_unregister_updates_index(self):
+        """Test that unregistering a filtered handler removes it"""
+        def handler(protocol, *args):
+            pass
+
+        self.registry.register_handler('privmsg', handler, prefix='!x')
+        self.assertEqual(self.match('#chan', '!x'), (handler,))
+        self.registry.unregister_handler('privmsg', handler)
+        self.assertEqual(self.match('#chan', '!x'), ())
+
+    def test_action_events_filtered(self):
+        """Test that filters also apply to action events"""
+        def handler(protocol, *args):
+            pass
+
+        self.registry.register_handler('action', handler, regex='waves')
+        self.assertEqual(self.match('#chan', 'waves', 'action'), (handler,))
+        self.assertEqual(self.match('#chan', 'sits', 'action'), ())
+
+    def test_filters_rejected_for_other_events(self):
+        """Test that filters cannot be used on non-message events"""
+        def handler(protocol, *args):
+            pass
+
+        self.assertRaises(ValueError, self.registry.register_handler,
+                          'user_joined', handler, channels=['#a'])
+
+    def test_non_message_events_unfiltered(self):
+        """Test that other events return every registered handler"""
+        def handler(protocol, *args):
+            pass
+
+        self.registry.register_handler('user_joined', handler)
+        self.assertEqual(
+            self.registry.match_handlers('user_joined', self.protocol,
+                                         'nick!user@host', '#chan'),
+            (handler,))
+
+
+class PluginBudgetTests(unittest.TestCase):
+    """Tests for concurrent dispatch under per-plugin budgets"""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.registry = PluginRegistry(self.clock, {})
+        self.pending = []
+        self.calls = []
+
+    def slow_handler(self, protocol, *args):
+        self.calls.append(args)
+        d = defer.Deferred()
+        self.pending.append(d)
+        return d
+
+    def test_deferred_results_run_concurrently(self):
+        """Test that dispatch does not wait for returned Deferreds"""
+        self.registry.register_handler('user_joined', self.slow_handler,
+                                       owner='slow')
+        self.registry.dispatch('user_joined', None, 'nick', '#a')
+        self.registry.dispatch('user_joined', None, 'nick', '#b')
+        self.assertEqual(self.calls, [('nick', '#a'), ('nick', '#b')])
+        self.assertEqual(self.registry.in_flight(), {'slow': 2})
+        self.pending[0].callback(None)
+        self.assertEqual(self.registry.in_flight(), {'slow': 1})
+
+    def test_coroutine_results_tracked(self):
+        """Test that coroutine handlers are run and tracked"""
+        waiting = defer.Deferred()
+
+        async def handler(protocol, *args):
+            await waiting
+            self.calls.append(args)
+
+        self.registry.register_handler('user_joined', handler, owner='coro')
+        self.registry.dispatch('user_joined', None, 'nick', '#a')
+        self.assertEqual(self.registry.in_flight(), {'coro': 1})
+        waiting.callback(None)
+        self.assertEqual(self.calls, [('nick', '#a')])
+        self.assertEqual(self.registry.in_flight(), {'coro': 0})
+
+    def test_cap_queues_events(self):
+        """Test that events over the cap are queued and drained in order"""
+        self.registry.set_budget('slow', max_concurrency=1)
+        self.registry.register_handler('user_joined', self.slow_handler,
+                                       owner='slow')
+        for channel in ('#a', '#b', '#c'):
+            self.registry.dispatch('user_joined', None, 'nick', channel)
+        self.assertEqual(self.calls, [('nick', '#a')])
+        self.assertEqual(len(self.registry.budgets['slow'].queue), 2)
+        self.pending[0].callback(None)
+        self.assertEqual(self.calls, [('nick', '#a'), ('nick', '#b')])
+        self.pending[1].callback(None)
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual(len(self.registry.budgets['slow'].queue), 0)
+
+    def test_queue_drains_synchronous_results(self):
+        """Test that a long queue of already fired results drains flat"""
+        blocker = defer.Deferred()
+
+        def handler(protocol, *args):
+            self.calls.append(args)
+            return blocker if len(self.calls) == 1 else defer.succeed(None)
+
+        self.registry.set_budget('fast', max_concurrency=1, max_queue=1000)
+        self.registry.register_handler('user_joined', handler, owner='fast')
+        for i in range(1001):
+            self.registry.dispatch('user_joined', None, 'nick', f'#{i}')
+        self.assertEqual(len(self.registry.budgets['fast'].queue), 1000)
+        blocker.callback(None)
+        self.assertEqual(len(self.calls), 1001)
+        self.assertEqual(self.registry.in_flight(), {'fast': 0})
+
+    def test_cap_drops_events(self):
+        """Test that the drop policy discards events over the cap"""
+        self.registry.set_budget('slow', max_concurrency=1, overflow='drop')
+        self.registry.register_handler('user_joined', self.slow_handler,
+                                       owner='slow')
+        self.registry.dispatch('user_joined', None, 'nick', '#a')
+        self.registry.dispatch('user_joined', None, 'nick', '#b')
+        self.assertEqual(self.calls, [('nick', '#a')])
+        self.assertEqual(self.registry.budgets['slow'].dropped, 1)
+
+    def test_full_queue_drops_events(self):
+        """Test that events are dropped once the queue is full"""
+        self.registry.set_budget('slow', max_concurrency=1, max_queue=1)
+        self.registry.register_handler('user_joined', self.slow_handler,
+                                       owner='slow')
+        for channel in ('#a', '#b', '#c'):
+            self.registry.dispatch('user_joined', None, 'nick', channel)
+        self.assertEqual(len(self.registry.budgets['slow'].queue), 1)
+        self.assertEqual(self.registry.budgets['slow'].dropped, 1)
+
+    def test_budgets_are_per_plugin(self):
+        """Test that a busy plugin does not hold back other plugins"""
+        other = []
+        self.registry.set_budget('slow', max_concurrency=1, overflow='drop')
+        self.registry.register_handler('user_joined', self.slow_handler,
+                                       owner='slow')
+        self.registry.register_handler(
+            'user_joined', lambda protocol, *args: other.append(args),
+            owner='fast')
+        self.registry.dispatch('user_joined', None, 'nick', '#a')
+        self.registry.dispatch('user_joined', None, 'nick', '#b')
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(len(other), 2)
+
+    def test_timeout_cancels_result(self):
+        """Test that in-flight results are cancelled after the timeout"""
+        self.registry.set_budget('slow', timeout=5)
+        self.registry.register_handler('user_joined', self.slow_handler,
+                                       owner='slow')
+        self.registry.dispatch('user_joined', None, 'nick', '#a')
+        self.clock.advance(4)
+        self.assertEqual(self.registry.in_flight(), {'slow': 1})
+        self.clock.advance(1)
+        self.assertEqual(self.registry.in_flight(), {'slow': 0})
+
+    def test_async_errors_logged(self):
+        """Test that failures of returned Deferreds are logged"""
+        self.registry.register_handler('user_joined', self.slow_handler,
+                                       owner='slow')
+        self.registry.dispatch('user_joined', None, 'nick', '#a')
+        self.pending[0].errback(RuntimeError("boom"))
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+        self.assertEqual(self.registry.in_flight(), {'slow': 0})
+
+    def test_load_plugins_configures_budget(self):
+        """Test that plugin config entries may set a budget"""
+        self.registry.load_plugins([{
+            'name': 'admin', 'module': 'plugins.admin_plugin',
+            'budget': {'max_concurrency': 3, 'overflow': 'drop'}}])
+        budget = self.registry.budgets['admin']
+        self.assertEqual(budget.max_concurrency, 3)
+        self.assertEqual(budget.overflow, 'drop')
+
+    def test_plugin_handlers_use_plugin_budget(self):
+        """Test that handlers registered by a plugin are owned by it"""
+        plugin = TestPlugin('test', self.registry)
+        plugin.load()
+        self.registry.dispatch('test_event', None, 'arg')
+        self.assertEqual(plugin.handler_calls, [(('arg',), {})])
+        self.assertIn('test', self.registry.budgets)
+
+    def test_unknown_overflow_policy(self):
+        """Test that invalid overflow policies are rejected"""
+        self.assertRaises(ValueError, self.registry.set_budget, 'slow',
+                          overflow='explode')
+
+
+class FakeTimer:
+    """Wall clock stand-in advanced by handlers under test"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class HandlerStatsTests(unittest.TestCase):
+    """Tests for handler latency statistics"""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.registry = PluginRegistry(self.clock, {})
+        self.timer = FakeTimer()
+
+    def enable(self, **kwargs):
+        self.registry.enable_stats(**kwargs)
+        self.registry._stats.timer = self.timer
+
+    def blocking_handler(self, seconds):
+        def handler(protocol, *args):
+            self.timer.now += seconds
+        return handler
+
+    def test_disabled_by_default(self):
+        """Test that no statistics are recorded unless enabled"""
+        self.registry.register_handler('user_joined', self.blocking_handler(1),
+                                       owner='slow')
+        self.registry.dispatch('user_joined', None, 'nick', '#a')
+        self.assertFalse(self.registry.stats_enabled)
+        self.assertEqual(self.registry.stats(), {})
+
+    def test_enabled_from_config(self):
+        """Test that the core config can enable statistics"""
+        registry = PluginRegistry(self.clock, {'core': {'handler_stats': {
+            'enabled': True, 'slow_threshold': 0.5}}})
+        self.assertTrue(registry.stats_enabled)
+        self.assertEqual(registry._stats.slow_threshold, 0.5)
+
+    def test_call_counts_and_latency(self):
+        """Test that calls are counted per plugin and event type"""
+        self.enable()
+        self.registry.register_handler('user_joined',
+                                       self.blocking_handler(0.003),
+                                       owner='slow')
+        self.registry.register_handler('user_left',
+                                       self.blocking_handler(0.001),
+                                       owner='slow')
+        for _ in range(3):
+            self.registry.dispatch('user_joined', None, 'nick', '#a')
+        self.registry.dispatch('user_left', None, 'nick', '#a')
+        stats = self.registry.stats()['slow']
+        self.assertEqual(stats['user_joined']['calls'], 3)
+        self.assertEqual(stats['user_left']['calls'], 1)
+        call = stats['user_joined']['call']
+        self.assertEqual(call['count'], 3)
+        self.assertAlmostEqual(call['mean'], 0.003)
+        self.assertAlmostEqual(call['max'], 0.003)
+        self.assertEqual(sum(call['histogram'].values()), 3)
+        bound, = call['histogram']
+        self.assertTrue(0.003 < bound <= 0.006)
+
+    def test_errors_counted(self):
+        """Test that failing handlers are counted as errors"""
+        self.enable()
+
+        def handler(protocol, *args):
+            raise ValueError("boom")
+
+        self.registry.register_handler('user_joined', handler, owner='bad')
+        self.registry.dispatch('user_joined', None, 'nick', '#a')
+        self.flushLoggedErrors(ValueError)
+        stats = self.registry.stats()['bad']['user_joined']
+        self.assertEqual(stats['calls'], 1)
+        self.assertEqual(stats['errors'], 1)
+
+    def test_deferred_time_to_fire(self):
+        """Test that returned Deferreds are timed until they fire"""
+        self.enable()
+        pending = []
+
+        def handler(protocol, *args):
+            d = defer.Deferred()
+            pending.append(d)
+            return d
+
+        self.registry.register_handler('user_joined', handler, owner='async')
+        self.registry.dispatch('user_joined', None, 'nick', '#a')
+        self.clock.advance(3)
+        pending[0].callback(None)
+        fire = self.registry.stats()['async']['user_joined']['fire']
+        self.assertEqual(fire['count'], 1)
+        self.assertEqual(fire['max'], 3)
+
+    def test_slow_handler_warning(self):
+        """Test that handlers blocking past the threshold are reported"""
+        self.enable(slow_threshold=0.05)
+        events = []
+        from twisted.logger import globalLogPublisher
+        globalLogPublisher.addObserver(events.append)
+        self.addCleanup(globalLogPublisher.removeObserver, events.append)
+        self.registry.register_handler('user_joined',
+                                       self.blocking_handler(0.01),
+                                       owner='fast')
+        self.registry.register_handler('user_joined',
+                                       self.blocking_handler(0.2),
+                                       owner='slow')
+        self.registry.dispatch('user_joined', None, 'nick', '#a')
+        warnings = [event['log_format'] for event in events
+                    if 'blocked the reactor' in event.get('log_format', '')]
+        self.assertEqual(len(warnings), 1)
+        self.assertIn('Plugin slow', warnings[0])
+
+    def test_disable_stats(self):
+        """Test that disabling stops recording for existing budgets"""
+        self.enable()
+        self.registry.register_handler('user_joined',
+                                       self.blocking_handler(0.001),
+                                       owner='slow')
+        self.registry.dispatch('user_joined', None, 'nick', '#a')
+        self.registry.disable_stats()
+        self.registry.dispatch('user_joined', None, 'nick', '#a')
+        self.assertIsNone(self.registry.budgets['slow'].stats)
+        self.assertEqual(self.registry.stats(), {})
+
+
+RELOADABLE_PLUGIN = """
+from plugin import Plugin
+
+VERSION = {version!r}
+
+
+class ReloadablePlugin(Plugin):
+    def load(self):
+        self.unloaded = False
+        self.version = VERSION
+        if VERSION == 'broken':
+            raise RuntimeError('cannot load')
+        self.register_handler('test_event', self.on_event)
+        self.register_handler('{event}', self.on_event)
+
+    def unload(self):
+        self.unloaded = True
+
+    def on_event(self, protocol, calls):
+        calls.append((self.version, self))
+
+
+def load(registry, config):
+    plugin = ReloadablePlugin(config['name'], registry, config)
+    plugin.load()
+    return plugin
+"""
+
+
+class PluginModuleTestMixin:
+    """Writes the reloadable_plugin module into a temporary directory"""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.registry = PluginRegistry(self.clock, {})
+        self.path = self.mktemp()
+        os.makedirs(self.path)
+        sys.path.insert(0, self.path)
+        self.addCleanup(sys.path.remove, self.path)
+        self.addCleanup(sys.modules.pop, 'reloadable_plugin', None)
+        # Restores the original value on cleanup
+        self.patch(sys, 'dont_write_bytecode', True)
+        self.write_module('one')
+
+    def write_module(self, version, event='other_event'):
+        filename = os.path.join(self.path, 'reloadable_plugin.py')
+        with open(filename, 'w') as f:
+            f.write(RELOADABLE_PLUGIN.format(version=version, event=event))
+        # Invalidate cached bytecode written within the same second
+        mtime = os.stat(filename).st_mtime + len(os.listdir(self.path)) + 1
+        os.utime(filename, (mtime, mtime))
+
+    def dispatch(self, event_type='test_event'):
+        calls = []
+        self.registry.dispatch(event_type, None, calls)
+        return calls
+
+
+class PluginReloadTests(PluginModuleTestMixin, unittest.TestCase):
+    """Tests for unloading and hot reloading plugins"""
+
+    def setUp(self):
+        super().setUp()
+        self.registry.load_plugins([{'name': 'reloadable',
+                                     'module': 'reloadable_plugin'}])
+
+    def test_unload_unregisters_handlers(self):
+        """Test that unloading a plugin removes all of its handlers"""
+        self.registry.unload_plugin('reloadable')
+        self.assertEqual(self.registry.get_handlers('test_event'), ())
+        self.assertEqual(self.registry.get_handlers('other_event'), ())
+
+    def test_reload_swaps_handlers(self):
+        """Test that reloading picks up new module code"""
+        old = self.registry.plugins['reloadable']
+        self.write_module('two')
+        self.assertTrue(self.registry.reload_plugin('reloadable'))
+        new = self.registry.plugins['reloadable']
+        self.assertIsNot(old, new)
+        self.assertTrue(old.unloaded)
+        self.assertEqual(self.dispatch(), [('two', new)])
+        self.assertEqual(len(self.registry.get_handlers('other_event')), 1)
+
+    def test_reload_drops_stale_event_types(self):
+        """Test that handlers the new code no longer registers are removed"""
+        self.write_module('two', event='third_event')
+        self.registry.reload_plugin('reloadable')
+        self.assertEqual(self.registry.get_handlers('other_event'), ())
+        self.assertEqual(len(self.registry.get_handlers('third_event')), 1)
+
+    def test_reload_keeps_dispatch_order(self):
+        """Test that reloaded handlers keep their place among plugins"""
+        def before(protocol, calls):
+            calls.append('before')
+
+        def after(protocol, calls):
+            calls.append('after')
+
+        self.registry.unload_plugin('reloadable')
+        self.registry.register_handler('test_event', before, owner='earlier')
+        self.registry.load_plugins([{'name': 'reloadable',
+                                     'module': 'reloadable_plugin'}])
+        self.registry.register_handler('test_event', after, owner='later')
+        self.write_module('two')
+        self.registry.reload_plugin('reloadable')
+        calls = self.dispatch()
+        self.assertEqual([calls[0], calls[1][0], calls[2]],
+                         ['before', 'two', 'after'])
+
+    def test_failed_reload_keeps_old_plugin(self):
+        """Test that the old handlers stay when the new code fails to load"""
+        old = self.registry.plugins['reloadable']
+        self.write_module('broken')
+        self.assertFalse(self.registry.reload_plugin('reloadable'))
+        self.flushLoggedErrors(RuntimeError)
+        self.assertIs(self.registry.plugins['reloadable'], old)
+        self.assertFalse(old.unloaded)
+        self.assertEqual(self.dispatch(), [('one', old)])
+        self.assertEqual(self.registry._staging, {})
+
+    def test_old_handlers_serve_until_swap(self):
+        """Test that events during the new load reach the old handlers"""
+        old = self.registry.plugins['reloadable']
+        seen = []
+        original_replace = self.registry._replace_owner
+
+        def replace(owner, staged):
+            seen.extend(self.dispatch())
+            original_replace(owner, staged)
+
+        self.registry._replace_owner = replace
+        self.write_module('two')
+        self.registry.reload_plugin('reloadable')
+        self.assertEqual(seen, [('one', old)])
+
+    def test_reload_unknown_plugin(self):
+        """Test that plugins not loaded from configuration are refused"""
+        self.assertFalse(self.registry.reload_plugin('missing'))
+
+
+class LazyPluginTests(PluginModuleTestMixin, unittest.TestCase):
+    """Tests for plugins whose module is imported on demand"""
+
+    def setUp(self):
+        super().setUp()
+        self.registry.load_plugins([{
+            'name': 'reloadable', 'module': 'reloadable_plugin',
+            'lazy': True, 'handles': [{'event': 'test_event'}]}])
+
+    def test_module_not_imported(self):
+        """Test that lazy plugins only install stub handlers"""
+        self.assertNotIn('reloadable_plugin', sys.modules)
+        self.assertNotIn('reloadable', self.registry.plugins)
+        self.assertEqual(len(self.registry.get_handlers('test_event')), 1)
+
+    def test_first_event_loads_and_forwards(self):
+        """Test that the first matching event loads the plugin"""
+        calls = self.dispatch()
+        plugin = self.registry.plugins['reloadable']
+        self.assertEqual(calls, [('one', plugin)])
+        self.assertEqual(self.registry.get_handlers('test_event'),
+                         (plugin.on_event,))
+        self.assertEqual(self.registry.get_handlers('other_event'),
+                         (plugin.on_event,))
+        self.assertEqual(self.dispatch(), [('one', plugin)])
+
+    def test_stub_filters_apply(self):
+        """Test that declared filters decide which events load the plugin"""
+        self.registry.unload_plugin('reloadable')
+        self.registry.load_plugins([{
+            'name': 'reloadable', 'module': 'reloadable_plugin',
+            'lazy': True,
+            'handles': [{'event': 'privmsg', 'prefix': '!load'}]}])
+        protocol = MockProtocol()
+        self.registry.dispatch('privmsg', protocol, 'nick!u@h', '#a', 'hello')
+        self.assertNotIn('reloadable', self.registry.plugins)
+        self.registry.dispatch('privmsg', protocol, 'nick!u@h', '#a', '!load')
+        self.assertIn('reloadable', self.registry.plugins)
+
+    def test_preload_after_sign_on(self):
+        """Test that preloading imports lazy plugins in the background"""
+        self.registry.preload_plugins()
+        self.assertNotIn('reloadable', self.registry.plugins)
+        self.clock.advance(0)
+        self.assertIn('reloadable', self.registry.plugins)
+        self.assertEqual(self.dispatch()[0][0], 'one')
+
+    def test_preload_disabled(self):
+        """Test that plugins can opt out of preloading"""
+        self.registry._lazy['reloadable']['preload'] = False
+        self.registry.preload_plugins()
+        self.clock.advance(0)
+        self.assertNotIn('reloadable', self.registry.plugins)
+
+    def test_failed_load_removes_stubs(self):
+        """Test that a plugin failing to load does not retry every event"""
+        self.write_module('broken')
+        self.assertEqual(self.dispatch(), [])
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+        self.assertEqual(self.registry.get_handlers('test_event'), ())
+
+    def test_unload_lazy_plugin(self):
+        """Test that unloading a pending lazy plugin removes its stubs"""
+        self.registry.unload_plugin('reloadable')
+        self.assertEqual(self.registry.get_handlers('test_event'), ())
+        self.registry.preload_plugins()
+        self.clock.advance(0)
+        self.assertNotIn('reloadable_plugin', sys.modules)
+
+
 class PluginTests(unittest.TestCase):
     """Tests for Plugin base class"""
     
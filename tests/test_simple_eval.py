@@ -1,3 +1,4 @@
+import itertools
 import unittest
 import simple_eval
 
@@ -29,6 +30,33 @@ class TestTokenizer(unittest.TestCase):
             (5, ")"), (6, "|"), (7, "("), (8, "~"), (9, "x"),
             (10, "&"), (11, "~"), (12, "y"), (13, ")")])
 
+    def test_whitespace_runs(self):
+        self.case(" \tfoo \r\n|\n bar  ", [(2, "foo"), (8, "|"), (11, "bar")])
+
+    def test_long_identifier(self):
+        self.case("a" * 100000 + "&b", [(0, "a" * 100000), (100000, "&"),
+                                         (100001, "b")])
+
+    def test_invalid_character(self):
+        with self.assertRaisesRegex(simple_eval.EvalError,
+                                    "Invalid token 1 at position 4"):
+            list(simple_eval.tokenize("foo&1", simple_eval.BOOL_SYNTAX,
+                                      simple_eval.WHITESPACE))
+
+    def test_invalid_character_after_identifier(self):
+        tokens = simple_eval.tokenize("a&foo1", simple_eval.BOOL_SYNTAX,
+                                      simple_eval.WHITESPACE)
+        self.assertEqual(next(tokens), (0, "a"))
+        self.assertEqual(next(tokens), (1, "&"))
+        with self.assertRaisesRegex(simple_eval.EvalError,
+                                    "Invalid token 1 at position 5"):
+            next(tokens)
+
+    def test_custom_syntax(self):
+        self.assertEqual(list(simple_eval.tokenize("a+b.c", "+", " .")),
+                         [(0, "a"), (1, "+"), (2, "b"), (4, "c")])
+
+
 class TestBoolEval(unittest.TestCase):
 
     def test_simple_true(self):
@@ -81,3 +109,178 @@ class TestBoolEval(unittest.TestCase):
     def test_bad_legal(self):
         with self.assertRaisesRegex(ValueError, "Invalid token & at position 2"):
             simple_eval.eval_bool("a&&b", ())
+
+class TestCompiledBool(unittest.TestCase):
+
+    def test_compile_is_cached(self):
+        self.assertIs(simple_eval.compile_bool("foo&bar"),
+                      simple_eval.compile_bool("foo&bar"))
+
+    def test_evaluate_many(self):
+        compiled = simple_eval.compile_bool("(foo&~bar)|baz")
+        self.assertTrue(compiled.evaluate({"foo"}))
+        self.assertFalse(compiled.evaluate({"foo", "bar"}))
+        self.assertTrue(compiled.evaluate(["bar", "baz"]))
+        self.assertFalse(compiled.evaluate(()))
+
+    def test_bad_input_raises_on_compile(self):
+        with self.assertRaisesRegex(ValueError, "Invalid token & at position 2"):
+            simple_eval.compile_bool("a&&b")
+
+    def test_trailing_operand_identifier(self):
+        with self.assertRaisesRegex(ValueError, "Invalid token b at position 2"):
+            simple_eval.eval_bool("a b", ())
+
+    def test_trailing_operand_computed(self):
+        with self.assertRaisesRegex(ValueError,
+                                    "Invalid token True at position 4"):
+            simple_eval.eval_bool("a b&c", ("b", "c"))
+        with self.assertRaisesRegex(ValueError,
+                                    "Invalid token False at position 4"):
+            simple_eval.eval_bool("a b&c", ())
+
+
+class RecordingTruths(set):
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.queried = []
+
+    def __contains__(self, item):
+        self.queried.append(item)
+        return super().__contains__(item)
+
+
+class TestOptimizedEval(unittest.TestCase):
+
+    def test_and_short_circuits(self):
+        truths = RecordingTruths()
+        self.assertFalse(simple_eval.eval_bool("foo&(bar|~baz)", truths))
+        self.assertEqual(truths.queried, ["foo"])
+
+    def test_or_short_circuits(self):
+        truths = RecordingTruths({"foo"})
+        self.assertTrue(simple_eval.eval_bool("foo|(bar&~baz)", truths))
+        self.assertEqual(truths.queried, ["foo"])
+
+    def test_shared_subexpression_evaluated_once(self):
+        truths = RecordingTruths({"foo", "bar"})
+        compiled = simple_eval.compile_bool("(foo&bar)&~(~(foo&bar)|baz)")
+        self.assertTrue(compiled.evaluate(truths))
+        self.assertEqual(sorted(truths.queried), ["bar", "baz", "foo"])
+
+    def test_contradiction_folds_to_constant(self):
+        compiled = simple_eval.compile_bool("(foo&~foo)|bar")
+        self.assertEqual([node.op for node in compiled._nodes],
+                         [simple_eval._VAR])
+        self.assertTrue(compiled.evaluate({"bar"}))
+        self.assertFalse(compiled.evaluate({"foo"}))
+
+    def test_tautology_folds_to_constant(self):
+        compiled = simple_eval.compile_bool("~(foo|~foo)|(bar|~bar)")
+        self.assertEqual(len(compiled._nodes), 1)
+        self.assertTrue(compiled.evaluate(()))
+
+    def test_deep_nesting(self):
+        expr = "foo"
+        for _ in range(5001):
+            expr = f"(~{expr}|bar)"
+        self.assertTrue(simple_eval.eval_bool(expr, ("bar",)))
+        self.assertFalse(simple_eval.eval_bool(expr, ("foo",)))
+
+
+class TestBatchEval(unittest.TestCase):
+
+    columns = ("foo", "bar", "baz")
+    expressions = ("foo", "~foo", "foo&bar", "foo|qux", "(foo&~bar)|baz",
+                   "~(foo&bar)&~(~foo|~bar)")
+
+    def assignments(self):
+        return [list(row) for row in
+                itertools.product((False, True), repeat=len(self.columns))]
+
+    def expected(self, expr, matrix):
+        return [simple_eval.eval_bool(
+                    expr, [c for c, v in zip(self.columns, row) if v])
+                for row in matrix]
+
+    def test_rows_match_eval_bool(self):
+        matrix = self.assignments()
+        for expr in self.expressions:
+            compiled = simple_eval.compile_bool(expr)
+            self.assertEqual(compiled.evaluate_rows(matrix, self.columns),
+                             self.expected(expr, matrix))
+
+    @unittest.skipIf(simple_eval.numpy is None, "NumPy not installed")
+    def test_matrix_matches_eval_bool(self):
+        matrix = self.assignments()
+        for expr in self.expressions:
+            result = simple_eval.eval_bool_batch(expr, matrix, self.columns)
+            self.assertEqual(result.dtype, bool)
+            self.assertEqual(result.tolist(), self.expected(expr, matrix))
+
+    @unittest.skipIf(simple_eval.numpy is None, "NumPy not installed")
+    def test_matrix_result_is_a_copy(self):
+        matrix = simple_eval.numpy.array([[True], [False]])
+        result = simple_eval.eval_bool_batch("foo", matrix, ["foo"])
+        result[0] = False
+        self.assertTrue(matrix[0, 0])
+
+    def test_fallback_without_numpy(self):
+        matrix = self.assignments()
+        original = simple_eval.numpy
+        simple_eval.numpy = None
+        try:
+            result = simple_eval.eval_bool_batch("foo&bar", matrix,
+                                                 self.columns)
+        finally:
+            simple_eval.numpy = original
+        self.assertEqual(result, self.expected("foo&bar", matrix))
+
+    def test_duplicate_columns(self):
+        with self.assertRaises(ValueError):
+            simple_eval.compile_bool("foo").evaluate_rows([[True, True]],
+                                                          ["foo", "foo"])
+
+    def test_bad_input(self):
+        with self.assertRaisesRegex(ValueError, "Invalid token & at position 2"):
+            simple_eval.eval_bool_batch("a&&b", [[True]], ["a"])
+
+
+class TestLimits(unittest.TestCase):
+
+    def test_max_length(self):
+        limits = simple_eval.EvalLimits(max_length=5)
+        self.assertTrue(simple_eval.eval_bool("a|b", ("a",), limits))
+        with self.assertRaisesRegex(simple_eval.LimitError, "max_length of 5"):
+            simple_eval.eval_bool("a|bcdef", ("a",), limits)
+
+    def test_max_tokens(self):
+        limits = simple_eval.EvalLimits(max_tokens=3)
+        self.assertTrue(simple_eval.eval_bool("a|b", ("a",), limits))
+        with self.assertRaisesRegex(simple_eval.LimitError,
+                                    "max_tokens of 3 at position 3"):
+            simple_eval.eval_bool("a|~(b)", ("a",), limits)
+
+    def test_max_depth(self):
+        limits = simple_eval.EvalLimits(max_depth=2)
+        self.assertTrue(simple_eval.eval_bool("((a))|(b)", ("a",), limits))
+        with self.assertRaisesRegex(simple_eval.LimitError,
+                                    "max_depth of 2 at position 2"):
+            simple_eval.eval_bool("(((a)))", ("a",), limits)
+
+    def test_max_steps(self):
+        limits = simple_eval.EvalLimits(max_steps=3)
+        self.assertTrue(simple_eval.eval_bool("a|b", ("a",), limits))
+        with self.assertRaisesRegex(simple_eval.LimitError, "max_steps of 3"):
+            simple_eval.eval_bool("(a|b)&c", ("a",), limits)
+
+    def test_limit_error_is_eval_error(self):
+        with self.assertRaises(simple_eval.EvalError):
+            simple_eval.eval_bool("a|b", (),
+                                  simple_eval.EvalLimits(max_length=1))
+
+    def test_syntax_errors_unchanged(self):
+        limits = simple_eval.EvalLimits(10, 10, 10, 10)
+        with self.assertRaisesRegex(ValueError, "Invalid token & at position 2"):
+            simple_eval.eval_bool("a&&b", (), limits)
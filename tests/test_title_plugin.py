@@ -2,7 +2,7 @@
 from twisted.trial import unittest
 from twisted.internet import task, defer
 from plugin import PluginRegistry
-from plugins.title_plugin import TitlePlugin, load, UrlCache
+from plugins.title_plugin import TitlePlugin, load, UrlCache, CacheStore
 
 
 class MockProtocol:
@@ -11,7 +11,7 @@ class MockProtocol:
         self.nickname = nickname
         self.sent = []
 
-    def msg(self, target, text):
+    def msg(self, target, text, priority=None):
         self.sent.append((target, text))
 
 
@@ -50,6 +50,15 @@ class TitlePluginLoadTests(unittest.TestCase):
         self.assertFalse(plugin._good_urls._reaper.running)
         self.assertFalse(plugin._bad_urls._reaper.running)
 
+    def test_unload_leaves_no_delayed_calls(self):
+        """Test that unload() stops the resolver's resolv.conf checks."""
+        plugin = TitlePlugin('title', self.registry, {})
+        plugin.load()
+        plugin._resolver.resolver
+        self.assertNotEqual(self.clock.getDelayedCalls(), [])
+        plugin.unload()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
     def test_default_max_title_length(self):
         """Test that max_title_length defaults to 200."""
         plugin = TitlePlugin('title', self.registry, {})
@@ -62,6 +71,63 @@ class TitlePluginLoadTests(unittest.TestCase):
         plugin.load()
         self.assertEqual(plugin._max_len, 100)
 
+    def test_cache_path_shares_store(self):
+        """Test that cache_path backs both caches with one sqlite store."""
+        plugin = TitlePlugin('title', self.registry,
+                             {'cache_path': self.mktemp()})
+        plugin.load()
+        self.addCleanup(plugin.unload)
+        self.assertIsNotNone(plugin._store)
+        self.assertIs(plugin._good_urls._store, plugin._bad_urls._store)
+        plugin._good_urls.update("http://example.com", "Example")
+        self.assertEqual(plugin.cache_stats()['good']['disk_size'], 1)
+        self.assertEqual(plugin.cache_stats()['bad']['disk_size'], 0)
+
+    def test_unload_keeps_late_lookups_working(self):
+        """Test that lookups finishing after unload() skip the closed store."""
+        path = self.mktemp()
+        plugin = TitlePlugin('title', self.registry, {'cache_path': path})
+        plugin.load()
+        plugin._good_urls.update("//example.com/", "Example")
+        plugin.unload()
+        plugin._good_urls.update("//example.com/late", "Late")
+        plugin._bad_urls.update("//example.com/gone", "miss")
+        self.assertEqual(plugin._good_urls.fetch("//example.com/late"), "Late")
+        self.assertEqual(plugin.cache_stats()['good']['disk_size'], 0)
+        store = CacheStore(self.clock, path)
+        self.addCleanup(store.close)
+        self.assertEqual(store.size("good"), 1)
+        self.assertEqual(store.size("bad"), 0)
+
+    def test_connection_pool_configured(self):
+        """Test that load() creates a tuned connection pool."""
+        plugin = TitlePlugin('title', self.registry, {
+            'max_persistent_per_host': 2, 'max_persistent': 8,
+            'idle_timeout': 30})
+        plugin.load()
+        self.addCleanup(plugin.unload)
+        self.assertEqual(plugin._pool.maxPersistentPerHost, 2)
+        self.assertEqual(plugin._pool.maxPersistent, 8)
+        self.assertEqual(plugin._pool.cachedConnectionTimeout, 30)
+        self.assertEqual(plugin.pool_stats(), {})
+
+    def test_unload_closes_connections(self):
+        """Test that unload() closes the cached connections."""
+        plugin = TitlePlugin('title', self.registry, {})
+        plugin.load()
+        closed = []
+        plugin._pool.closeCachedConnections = lambda: closed.append(True)
+        plugin.unload()
+        self.assertEqual(closed, [True])
+
+    def test_memory_only_by_default(self):
+        """Test that without cache_path nothing is written to disk."""
+        plugin = TitlePlugin('title', self.registry, {'cache_size': 10})
+        plugin.load()
+        self.addCleanup(plugin.unload)
+        self.assertIsNone(plugin._store)
+        self.assertEqual(plugin.cache_stats()['good']['max_size'], 10)
+
 
 class TitlePluginPrivmsgTests(unittest.TestCase):
     """Tests for TitlePlugin.on_privmsg handler."""
@@ -100,7 +166,8 @@ class TitlePluginPrivmsgTests(unittest.TestCase):
         """Test that public messages reply to the channel."""
 
         class CapturingMessageHandler:
-            def __init__(self, reactor, hits, misses, callback, max_len):
+            def __init__(self, reactor, hits, misses, callback, max_len,
+                         **kwargs):
                 self._callback = callback
 
             async def find_links(self, message):
@@ -121,7 +188,8 @@ class TitlePluginPrivmsgTests(unittest.TestCase):
         replies = []
 
         class CapturingMessageHandler:
-            def __init__(self, reactor, hits, misses, callback, max_len):
+            def __init__(self, reactor, hits, misses, callback, max_len,
+                         **kwargs):
                 self._callback = callback
 
             async def find_links(self, message):
@@ -148,7 +216,8 @@ class TitlePluginPrivmsgTests(unittest.TestCase):
     def test_on_privmsg_public_channel_target(self):
         """Test that public channel messages reply to the channel."""
         class CapturingMessageHandler:
-            def __init__(self, reactor, hits, misses, callback, max_len):
+            def __init__(self, reactor, hits, misses, callback, max_len,
+                         **kwargs):
                 self._callback = callback
 
             async def find_links(self, message):
@@ -171,6 +240,52 @@ class TitlePluginPrivmsgTests(unittest.TestCase):
         finally:
             title_plugin.MessageHandler = original
 
+    def test_on_privmsg_shares_in_flight_fetches(self):
+        """Test that every message handler joins the plugin's fetches."""
+        seen = []
+
+        class RecordingMessageHandler:
+            def __init__(self, *args, **kwargs):
+                seen.append(kwargs)
+
+            async def find_links(self, message):
+                pass
+
+        import plugins.title_plugin as title_plugin
+        original = title_plugin.MessageHandler
+        title_plugin.MessageHandler = RecordingMessageHandler
+        try:
+            for channel in ('#a', '#b'):
+                self.plugin.on_privmsg(
+                    self.protocol, 'nick!user@host', channel,
+                    'http://example.com')
+        finally:
+            title_plugin.MessageHandler = original
+        for kwargs in seen:
+            self.assertIs(kwargs['in_flight'], self.plugin._in_flight)
+            self.assertIs(kwargs['limiter'], self.plugin._fetch_limiter)
+            self.assertEqual(kwargs['max_parallel'], 4)
+
+    def test_fetch_caps_configurable(self):
+        """Test that the per-message and global fetch caps are read."""
+        plugin = TitlePlugin('title', self.registry, {
+            'max_parallel_per_message': 2, 'max_parallel_fetches': 8})
+        plugin.load()
+        self.addCleanup(plugin.unload)
+        self.assertEqual(plugin._max_parallel, 2)
+        self.assertEqual(plugin._fetch_limiter.limit, 8)
+
+    def test_blocklist_configurable(self):
+        """Test that configured ranges are blocked along with the defaults."""
+        plugin = TitlePlugin('title', self.registry, {
+            'blocklist': ['203.0.113.0/24', '2001:db8::/32']})
+        plugin.load()
+        self.addCleanup(plugin.unload)
+        self.assertIn('203.0.113.9', plugin._blocklist)
+        self.assertIn('2001:db8::1', plugin._blocklist)
+        self.assertIn('127.0.0.1', plugin._blocklist)
+        self.assertNotIn('198.51.100.1', plugin._blocklist)
+
     def test_on_privmsg_errors_are_caught(self):
         """Test that errors from MessageHandler do not propagate uncaught."""
         class FailingMessageHandler: